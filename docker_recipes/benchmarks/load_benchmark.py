@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark of a synthetic benchmarking event, without Docker.
+
+The script generates an event (a gold standard per challenge and the predictions
+of every participant) and runs, for each participant, the commands main.nf
+issues in its task directory:
+
+    validation.py             -> validated_result.json
+    compute_metrics.py        -> assessment_results.json
+    aggregation.py            -> <results>/<challenge>/..., Manifest.json
+    merge_data_model_files.py -> consolidated_result.json
+
+Participants run concurrently, each in a fresh interpreter per stage as in the
+pipeline; the consolidations share one results directory (aggregation.py
+--shared_outdir), as the runs of an event do. The stage scripts are taken from
+this source tree, or from a flat image-like directory with --app_dir. When
+JSON_templates is not installed, the stand-in in stubs/ is used.
+
+It reports per-stage latency percentiles, the peak memory (max RSS) of each
+stage, and the event throughput. With --baseline (a report written earlier with
+--output) it fails when a stage got slower or bigger, or the throughput lower,
+than the baseline by more than --tolerance, so it can be used as a regression gate.
+
+Usage:
+    python3 load_benchmark.py [-n PARTICIPANTS] [-c CHALLENGES] [--cases N] [-j CONCURRENCY]
+                              [--output report.json] [--baseline report.json [--tolerance 0.25]]
+"""
+import csv
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+RECIPES_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+STUBS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "stubs")
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(RECIPES_DIR), "input_data", "minimal_aggregation_template.json")
+
+COMMUNITY_ID = "EuCanImage"
+EVENT_ID = "LOAD"
+
+# stage name -> (recipe directory, script), in the order of main.nf
+STAGES = {
+    "validation": ("validation", "validation.py"),
+    "metrics": ("metrics", "compute_metrics.py"),
+    "aggregation": ("consolidation", "aggregation.py"),
+    "merge": ("consolidation", "merge_data_model_files.py"),
+}
+
+PERCENTILES = (50, 90, 99)
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--participants", type=int, default=20,
+                        help="Number of participants of the event (default: 20)")
+    parser.add_argument("-c", "--challenges", type=int, default=1,
+                        help="Number of challenges; every participant takes part in all (default: 1)")
+    parser.add_argument("--cases", type=int, default=500,
+                        help="Number of cases (images) of each challenge (default: 500)")
+    parser.add_argument("-j", "--concurrency", type=int, default=4,
+                        help="Number of participants processed at the same time (default: 4)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the synthetic event (default: 0)")
+    parser.add_argument("-t", "--template", default=DEFAULT_TEMPLATE,
+                        help="Aggregation template (default: input_data/minimal_aggregation_template.json)")
+    parser.add_argument("--app_dir",
+                        help="Run the stage scripts from this flat directory (as /app in the images)\n"
+                             "instead of the source tree")
+    parser.add_argument("-w", "--workdir",
+                        help="Directory for the event and the task directories, kept afterwards\n"
+                             "(default: a temporary directory, removed afterwards unless a stage failed)")
+    parser.add_argument("--output",
+                        help="Write the report as JSON to this file (usable as a later --baseline)")
+    parser.add_argument("--baseline",
+                        help="Report of an earlier run to compare with; exit with an error on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative regression against the baseline (default: 0.25)")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the report as JSON instead of a table")
+    return parser
+
+
+# -----------------------------------------------------------------------------
+# Synthetic event
+# -----------------------------------------------------------------------------
+
+def generate_event(workdir, participants, challenges, cases, seed):
+    '''
+    Write the gold standard of each challenge (<workdir>/goldstandard/<challenge>/gt.csv), cases images
+    of its own, and the predictions of each participant for the images of all challenges
+    (<workdir>/predictions/<participant>.csv), each scored against the labels of its challenge.
+    Participants differ in how well their scores separate the classes.
+    Returns (challenge ids, {participant id: predictions path}, gold-standard directory).
+    '''
+    rng = random.Random(seed)
+    challenge_ids = [f"LOAD_C{c + 1}" for c in range(challenges)]
+
+    gt_dir = os.path.join(workdir, "goldstandard")
+    goldstandards = {}
+    for challenge_id in challenge_ids:
+        images = [f"{challenge_id}_image_{i + 1}" for i in range(cases)]
+        labels = [rng.randint(0, 1) for _ in images]
+        goldstandards[challenge_id] = list(zip(images, labels))
+        os.makedirs(os.path.join(gt_dir, challenge_id), exist_ok=True)
+        with open(os.path.join(gt_dir, challenge_id, "gt.csv"), mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["image", "label"])
+            writer.writerows(goldstandards[challenge_id])
+
+    pred_dir = os.path.join(workdir, "predictions")
+    os.makedirs(pred_dir, exist_ok=True)
+    predictions = {}
+    for p in range(participants):
+        participant_id = f"load_tool{p + 1}"
+        skill = rng.uniform(0.5, 2.5)
+        path = os.path.join(pred_dir, f"{participant_id}.csv")
+        with open(path, mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["image", "predicted_probability", "predicted_label"])
+            for challenge_id in challenge_ids:
+                for image, label in goldstandards[challenge_id]:
+                    score = 1 / (1 + pow(2.718281828459045, -(skill * (2 * label - 1) + rng.gauss(0, 1))))
+                    writer.writerow([image, score, int(score >= 0.5)])
+        predictions[participant_id] = path
+    return challenge_ids, predictions, gt_dir
+
+
+# -----------------------------------------------------------------------------
+# Stage runner
+# -----------------------------------------------------------------------------
+
+def stage_env():
+    '''
+    Environment of the stage processes: the JSON_templates stand-in is added to PYTHONPATH
+    when the real module is not installed.
+    '''
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    # the stand-in may already be on sys.path here (e.g. under pytest), but not in the stage processes
+    spec = importlib.util.find_spec("JSON_templates")
+    if spec is None or os.path.dirname(os.path.realpath(spec.origin)) == STUBS_DIR:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [STUBS_DIR, env.get("PYTHONPATH")]))
+    return env
+
+
+def script_path(stage, app_dir=None):
+    recipe_dir, script = STAGES[stage]
+    return os.path.join(app_dir, script) if app_dir else os.path.join(RECIPES_DIR, recipe_dir, script)
+
+
+def exit_code(status):
+    # os.waitstatus_to_exitcode needs Python 3.9
+    return os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+
+def max_rss_mb(rusage):
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_stage(args, cwd, env, log_path):
+    '''
+    Run a stage command in cwd, its output going to log_path.
+    Returns (wall seconds, peak memory in MB, exit code).
+    '''
+    with open(log_path, mode='ab') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable] + args, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 rather than wait, for the resource usage of this very process
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    proc.returncode = exit_code(status)
+    return wall, max_rss_mb(rusage), proc.returncode
+
+
+def stage_commands(participant_id, predictions, challenge_ids, gt_dir, results_dir, template, app_dir):
+    '''
+    The commands of main.nf for one participant, run in its task directory.
+    '''
+    return [
+        ("validation", [script_path("validation", app_dir), "-i", predictions, "-com", COMMUNITY_ID,
+                        "-c"] + challenge_ids + ["-e", EVENT_ID, "-p", participant_id, "-g", gt_dir]),
+        ("metrics", [script_path("metrics", app_dir), "-i", predictions, "-c"] + challenge_ids +
+                    ["-e", EVENT_ID, "-g", gt_dir, "-p", participant_id, "-com", COMMUNITY_ID,
+                     "-o", "assessment_results.json"]),
+        ("aggregation", [script_path("aggregation", app_dir), "-a", "assessment_results.json", "-e", EVENT_ID,
+                         "-o", results_dir, "-t", template, "--shared_outdir"]),
+        ("merge", [script_path("merge", app_dir), "-m", "assessment_results.json", "-v", "validated_result.json",
+                   "-c"] + challenge_ids + ["-a", results_dir, "-o", "consolidated_result.json"]),
+    ]
+
+
+def run_participant(participant_id, commands, task_dir, env):
+    '''
+    Run the stages of one participant in order, stopping at the first failure (as Nextflow does).
+    Returns a list of (stage, wall seconds, peak MB, exit code).
+    '''
+    os.makedirs(task_dir, exist_ok=True)
+    log_path = os.path.join(task_dir, "stages.log")
+    samples = []
+    for stage, args in commands:
+        wall, rss, code = run_stage(args, task_dir, env, log_path)
+        samples.append((stage, wall, rss, code))
+        if code != 0:
+            print(f"ERROR: {stage} of {participant_id} exited with {code}, see {log_path}", file=sys.stderr)
+            break
+    return samples
+
+
+# -----------------------------------------------------------------------------
+# Report
+# -----------------------------------------------------------------------------
+
+def percentile(values, q):
+    '''
+    q-th percentile of values, linearly interpolated between the closest ranks.
+    '''
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    pos = (len(values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def summarize(walls, rss=None):
+    summary = {"n": len(walls)}
+    summary.update((f"p{q}_s", percentile(walls, q)) for q in PERCENTILES)
+    summary["max_s"] = max(walls, default=float("nan"))
+    if rss is not None:
+        summary["peak_rss_mb"] = max(rss, default=float("nan"))
+    return summary
+
+
+def missing_participants(results_dir, challenge_ids, participant_ids):
+    '''
+    Participants missing from the Manifest entry of each challenge (lost updates, failed runs).
+    '''
+    manifest_path = os.path.join(results_dir, "Manifest.json")
+    listed = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, mode='r', encoding="utf-8") as f:
+            listed = {obj["id"]: set(obj["participants"]) for obj in json.load(f)}
+    return {challenge_id: sorted(set(participant_ids) - listed.get(challenge_id, set()))
+            for challenge_id in challenge_ids
+            if set(participant_ids) - listed.get(challenge_id, set())}
+
+
+def build_report(options, samples, wall, missing):
+    stages = {}
+    for stage in STAGES:
+        runs = [s for participant in samples.values() for s in participant if s[0] == stage]
+        stages[stage] = summarize([s[1] for s in runs], [s[2] for s in runs])
+    end_to_end = [sum(s[1] for s in participant) for participant in samples.values()
+                  if len(participant) == len(STAGES) and all(s[3] == 0 for s in participant)]
+    return {
+        "participants": options.participants,
+        "challenges": options.challenges,
+        "cases": options.cases,
+        "concurrency": options.concurrency,
+        "wall_s": wall,
+        "throughput_per_min": 60 * len(end_to_end) / wall if wall > 0 else float("nan"),
+        "failed": sorted(pid for pid, participant in samples.items() if any(s[3] != 0 for s in participant)),
+        "missing_from_manifest": missing,
+        "stages": stages,
+        "end_to_end": summarize(end_to_end),
+    }
+
+
+def print_table(report):
+    print(f"{report['participants']} participants x {report['challenges']} challenge(s) x "
+          f"{report['cases']} cases, concurrency {report['concurrency']}")
+    header = f"{'stage':<12} {'runs':>5} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'peak RSS':>10}"
+    print(header)
+    print("-" * len(header))
+    for stage, s in list(report["stages"].items()) + [("end-to-end", report["end_to_end"])]:
+        rss = f"{s['peak_rss_mb']:>8.1f}MB" if "peak_rss_mb" in s else f"{'':>10}"
+        print(f"{stage:<12} {s['n']:>5} {s['p50_s']:>8.2f}s {s['p90_s']:>8.2f}s {s['p99_s']:>8.2f}s "
+              f"{s['max_s']:>8.2f}s {rss}")
+    print(f"\nwall time {report['wall_s']:.1f}s, throughput {report['throughput_per_min']:.1f} participants/min")
+    if report["failed"]:
+        print(f"failed: {', '.join(report['failed'])}")
+    for challenge_id, participants in report["missing_from_manifest"].items():
+        print(f"missing from the Manifest of {challenge_id}: {', '.join(participants)}")
+
+
+def regressions(report, baseline, tolerance):
+    '''
+    Messages describing where report is worse than baseline by more than tolerance.
+    '''
+    found = []
+    limit = 1 + tolerance
+    for stage, base in baseline.get("stages", {}).items():
+        current = report["stages"].get(stage)
+        if not current:
+            continue
+        for key in [f"p{q}_s" for q in PERCENTILES[:2]] + ["peak_rss_mb"]:
+            if base.get(key, 0) > 0 and current[key] > base[key] * limit:
+                found.append(f"{stage} {key}: {current[key]:.3f} > {base[key]:.3f} (+{tolerance:.0%})")
+    base = baseline.get("throughput_per_min", 0)
+    if base > 0 and report["throughput_per_min"] < base / limit:
+        found.append(f"throughput_per_min: {report['throughput_per_min']:.2f} < {base:.2f} (-{tolerance:.0%})")
+    return found
+
+
+def main(options):
+    workdir = options.workdir or tempfile.mkdtemp(prefix="load_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    report = None
+    try:
+        challenge_ids, predictions, gt_dir = generate_event(
+            workdir, options.participants, options.challenges, options.cases, options.seed)
+        results_dir = os.path.join(workdir, "results")
+        template = os.path.abspath(options.template)
+        env = stage_env()
+
+        samples = {}
+        lock = threading.Lock()
+
+        def task(participant_id):
+            commands = stage_commands(participant_id, predictions[participant_id], challenge_ids, gt_dir,
+                                      results_dir, template, options.app_dir)
+            result = run_participant(participant_id, commands, os.path.join(workdir, "work", participant_id), env)
+            with lock:
+                samples[participant_id] = result
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+            list(pool.map(task, predictions))
+        wall = time.perf_counter() - start
+
+        report = build_report(options, samples, wall, missing_participants(results_dir, challenge_ids, predictions))
+    finally:
+        # a temporary workdir is kept when something failed, for the stage logs
+        if not options.workdir:
+            if report is not None and not report["failed"]:
+                shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                print(f"INFO: kept {workdir} for inspection", file=sys.stderr)
+
+    if options.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_table(report)
+    if options.output:
+        with open(options.output, mode='w', encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    problems = [f"{len(report['failed'])} participant(s) failed"] if report["failed"] else []
+    if report["missing_from_manifest"]:
+        problems.append("participants missing from the Manifest")
+    if options.baseline:
+        with open(options.baseline, mode='r', encoding="utf-8") as f:
+            problems += regressions(report, json.load(f), options.tolerance)
+    if problems:
+        sys.exit("ERROR: " + "\n       ".join(problems))
+    return report
+
+
+if __name__ == '__main__':
+    main(parse_arguments().parse_args())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Start-up time benchmark for the three container stages.
+
+Every Nextflow task starts a fresh interpreter, so the cost of importing the
+stage script and its dependencies is paid once per submission. For each stage
+this script measures, in fresh interpreters:
+
+- the bare interpreter start-up,
+- importing the entry-point module (what `--help` or a bad argument costs),
+- importing the heavy dependencies that the stage loads lazily on its work path,
+
+and reports the median over a number of runs. With `--top N` it also lists the
+N most expensive modules reported by `python -X importtime` for the full import.
+
+Usage:
+    python3 startup_benchmark.py [-r RUNS] [--top N] [--json]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+RECIPES_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# stage name -> (recipe directory, entry module, lazily loaded dependencies)
+STAGES = {
+    "validation": ("validation", "validation", ["pandas"]),
+    "metrics": ("metrics", "compute_metrics", ["numpy", "pandas", "sklearn.metrics"]),
+    "aggregation": ("consolidation", "aggregation", ["assessment_chart.assessment_chart"]),
+    "merge": ("consolidation", "merge_data_model_files", []),
+}
+
+TIMER = "import time; t = time.perf_counter(); {imports}; print(time.perf_counter() - t)"
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-r", "--runs", type=int, default=5,
+                        help="Number of fresh interpreters per measurement (default: 5)")
+    parser.add_argument("-s", "--stages", nargs="+", choices=sorted(STAGES), default=list(STAGES),
+                        help="Stages to measure (default: all)")
+    parser.add_argument("--top", type=int, default=0,
+                        help="Also list the N slowest modules of each stage's full import")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON instead of a table")
+    return parser
+
+
+def run_python(args, cwd):
+    '''
+    Run a fresh interpreter in cwd and return (wall seconds, completed process).
+    '''
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, cwd=cwd, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"`python {' '.join(args)}` failed in {cwd}:\n{proc.stderr}")
+    return wall, proc
+
+
+def time_imports(modules, cwd, runs):
+    '''
+    Median in-process time (seconds) of importing the given modules in a fresh interpreter.
+    '''
+    if not modules:
+        return 0.0
+    code = TIMER.format(imports="; ".join(f"import {m}" for m in modules))
+    samples = []
+    for _ in range(runs):
+        _, proc = run_python(["-c", code], cwd)
+        samples.append(float(proc.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def slowest_imports(modules, cwd, top):
+    '''
+    Parse `python -X importtime` output and return the top (cumulative us, module) entries.
+    '''
+    code = "; ".join(f"import {m}" for m in modules) or "pass"
+    _, proc = run_python(["-X", "importtime", "-c", code], cwd)
+    entries = []
+    # lines look like "import time:       self |  cumulative | <indent>package"
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # only report top-level entries of the import tree
+        if name.startswith("  "):
+            continue
+        entries.append((int(cumulative_us), name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def measure_stage(stage, runs, top):
+    recipe_dir, module, deps = STAGES[stage]
+    cwd = os.path.join(RECIPES_DIR, recipe_dir)
+
+    interpreter = statistics.median(run_python(["-c", "pass"], cwd)[0] for _ in range(runs))
+    entry = time_imports([module], cwd, runs)
+    full = time_imports([module] + deps, cwd, runs)
+
+    result = {
+        "stage": stage,
+        "module": module,
+        "interpreter_s": interpreter,
+        "entry_import_s": entry,
+        "deferred_imports_s": max(full - entry, 0.0),
+        "work_path_total_s": interpreter + full,
+    }
+    if top:
+        result["slowest_imports"] = [{"module": name, "cumulative_s": us / 1e6}
+                                     for us, name in slowest_imports([module] + deps, cwd, top)]
+    return result
+
+
+def print_table(results):
+    header = f"{'stage':<12} {'interpreter':>12} {'entry import':>13} {'deferred deps':>14} {'work path':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['stage']:<12} {r['interpreter_s'] * 1e3:>10.1f}ms {r['entry_import_s'] * 1e3:>11.1f}ms "
+              f"{r['deferred_imports_s'] * 1e3:>12.1f}ms {r['work_path_total_s'] * 1e3:>8.1f}ms")
+    for r in results:
+        if r.get("slowest_imports"):
+            print(f"\nslowest imports on the {r['stage']} work path:")
+            for entry in r["slowest_imports"]:
+                print(f"  {entry['cumulative_s'] * 1e3:>9.1f}ms  {entry['module']}")
+
+
+def main(options):
+    results = [measure_stage(stage, options.runs, options.top) for stage in options.stages]
+    if options.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print_table(results)
+    return results
+
+
+if __name__ == '__main__':
+    main(parse_arguments().parse_args())
@@ -0,0 +1,38 @@
+"""
+Stand-in for the OEB ``JSON_templates`` module, for running the stages outside the images.
+
+The images install it from the APAeval repository (see the stages' requirements.txt).
+Only the two functions the stages call are provided, and they build the same objects.
+load_benchmark.py puts this directory on PYTHONPATH when the real module is not installed.
+"""
+from datetime import datetime, timezone
+
+
+def write_participant_dataset(ID, community, challenges, participant_name, is_valid):
+    return {
+        "_id": ID,
+        "community_id": community,
+        "challenge_id": challenges,
+        "type": "participant",
+        "datalink": {
+            "attrs": ["archive"],
+            "validation_date": datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+            "status": "ok" if is_valid else "corrupted"
+        },
+        "participant_id": participant_name
+    }
+
+
+def write_assessment_dataset(ID, community, challenge, participant_name, metric, metric_value, error):
+    return {
+        "_id": ID,
+        "community_id": community,
+        "challenge_id": challenge,
+        "type": "assessment",
+        "metrics": {
+            "metric_id": metric,
+            "value": metric_value,
+            "stderr": error
+        },
+        "participant_id": participant_name
+    }
@@ -0,0 +1,53 @@
+import csv
+import json
+
+import pytest
+
+import load_benchmark
+
+
+def options(tmp_path, *args):
+    return load_benchmark.parse_arguments().parse_args(
+        ["-n", "2", "-c", "2", "--cases", "40", "-j", "2", "-w", str(tmp_path / "work"), "--json"] + list(args))
+
+
+def test_predictions_are_scored_against_their_own_challenge(tmp_path):
+    challenge_ids, predictions, gt_dir = load_benchmark.generate_event(str(tmp_path), 2, 2, 30, seed=0)
+    labels = {}
+    for challenge_id in challenge_ids:
+        with open(f"{gt_dir}/{challenge_id}/gt.csv", newline='') as f:
+            labels.update((row["image"], int(row["label"])) for row in csv.DictReader(f))
+    for path in predictions.values():
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        assert [row["image"] for row in rows] == list(labels)
+        # every participant is better than chance on the labels of each image's challenge
+        right = sum(int(row["predicted_label"]) == labels[row["image"]] for row in rows)
+        assert right / len(rows) > 0.6
+
+
+def test_baseline_gate_reports_regressions():
+    report = {"stages": {"metrics": {"p50_s": 1.0, "p90_s": 1.2, "peak_rss_mb": 100.0}}, "throughput_per_min": 10.0}
+    baseline = {"stages": {"metrics": {"p50_s": 0.5, "p90_s": 1.1, "peak_rss_mb": 100.0}}, "throughput_per_min": 20.0}
+    found = load_benchmark.regressions(report, baseline, 0.25)
+    assert [message.split(":")[0] for message in found] == ["metrics p50_s", "throughput_per_min"]
+    assert load_benchmark.regressions(report, report, 0.25) == []
+
+
+def test_event_runs_every_stage_of_every_participant(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"throughput_per_min": 1e9}))
+    # the report is written before the regression fails the run
+    with pytest.raises(SystemExit, match="throughput_per_min"):
+        load_benchmark.main(options(tmp_path, "--output", str(tmp_path / "report.json"), "--baseline", str(baseline)))
+    with open(tmp_path / "report.json") as f:
+        report = json.load(f)
+    assert json.loads(capsys.readouterr().out) == report
+
+    assert report["failed"] == [] and report["missing_from_manifest"] == {}
+    assert {stage: s["n"] for stage, s in report["stages"].items()} == dict.fromkeys(load_benchmark.STAGES, 2)
+    assert report["end_to_end"]["n"] == 2
+    with open(tmp_path / "work" / "results" / "Manifest.json") as f:
+        manifest = json.load(f)
+    assert {obj["id"]: sorted(obj["participants"]) for obj in manifest} == {
+        "LOAD_C1": ["load_tool1", "load_tool2"], "LOAD_C2": ["load_tool1", "load_tool2"]}
@@ -13,8 +13,12 @@ if [ $# -gt 0 ]; then
 	tag_id="$1"
 
 	for docker_name in validation metrics consolidation ; do
-		docker build -t "$COMMUNITY_LABEL"/"$docker_name":"$tag_id" "$docker_name"
+		# the OEB schema checks are shared by all stage images (needs BuildKit)
+		docker buildx build --load --build-context oeb_schemas=oeb_schemas -t "$COMMUNITY_LABEL"/"$docker_name":"$tag_id" "$docker_name"
 	done
+
+	# The pipeline image bundles all stages, so its build context is this directory
+	docker build -t "$COMMUNITY_LABEL"/pipeline:"$tag_id" -f pipeline/Dockerfile .
 else
 	echo "Usage: $0 tag_id" 1>&2
 	exit 1
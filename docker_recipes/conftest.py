@@ -0,0 +1,18 @@
+'''
+Test set-up: the stage modules import each other flat, as in the images
+(see pipeline/stages.py), and JSON_templates comes from benchmarks/stubs
+when the evaluation environment does not provide it.
+'''
+import importlib.util
+import os
+import sys
+
+RECIPES_DIR = os.path.dirname(os.path.realpath(__file__))
+
+for stage_dir in ("oeb_schemas", "validation", "metrics", "consolidation", "pipeline", "benchmarks"):
+    path = os.path.join(RECIPES_DIR, stage_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+if importlib.util.find_spec("JSON_templates") is None:
+    sys.path.append(os.path.join(RECIPES_DIR, "benchmarks", "stubs"))
@@ -1,11 +1,22 @@
-
 import os
-import json
+import sys
 import logging
 from copy import deepcopy
 from enum import Enum
 from argparse import ArgumentParser, RawTextHelpFormatter
-from assessment_chart import assessment_chart
+
+# shared OEB modules: in the images they are copied to /app, in a source checkout they are in ../oeb_schemas
+SCHEMAS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "oeb_schemas")
+if SCHEMAS_DIR not in sys.path:
+    sys.path.append(SCHEMAS_DIR)
+import oeb_json
+import profiling
+import storage
+from oeb_validation import check_oeb_objects
+import participant_store
+from participant_store import ParticipantStore
+# assessment_chart (and with it matplotlib) is imported lazily by
+# render_charts(), only when there is something to plot.
 
 
 class Visualisations(Enum):
@@ -14,6 +25,8 @@ class Visualisations(Enum):
     """
     BARPLOT = "bar-plot"
     TWODPLOT = "2D-plot"
+    SIGNIFICANCE = "significance-heatmap"
+    LEADERBOARD = "leaderboard"
 
 
 def parse_arguments():
@@ -48,6 +61,59 @@ def parse_arguments():
         #    os.path.realpath(__file__)), "aggregation_aggregation_template.json"),
         required=True
     )
+    parser.add_argument(
+        "--cases_dir",
+        help="directory with the per-case tables (<challenge>/<participant>.csv) written by compute_metrics.py --cases_dir;\n"
+             "if given, participants are compared with paired permutation tests, and the case analytics of\n"
+             "the outcome matrices (<challenge>/outcomes) are written to <challenge>/cases_report.json"
+    )
+    parser.add_argument(
+        "--significance_metrics",
+        nargs="+",
+        help="metrics to test (default: every assessed metric the tests support)"
+    )
+    parser.add_argument(
+        "--permutations",
+        type=int,
+        default=10000,
+        help="number of permutations per participant pair (default: 10000)"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed of the permutation tests (default: 0)"
+    )
+    parser.add_argument(
+        "--checkpoint_budget",
+        type=float,
+        default=0.01,
+        help="fraction of the permutation tests' run time that may be spent saving their progress\n"
+             "to <outdir>/<challenge>/.checkpoints, from where a restarted task resumes (default: 0.01, 0: off)"
+    )
+    parser.add_argument(
+        "--chart_format",
+        choices=["svg", "png", "webp"],
+        default="svg",
+        help="file format of the charts (default: svg); above 50 participants charts are drawn in\n"
+             "large-scale mode (rasterised points, no legend, best participants labelled)"
+    )
+    parser.add_argument(
+        "--tier",
+        type=int,
+        choices=[1, 2],
+        help="progressive results: 1 = provisional aggregation of the tier 1 assessments, without\n"
+             "permutation tests or charts; 2 = final results, atomically replacing the provisional ones\n"
+             "(default: final results without tier markers)"
+    )
+    parser.add_argument(
+        "--shared_outdir",
+        action="store_true",
+        help="outdir is shared by concurrent consolidations of other participants: add the participant\n"
+             "to the aggregation files and Manifest already there instead of starting from the template\n"
+             "(see storage.py; writes are atomic and per-challenge locked either way)"
+    )
+    profiling.add_arguments(parser)
     return parser
 
 
@@ -71,8 +137,8 @@ def main(options):
     logging.info(f"Assessment data: {assessment_data}")
 
     # Assuring the output directory for participant does exist
-    if not os.path.exists(outdir):
-        os.makedirs(outdir)
+    # (concurrent runs in a shared outdir may create it at the same time)
+    os.makedirs(outdir, exist_ok=True)
 
     ########################################################
     # 1. Get assesment (=metrics) for current participant
@@ -81,76 +147,149 @@ def main(options):
     # Load info from assessment file into dict of challenges with dicts of metric IDs
     community_id, participant_id, challenges = get_metrics_per_challenge(
         assessment_data)
+
+    # 2. Aggregation file(s), per-challenge assessments and plots
+    manifest, _ = aggregate_challenges(
+        community_id, participant_id, challenges, outdir, event, aggregation_template,
+        cases_dir=options.cases_dir, significance_metrics=options.significance_metrics,
+        permutations=options.permutations, seed=options.seed, checkpoint_budget=options.checkpoint_budget,
+        chart_format=options.chart_format, tier=options.tier, shared_outdir=options.shared_outdir)
+
+    # After we have updated all aggregation files for all challenges, save the summary manifest
+    # (a shared outdir's Manifest has been updated challenge by challenge)
+    if not options.shared_outdir:
+        oeb_json.dump_tier(manifest, os.path.join(outdir, "Manifest.json"), options.tier)
+
+
+# Function definitions
+def aggregate_challenges(community_id, participant_id, challenges, outdir, event, aggregation_template,
+                         cases_dir=None, significance_metrics=None, permutations=10000, seed=0,
+                         checkpoint_budget=0.01, chart_format="svg", tier=None, shared_outdir=False):
+    '''
+    Build, write and plot the aggregation objects of every challenge of a participant.
+    Input:
+    community_id, participant_id, challenges: as returned by get_metrics_per_challenge / group_assessments
+    outdir: output directory; one sub-directory per challenge is written
+    event: benchmarking event id
+    aggregation_template: path to the aggregation template
+    cases_dir, significance_metrics, permutations, seed, checkpoint_budget: optional permutation tests, see add_significance
+    chart_format: file format of the charts (svg, png or webp)
+    tier: progressive results tier (see oeb_json.dump_tier); tier 1 skips the permutation tests and charts
+    shared_outdir: start from the aggregation files in outdir (if any) rather than the template, so that
+    concurrent consolidations of the same challenge add up (see storage.update), and merge each
+    challenge's entry into outdir/Manifest.json as its aggregation is written
+    Returns:
+    manifest: list of manifest objects, one per challenge
+    aggregations: dict of challenge id -> list of aggregation objects
+    '''
     # Get a list of challenge ids
     challenges_ids = list(challenges.keys())
-    # Get a list of metrics ids, as those change depending on the window sizes specified for compute_metrics.py
-    metrics_ids = list(challenges[challenges_ids[0]].keys())
 
-    logging.debug(
-        f"Participant {participant_id}, challenges {challenges}, challenges_ids {challenges_ids}, metrics_ids {metrics_ids}")
+    logging.debug(f"Participant {participant_id}, challenges {challenges}, challenges_ids {challenges_ids}")
 
     ########################################################
     # 2. Handle aggregation file(s)
     # Loop over challenges IDs, for each challenge:
-    # a) start fresh with the provided template
+    # a) start fresh with the provided template (or the aggregation file of a shared outdir)
     # b) add current participant's metrics to aggregation
-    # c) write aggregation file
+    # c) write aggregation file, under the challenge's lock unless it changed meanwhile
     # d) split up assessments into challenges dirs
     # e) store info for summary file (manifest)
     ########################################################
 
     # Store info for summary file
     manifest = []
+    aggregations = {}
+    # participant stores (participant_store.py) of the challenges, as last built
+    stores = {}
 
     for challenge_id in challenges_ids:
 
         challenge_id_results = challenge_id.replace('.', '_')
         challenge_dir = os.path.join(outdir, challenge_id_results)
-
-        if not os.path.exists(challenge_dir):
-            os.makedirs(challenge_dir)
-
-        # 2.a) Load the aggregation template file
-        aggregation = load_aggregation_template(
-            aggregation_template, community_id, event, challenge_id, metrics_ids)
-
-        # if something else than the file missing went wrong
-        logging.debug(f"aggregation on load: {aggregation}")
-
-        # 2.b) Add the current participant's metrics to the aggregation for the current challenge_id
-        new_aggregation = add_to_aggregation(
-            aggregation, participant_id, challenges[challenge_id])
-
-        logging.debug(f"aggregation after update: {new_aggregation}")
+        # metrics ids of the challenge: they differ between classification and segmentation challenges
+        metrics_ids = list(challenges[challenge_id].keys())
+
+        os.makedirs(challenge_dir, exist_ok=True)
+
+        def build(existing, challenge_id=challenge_id, challenge_dir=challenge_dir, metrics_ids=metrics_ids):
+            # 2.a) Load the aggregation template file, or the current aggregation of a shared outdir;
+            # the participants of the plots come from the challenge's participant store
+            if shared_outdir and existing is not None:
+                aggregation = existing
+                if os.path.isfile(participant_store.store_file(challenge_dir)):
+                    store = ParticipantStore.open(challenge_dir, mmap=False)
+                else:  # written before the participant store existed
+                    store = ParticipantStore.from_aggregation(aggregation)
+            else:
+                aggregation = load_aggregation_template(
+                    aggregation_template, community_id, event, challenge_id, metrics_ids)
+                store = ParticipantStore.from_aggregation(aggregation)
+            stores[challenge_id] = store
+
+            # if something else than the file missing went wrong
+            logging.debug(f"aggregation on load: {aggregation}")
+            check_oeb_objects(aggregation)
+
+            # 2.b) Add the current participant's metrics to the aggregation for the current challenge_id
+            new_aggregation = add_to_aggregation(
+                aggregation, participant_id, challenges[challenge_id], store)
+
+            logging.debug(f"aggregation after update: {new_aggregation}")
+            # only the participants changed since the full check above
+            check_oeb_objects(new_aggregation, fields=["datalink.inline_data.challenge_participants"])
+
+            # 2.b') Compare all participants with per-case tables by permutation tests
+            if cases_dir and tier != oeb_json.PROVISIONAL_TIER:
+                # tests of an earlier run are replaced by those over the current participants
+                new_aggregation = [item for item in new_aggregation
+                                   if item["datalink"]["inline_data"]["visualization"]["type"] != Visualisations.SIGNIFICANCE.value]
+                checked = len(new_aggregation)
+                add_significance(new_aggregation, community_id, event, challenge_id, cases_dir,
+                                 significance_metrics or metrics_ids, permutations, seed,
+                                 checkpoint_dir=os.path.join(challenge_dir, ".checkpoints"),
+                                 checkpoint_budget=checkpoint_budget)
+                check_oeb_objects(new_aggregation[checked:])
+            return new_aggregation
+
+        def commit(new_aggregation, challenge_id=challenge_id, challenge_dir=challenge_dir):
+            store = stores[challenge_id]
+            store.save(challenge_dir, tier)
+
+            # 2.d) Write assessments per challenge to local results dir
+            # We have stored the assessment json objects for each challenge in the challenges dict
+            challenge_assessments = []
+            for metric, ass_json in challenges[challenge_id].items():
+                challenge_assessments.append(ass_json)
+
+            assessment_file = os.path.join(challenge_dir, participant_id + ".json")
+            oeb_json.dump_tier(challenge_assessments, assessment_file, tier)
+
+            # Create plots for current challenge (final results only)
+            if tier != oeb_json.PROVISIONAL_TIER:
+                render_charts(challenge_dir, new_aggregation, challenge_id, chart_format, store)
+
+            # Case difficulty, consensus and agreement, from the participants x cases outcome matrix
+            if cases_dir and tier != oeb_json.PROVISIONAL_TIER:
+                from case_analytics import write_case_report
+                write_case_report(challenge_dir, cases_dir, challenge_id, tier)
+
+            # in a shared outdir the Manifest entry must follow the aggregation it lists
+            if shared_outdir:
+                storage.merge_manifest([{"id": challenge_id, "participants": store.participants().tolist()}],
+                                       os.path.join(outdir, "Manifest.json"), tier)
 
         # 2.c) Write aggregation in a file.
         aggregation_file = os.path.join(
             challenge_dir, challenge_id_results + ".json")
-        # Create others aggregations in one file
-        with open(aggregation_file, mode='w', encoding="utf-8") as f:
-            json.dump(new_aggregation, f, sort_keys=True,
-                      indent=4, separators=(',', ': '))
-
-        # 2.d) Write assessments per challenge to local results dir
-        # We have stored the assessment json objects for each challenge in the challenges dict
-        challenge_assessments = []
-        for metric, ass_json in challenges[challenge_id].items():
-            challenge_assessments.append(ass_json)
-
-        assessment_file = os.path.join(challenge_dir, participant_id + ".json")
-        with open(assessment_file, mode='w', encoding="utf-8") as f:
-            json.dump(challenge_assessments, f, sort_keys=True,
-                      indent=4, separators=(',', ': '))
+        # Create others aggregations in one file; the participant's assessments and the plots
+        # are written under the same lock
+        new_aggregation = storage.update(
+            aggregation_file, build, storage.challenge_lock_path(challenge_dir), tier, commit)
 
         # 2.e) store manifest object for current challenge
-        # For that, get a list of participants from aggregation
-        participants = []
-
-        # Already recorded participants
-        # Dirty: we're only looking at the first aggregation object, assuming the participants are the same for all objects (=plots)
-        print('HERE', new_aggregation)
-        for item in new_aggregation[0]["datalink"]["inline_data"]["challenge_participants"]:
-            participants.append(item["participant_id"])
+        # For that, get the list of participants from the participant store
+        participants = stores[challenge_id].participants().tolist()
 
         logging.debug(f"participants: {participants}")
 
@@ -159,30 +298,14 @@ def main(options):
             "participants": participants,
         }
 
+        check_oeb_objects([mani_obj])
         manifest.append(mani_obj)
 
-        # Create plots for current challenge
-        for aggr_object in new_aggregation:
-            # 2D-plots
-            if aggr_object["datalink"]["inline_data"]["visualization"]["type"] == Visualisations.TWODPLOT.value:
-                assessment_chart.print_chart(
-                    challenge_dir, aggr_object, challenge_id, "RAW")
-                assessment_chart.print_chart(
-                    challenge_dir, aggr_object, challenge_id, "SQR")
-                assessment_chart.print_chart(
-                    challenge_dir, aggr_object, challenge_id, "DIAG")
-            # barplots
-            elif aggr_object["datalink"]["inline_data"]["visualization"]["type"] == Visualisations.BARPLOT.value:
-                assessment_chart.print_barplot(
-                    challenge_dir, aggr_object, challenge_id)
+        aggregations[challenge_id] = new_aggregation
 
-    # After we have updated all aggregation files for all challenges, save the summary manifest
-    with open(os.path.join(outdir, "Manifest.json"), mode='w', encoding="utf-8") as f:
-        json.dump(manifest, f, sort_keys=True,
-                  indent=4, separators=(',', ': '))
+    return manifest, aggregations
 
 
-# Function definitions
 def get_metrics_per_challenge(assessment_data):
     '''
     From the assessment file collect all challenges and all metrics/assessments per challenge
@@ -204,22 +327,27 @@ def get_metrics_per_challenge(assessment_data):
         }
     }
     '''
-    # read assessment files
-    assessments = []
-    for ass in assessment_data:
-        with open(ass, mode='r', encoding="utf-8") as f:
-            a = json.load(f)
-        assessments.extend(a)
+    # stream the assessment objects of all files, one at a time
+    assessments = (a for ass in assessment_data for a in oeb_json.iter_objects(ass))
 
-    logging.debug(f"Assessments: {assessments}")
+    return group_assessments(assessments)
 
+
+def group_assessments(assessments):
+    '''
+    Group the assessment objects (list or iterable) of one participant by challenge and metric,
+    see get_metrics_per_challenge for the structure returned.
+    '''
     # initialize
     challenges = {}
-    participant_id = assessments[0]["participant_id"]
-    community_id = assessments[0]["community_id"]
+    participant_id = community_id = None
 
     # go through all assessment objects
     for item in assessments:
+        logging.debug(f"Assessment: {item}")
+        if participant_id is None:
+            participant_id = item["participant_id"]
+            community_id = item["community_id"]
 
         # make sure we're dealing with assessment objects
         assert_object_type(item, "assessment")
@@ -237,6 +365,85 @@ def get_metrics_per_challenge(assessment_data):
     return community_id, participant_id, challenges
 
 
+def add_significance(aggregation, community_id, event, challenge_id, cases_dir, metrics, permutations, seed,
+                     checkpoint_dir=None, checkpoint_budget=0.01):
+    '''
+    Append one significance-heatmap aggregation object per testable metric of a challenge.
+    Input:
+    aggregation: list of aggregation objects of the challenge, extended in place
+    cases_dir: directory with the per-case tables of all participants
+    metrics: metric ids to test; those without a permutation test are skipped
+    permutations, seed: number of permutations per pair and the fixed seed
+    checkpoint_dir, checkpoint_budget: where the tests save their progress, and the share of run time it may take
+    Returns:
+    aggregation
+    '''
+    from significance import METRICS, read_cases, significance_aggregation
+
+    cases = read_cases(cases_dir, challenge_id)
+    if len(cases) < 2:
+        logging.info(f"Challenge {challenge_id}: fewer than two participants with per-case tables, no permutation tests")
+        return aggregation
+    if not all({"label", "predicted_label", "predicted_probability"}.issubset(df.columns) for df in cases.values()):
+        logging.warning(f"Challenge {challenge_id}: permutation tests need binary per-case tables, skipped")
+        return aggregation
+
+    # the metrics the challenge's plots and leaderboard show should all be testable
+    shown = set()
+    for item in aggregation:
+        viz = item["datalink"]["inline_data"]["visualization"]
+        shown.update(viz[key] for key in ("metric", "x_axis", "y_axis") if key in viz)
+        shown.update(viz.get("metrics", []))
+
+    for metric in metrics:
+        if metric not in METRICS:
+            if metric in shown:
+                logging.warning(f"Challenge {challenge_id}: no permutation test for metric {metric}, not tested")
+            else:
+                logging.debug(f"No permutation test for metric {metric}")
+            continue
+        aggregation.append(significance_aggregation(
+            community_id, event, challenge_id, metric, cases, permutations, seed,
+            checkpoint_dir=checkpoint_dir, checkpoint_budget=checkpoint_budget))
+
+    if checkpoint_dir and os.path.isdir(checkpoint_dir) and not os.listdir(checkpoint_dir):
+        os.rmdir(checkpoint_dir)
+    return aggregation
+
+
+def render_charts(challenge_dir, aggregation, challenge_id, chart_format="svg", store=None):
+    '''
+    Draw the chart(s) of every aggregation object of a challenge into challenge_dir.
+    The plotting module is only imported when at least one object has to be drawn.
+    With the challenge's participant store, bar-plots and 2D-plots take their series from it.
+    '''
+    if not aggregation:
+        return
+
+    from assessment_chart import assessment_chart
+
+    for aggr_object in aggregation:
+        plot = aggr_object["datalink"]["inline_data"]["visualization"]
+        # 2D-plots
+        if plot["type"] == Visualisations.TWODPLOT.value:
+            series = store.series(plot["x_axis"], plot["y_axis"]) if store is not None else None
+            assessment_chart.print_chart(
+                challenge_dir, aggr_object, challenge_id, "RAW", chart_format, series)
+            assessment_chart.print_chart(
+                challenge_dir, aggr_object, challenge_id, "SQR", chart_format, series)
+            assessment_chart.print_chart(
+                challenge_dir, aggr_object, challenge_id, "DIAG", chart_format, series)
+        # barplots
+        elif plot["type"] == Visualisations.BARPLOT.value:
+            series = store.column(plot["metric"])[:2] if store is not None else None
+            assessment_chart.print_barplot(
+                challenge_dir, aggr_object, challenge_id, chart_format, series)
+        # significance heatmaps
+        elif plot["type"] == Visualisations.SIGNIFICANCE.value:
+            assessment_chart.print_significance_heatmap(
+                challenge_dir, aggr_object, challenge_id, chart_format)
+
+
 def assert_object_type(json_obj, curr_type):
     '''
     Check OEB json object type
@@ -253,13 +460,20 @@ def assert_object_type(json_obj, curr_type):
 
 #logging.info(f"Using event: {EVENT}")
 
+def read_aggregation_template(aggregation_template):
+    '''
+    Read the aggregation template JSON. The returned objects are only read, never modified,
+    so long-running callers may replace this function with a cached one.
+    '''
+    return oeb_json.load(aggregation_template)
+
+
 def load_aggregation_template(aggregation_template, community_id, event, challenge_id, metrics_ids):
     '''
     Load the aggregation template from the provided json file and set _id and challenge_id; create objects for all window sizes
     '''
 
-    with open(aggregation_template, mode='r', encoding="utf-8") as t:
-        template = json.load(t)
+    template = read_aggregation_template(aggregation_template)
 
     aggregation = []
 
@@ -305,6 +519,26 @@ def load_aggregation_template(aggregation_template, community_id, event, challen
                 win_item["datalink"]["inline_data"]["visualization"]["metric"] = y_win
                 aggregation.append(win_item)
 
+        # leaderboard: one object ranking the participants on all its metrics
+        elif viz["type"] == Visualisations.LEADERBOARD.value:
+            board = deepcopy(item)
+            # default: the metrics of the template's bar-plots
+            metrics = viz.get("metrics") or [t["datalink"]["inline_data"]["visualization"]["metric"] for t in template
+                                             if t["datalink"]["inline_data"]["visualization"]["type"] == Visualisations.BARPLOT.value]
+            ranked = [m for m in metrics if m in metrics_ids]
+            if not ranked:
+                # none of them is a metric of this challenge (e.g. a segmentation challenge): its bar-plots' metrics
+                ranked = list(dict.fromkeys(
+                    m for t in template if t["datalink"]["inline_data"]["visualization"]["type"] == Visualisations.BARPLOT.value
+                    for m in metrics_ids if t["datalink"]["inline_data"]["visualization"]["metric"] in m))
+            if not ranked:
+                logging.warning(f"Challenge {challenge_id}: no metrics to rank, no leaderboard")
+                continue
+            board["_id"] = base_id + "leaderboard"
+            board["challenges_ids"] = [challenge_id]
+            board["datalink"]["inline_data"]["visualization"]["metrics"] = ranked
+            aggregation.append(board)
+
         # someting wrong
         else:
             raise KeyError("Unknown plot type")
@@ -312,43 +546,67 @@ def load_aggregation_template(aggregation_template, community_id, event, challen
     return aggregation
 
 
-def add_to_aggregation(aggregation, participant_id, challenge):
+def add_to_aggregation(aggregation, participant_id, challenge, store=None):
     '''
     Add the metrics for the current challenge to the challenge's aggregation file. Aggregation file can have more than one aggregation object, one per plot type.
+    The participant is added to the challenge's participant store (by default, a store of the participants
+    already in the aggregation), from which the participants of the bar-plots and 2D-plots are regenerated.
+    '''
+    return add_participants_to_aggregation(aggregation, {participant_id: challenge}, store)
+
+
+def add_participants_to_aggregation(aggregation, participants, store=None):
+    '''
+    Add the metrics of several participants ({participant_id: challenge}, see add_to_aggregation) at once:
+    they are all put in the participant store before the participants of the bar-plots and 2D-plots
+    are regenerated, once.
     '''
+    if store is None:
+        store = ParticipantStore.from_aggregation(aggregation)
+    for participant_id, challenge in participants.items():
+        store.put(participant_id, {metric: (ass_json["metrics"]["value"], ass_json["metrics"].get("stderr"))
+                                   for metric, ass_json in challenge.items()})
+
     for item in aggregation:
         assert_object_type(item, "aggregation")
 
         # get the current visualization object
         plot = item["datalink"]["inline_data"]["visualization"]
+        inline_data = item["datalink"]["inline_data"]
 
         # Depending on the type of plot we'll need to create different participant objects
-        participant = {}
-        participant["participant_id"] = participant_id
-        skip_participant = False
         if plot["type"] == Visualisations.TWODPLOT.value:
-            try:
-                participant["metric_x"] = challenge[plot["x_axis"]
-                                                    ]["metrics"]["value"]
-                participant["metric_y"] = challenge[plot["y_axis"]
-                                                    ]["metrics"]["value"]
-            except Exception as e:
-                logging.exception(str(e))
-                skip_participant = True
+            if any(plot["x_axis"] not in challenge or plot["y_axis"] not in challenge
+                   for challenge in participants.values()):
+                logging.error(
+                    f"The assessment file does not contain data for metrics {plot['x_axis']} and {plot['y_axis']}.")
+            tools, x_values, y_values = store.series(plot["x_axis"], plot["y_axis"])
+            inline_data["challenge_participants"] = [
+                {"participant_id": tool, "metric_x": x, "metric_y": y}
+                for tool, x, y in zip(tools.tolist(), x_values.tolist(), y_values.tolist())]
 
         elif plot["type"] == Visualisations.BARPLOT.value:
-            try:
-                participant["metric_value"] = challenge[plot["metric"]
-                                                        ]["metrics"]["value"]
-            except KeyError as e:
-                logging.exception(
+            if any(plot["metric"] not in challenge for challenge in participants.values()):
+                logging.error(
                     f"The assessment file does not contain data for metric {plot['metric']}.")
-                raise e
-
-        # Append current participant to the list of participant objects
-        if not skip_participant: 
-            item["datalink"]["inline_data"]["challenge_participants"].append(
-                participant)
+                raise KeyError(plot["metric"])
+            tools, values, _ = store.column(plot["metric"])
+            inline_data["challenge_participants"] = [
+                {"participant_id": tool, "metric_value": value}
+                for tool, value in zip(tools.tolist(), values.tolist())]
+
+        elif plot["type"] == Visualisations.LEADERBOARD.value:
+            missing = [metric for metric in plot["metrics"]
+                       if any(metric not in challenge for challenge in participants.values())]
+            if missing:
+                logging.error(
+                    f"The assessment file does not contain data for metrics {', '.join(missing)}.")
+                raise KeyError(missing[0])
+            # ranks are updated in place by sorted insertion, not regenerated
+            from leaderboard import update_leaderboard_aggregation
+            update_leaderboard_aggregation(item, {
+                participant_id: {metric: challenge[metric]["metrics"]["value"] for metric in plot["metrics"]}
+                for participant_id, challenge in participants.items()})
 
     return aggregation
 
@@ -363,7 +621,7 @@ if __name__ == '__main__':
                             format='%(asctime)s %(levelname)s:%(message)s', datefmt='%Y-%m-%d %H:%M:%S ')
         # execute the body of the script
         logging.info("Starting script")
-        main(options)
+        profiling.run(main, options, options.outdir, "aggregation")
         logging.info("Finished script successfully.")
 
     except Exception as e:
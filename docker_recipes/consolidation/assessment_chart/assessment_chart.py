@@ -1,4 +1,3 @@
-import pandas
 import io
 import json
 import os
@@ -16,6 +15,93 @@ plt.ioff()
 
     @Javier Garrayo Ventas. Barcelona Supercomputing Center. Spain. 2019"
 """
+
+# markers and colours of the first participants of a 2D chart; further participants get generated ones
+MARKERS = [".", "o", "v", "^", "<", ">", "1", "2", "3", "4", "8", "s", "p", "P", "*", "h", "H", "+",
+           "x", "X",
+           "D",
+           "d", "|", "_", ","]
+COLORS = ['#5b2a49', '#a91310', '#9693b0', '#e7afd7', '#fb7f6a', '#0566e5', '#00bdc8', '#cf4119', '#8b123f',
+          '#b35ccc', '#dbf6a6', '#c0b596', '#516e85', '#1343c3', '#7b88be']
+# filled markers cycled through by the generated styles
+CYCLE_MARKERS = ["o", "s", "^", "D", "v", "P", "X", "<", ">", "p", "h", "*", "8", "d", "H"]
+# (saturation, value) levels alternated by the generated colours
+COLOR_LEVELS = [(0.65, 0.85), (0.9, 0.6), (0.45, 0.95)]
+
+# above this many participants a chart is drawn in large-scale mode: points and bars in rasterised
+# layers, no legend, and at most LABEL_LIMIT participants labelled (and listed in quartile tables)
+LARGE_SCALE_THRESHOLD = 50
+LABEL_LIMIT = 30
+
+CHART_FORMATS = ("svg", "png", "webp")
+# resolution of the raster formats and of the rasterised layers inside SVGs
+DPI = 100
+
+
+def participant_styles(n_participants):
+    """
+    Marker and colour of each participant: the fixed lists first, then golden-ratio hues over
+    alternating saturation/value levels with cycling markers, for any number of participants
+    """
+    from matplotlib.colors import hsv_to_rgb, to_hex
+
+    styles = []
+    for i in range(n_participants):
+        if i < len(COLORS):
+            styles.append((MARKERS[i], COLORS[i]))
+            continue
+        k = i - len(COLORS)
+        saturation, value = COLOR_LEVELS[k % len(COLOR_LEVELS)]
+        hue = (k * 0.618033988749895) % 1
+        styles.append((CYCLE_MARKERS[k % len(CYCLE_MARKERS)], to_hex(hsv_to_rgb((hue, saturation, value)))))
+    return styles
+
+
+def is_large_scale(n_participants):
+    return n_participants > LARGE_SCALE_THRESHOLD
+
+
+def label_indices(x_values, y_values, better, limit=LABEL_LIMIT):
+    """
+    Indices of the (at most limit) participants closest to the 'better' corner, best first;
+    the ones labelled on a large-scale chart
+    """
+    x_norm, y_norm = (np.asarray(v, dtype=float) for v in normalize_data(x_values, y_values))
+    x_score = 1 - x_norm if better.endswith("left") else x_norm
+    y_score = 1 - y_norm if better.startswith("bottom") else y_norm
+    scores = np.nan_to_num(x_score + y_score, nan=-np.inf)
+    return [int(i) for i in np.argsort(-scores, kind="stable")[:limit]]
+
+
+def spaced_indices(n, limit=LABEL_LIMIT):
+    """
+    At most limit evenly spaced indices of range(n), for the tick labels of large charts
+    """
+    if n <= limit:
+        return list(range(n))
+    return sorted(set(np.linspace(0, n - 1, limit).round().astype(int).tolist()))
+
+
+def save_figure(fig, out_path, chart_format="svg"):
+    """
+    Save fig as <out_path>.<chart_format> and return the file name.
+    WebP is converted with Pillow from a PNG rendering (matplotlib writes it only from 3.6 on).
+    """
+    if chart_format not in CHART_FORMATS:
+        raise ValueError(f"Unknown chart format '{chart_format}', expected one of {CHART_FORMATS}")
+
+    outname = out_path + "." + chart_format
+    if chart_format == "webp":
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", dpi=DPI)
+        buffer.seek(0)
+        Image.open(buffer).save(outname, format="WEBP")
+    else:
+        fig.savefig(outname, dpi=DPI)
+    return outname
+
 def pareto_frontier(Xs, Ys, maxX=True, maxY=True):
     # Sort the list in either ascending or descending order of X
     myList = sorted([[Xs[i], Ys[i]] for i, val in enumerate(Xs, 0)], reverse=maxX)
@@ -184,8 +270,9 @@ def get_quartile_points(scores_and_values, first_quartile, second_quartile, thir
 
 
 # funtion that separate the points through diagonal quartiles based on the distance to the 'best corner'
-def plot_diagonal_quartiles(x_values, means, tools, better):
+def plot_diagonal_quartiles(x_values, means, tools, better, labelled=None):
     # get distance to lowest score corner
+    # labelled: indices of the participants annotated (default: all); others are only classified
 
     # normalize data to 0-1 range
     x_norm, means_norm = normalize_data(x_values, means)
@@ -204,7 +291,9 @@ def plot_diagonal_quartiles(x_values, means, tools, better):
             scores.append(1-x_norm[i] + (1 - means_norm[i]))
 
     # add plot annotation boxes with info about scores and tool names
-    for counter, scr in enumerate(scores):
+    large = is_large_scale(len(tools))
+    for counter in (range(len(scores)) if labelled is None else labelled):
+        scr = scores[counter]
         plt.annotate(
             tools[counter] + "\n" +
             # str(round(x_norm[counter], 6)) + " * " + str(round(1 - means_norm[counter], 6)) + " = " + str(round(scr, 8)),
@@ -213,7 +302,8 @@ def plot_diagonal_quartiles(x_values, means, tools, better):
             textcoords='offset points', ha='right', va='bottom',
             bbox=dict(boxstyle='round,pad=0.5', fc='yellow', alpha=0.15),
             size=7,
-            arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=0'))
+            arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=0'),
+            rasterized=large)
 
     # region sort the list in descending order
     scores_and_values = sorted([[scores[i], x_values[i], means[i], tools[i]] for i, val in enumerate(scores, 0)],
@@ -235,7 +325,15 @@ def plot_diagonal_quartiles(x_values, means, tools, better):
 
 
 # function that prints a table with the list of tools and the corresponding quartiles
-def print_quartiles_table(tools_quartiles):
+def print_quartiles_table(tools_quartiles, shown=None):
+    import pandas  # only needed for the quartile tables
+
+    # shown: tools listed (default: all); the others are summed up in a last row
+    if shown is not None and len(shown) < len(tools_quartiles):
+        hidden = len(tools_quartiles) - len(shown)
+        tools_quartiles = {tool: tools_quartiles[tool] for tool in shown if tool in tools_quartiles}
+        tools_quartiles[f"... {hidden} more"] = ""
+
     row_names = tools_quartiles.keys()
     quartiles_1 = tools_quartiles.values()
 
@@ -265,7 +363,11 @@ def print_quartiles_table(tools_quartiles):
 
 
 
-def print_chart(challenge_dir, summary_dir, challenge_type, classification_type):
+def print_chart(challenge_dir, summary_dir, challenge_type, classification_type, chart_format="svg", series=None):
+    """
+    Print the 2D-plot of an aggregation object; series is an optional (tools, x values, y values)
+    query of the participant store (see participant_store.py), read instead of the participant list
+    """
 
     tools = []
     x_values = []
@@ -276,27 +378,44 @@ def print_chart(challenge_dir, summary_dir, challenge_type, classification_type)
     aggregation_file = summary_dir
 
     # participants and their metrics
-    for participant_data in aggregation_file["datalink"]["inline_data"]["challenge_participants"]:
+    if series is not None:
+        tools, x_values, y_values = (np.asarray(column).tolist() for column in series)
+    else:
+        for participant_data in aggregation_file["datalink"]["inline_data"]["challenge_participants"]:
 
-        tools.append(participant_data['participant_id'])
-        x_values.append(participant_data['metric_x'])
-        y_values.append(participant_data['metric_y'])
+            tools.append(participant_data['participant_id'])
+            x_values.append(participant_data['metric_x'])
+            y_values.append(participant_data['metric_y'])
     # metrics names for axes
     x_metric = aggregation_file["datalink"]["inline_data"]["visualization"]["x_axis"]
     y_metric = aggregation_file["datalink"]["inline_data"]["visualization"]["y_axis"]
     
+    # set parameters for optimization
+    better = aggregation_file["datalink"]["inline_data"]["visualization"]["optimization"]
+
+    styles = participant_styles(len(tools))
+    large = is_large_scale(len(tools))
     ax = plt.subplot()
-    for i, val in enumerate(tools, 0):
-        markers = [".", "o", "v", "^", "<", ">", "1", "2", "3", "4", "8", "s", "p", "P", "*", "h", "H", "+",
-                   "x", "X",
-                   "D",
-                   "d", "|", "_", ","]
-        colors = ['#5b2a49', '#a91310', '#9693b0', '#e7afd7', '#fb7f6a', '#0566e5', '#00bdc8', '#cf4119', '#8b123f',
-                  '#b35ccc', '#dbf6a6', '#c0b596', '#516e85', '#1343c3', '#7b88be']
-
-        ax.errorbar(x_values[i], y_values[i], linestyle='None', marker=markers[i],
-                    markersize='15', markerfacecolor=colors[i], markeredgecolor=colors[i], capsize=6,
-                    ecolor=colors[i], label=tools[i])
+    if large:
+        # one rasterised scatter layer per marker instead of one vector artist per participant
+        by_marker = {}
+        for i, (marker, color) in enumerate(styles):
+            by_marker.setdefault(marker, []).append(i)
+        for marker, indices in by_marker.items():
+            ax.scatter([x_values[i] for i in indices], [y_values[i] for i in indices], marker=marker,
+                       s=36, c=[styles[i][1] for i in indices], rasterized=True)
+        # the best participants are named next to their points
+        labelled = label_indices(x_values, y_values, better)
+        for i in labelled:
+            ax.annotate(tools[i], xy=(x_values[i], y_values[i]), xytext=(4, 4), textcoords='offset points',
+                        fontsize=7, rasterized=True)
+    else:
+        labelled = None
+        for i, val in enumerate(tools, 0):
+            marker, color = styles[i]
+            ax.errorbar(x_values[i], y_values[i], linestyle='None', marker=marker,
+                        markersize='15', markerfacecolor=color, markeredgecolor=color, capsize=6,
+                        ecolor=color, label=tools[i])
 
     # change plot style
     # set plot title
@@ -311,9 +430,10 @@ def print_chart(challenge_dir, summary_dir, challenge_type, classification_type)
     ax.set_position([box.x0, box.y0 + box.height * 0.25,
                      box.width, box.height * 0.75])
 
-    # Put a legend below current axis
-    plt.legend(loc='upper center', bbox_to_anchor=(0.5, -0.12), markerscale=0.7,
-               fancybox=True, shadow=True, ncol=5, prop={'size': 12})
+    # Put a legend below current axis (large charts label their best points instead)
+    if not large:
+        plt.legend(loc='upper center', bbox_to_anchor=(0.5, -0.12), markerscale=0.7,
+                   fancybox=True, shadow=True, ncol=5, prop={'size': 12})
 
 
     # set the axis limits
@@ -326,8 +446,6 @@ def print_chart(challenge_dir, summary_dir, challenge_type, classification_type)
     if y_lims[0] >= 1000:
         ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda y, loc: "{:,}".format(int(y))))
 
-    # set parameters for optimization
-    better = aggregation_file["datalink"]["inline_data"]["visualization"]["optimization"]
     max_x = True
     max_y = True
 
@@ -388,28 +506,29 @@ def print_chart(challenge_dir, summary_dir, challenge_type, classification_type)
     plt.grid(b=None, which='major', axis='both', linewidth=0.5)
 
 
+    shown = None if labelled is None else [tools[i] for i in labelled]
     if classification_type == "SQR":
         tools_quartiles = plot_square_quartiles(x_values, y_values, tools, better, ax)
-        print_quartiles_table(tools_quartiles)
+        print_quartiles_table(tools_quartiles, shown)
 
     elif classification_type == "DIAG":
-        tools_quartiles = plot_diagonal_quartiles(x_values, y_values, tools, better)
-        print_quartiles_table(tools_quartiles)
+        tools_quartiles = plot_diagonal_quartiles(x_values, y_values, tools, better, labelled)
+        print_quartiles_table(tools_quartiles, shown)
 
     out_id = aggregation_file["_id"].split("_")
     del out_id[0]
     out_id = "_".join(out_id)
 
-    outname = os.path.join(challenge_dir, out_id + "_benchmark_" + classification_type + ".svg")
     fig = plt.gcf()
     fig.set_size_inches(18.5, 10.5)
-    fig.savefig(outname, dpi=100)
+    save_figure(fig, os.path.join(challenge_dir, out_id + "_benchmark_" + classification_type), chart_format)
 
     plt.close("all")
 
-def print_barplot(challenge_dir, aggregation, challenge_acronym):
+def print_barplot(challenge_dir, aggregation, challenge_acronym, chart_format="svg", series=None):
     """
-    Print bar plots when there is only a single metric in the aggregation
+    Print bar plots when there is only a single metric in the aggregation;
+    series is an optional (tools, values) query of the participant store, read instead of the participant list
     """
 
     tools = []
@@ -417,31 +536,98 @@ def print_barplot(challenge_dir, aggregation, challenge_acronym):
     orange_hex = "#f47c21" #Bar plots in orange like on the OEB website
 
     # participants and their metrics
-    for participant_data in aggregation["datalink"]["inline_data"]["challenge_participants"]:
-        tools.append(participant_data['participant_id'])
-        values.append(participant_data['metric_value'])
+    if series is not None:
+        tools, values = (np.asarray(column).tolist() for column in series)
+    else:
+        for participant_data in aggregation["datalink"]["inline_data"]["challenge_participants"]:
+            tools.append(participant_data['participant_id'])
+            values.append(participant_data['metric_value'])
 
     # metrics names for axes
     metric_name = aggregation["datalink"]["inline_data"]["visualization"][
         "metric"]
 
     ax = plt.subplot()
-    ax.bar(tools, values, color = orange_hex, edgecolor = orange_hex)
+    large = is_large_scale(len(tools))
+    if large:
+        # all bars in one rasterised collection on numeric positions, with evenly spaced tool names
+        from matplotlib.collections import PolyCollection
+
+        left = np.arange(len(tools)) - 0.4
+        heights = np.asarray(values, dtype=float)
+        bars = np.stack([np.stack([left, np.zeros_like(heights)], axis=1),
+                         np.stack([left, heights], axis=1),
+                         np.stack([left + 0.8, heights], axis=1),
+                         np.stack([left + 0.8, np.zeros_like(heights)], axis=1)], axis=1)
+        ax.add_collection(PolyCollection(bars, facecolors=orange_hex, edgecolors=orange_hex, rasterized=True))
+        ax.autoscale_view()
+        shown = spaced_indices(len(tools))
+        ax.set_xticks(shown)
+        ax.set_xticklabels([tools[i] for i in shown], rotation=90, fontsize=7)
+    else:
+        ax.bar(tools, values, color = orange_hex, edgecolor = orange_hex)
 
     ax.set_xlabel("Tools", fontsize=12)
     ax.set_ylabel(f"{metric_name.capitalize()}", fontsize=12)
     ax.set_title(f"{metric_name.capitalize()} bar-plot in challenge {challenge_acronym}")
-    ax.legend()
+    # the bar collection of large charts has no legend entry
+    if not large:
+        ax.legend()
+
+    # Extract the challenge name and "Aggregation" from the id for the file name
+    out_id = aggregation["_id"].split("_")
+    del out_id[0]
+    out_id = "_".join(out_id)
+
+    fig = plt.gcf()
+    fig.set_size_inches(18.5, 10.5)
+    save_figure(fig, os.path.join(challenge_dir, out_id + "_benchmark_" + metric_name + "_barplot"), chart_format)
+
+    plt.close("all")
+
+def print_significance_heatmap(challenge_dir, aggregation, challenge_acronym, chart_format="svg"):
+    """
+    Print the p-values of the pairwise permutation tests of one metric as a heatmap
+    """
+
+    inline_data = aggregation["datalink"]["inline_data"]
+    metric_name = inline_data["visualization"]["metric"]
+    tools = [participant_data["participant_id"] for participant_data in inline_data["challenge_participants"]]
+    index = {tool: i for i, tool in enumerate(tools)}
+
+    # symmetric matrix of p-values, empty diagonal
+    p_values = np.full((len(tools), len(tools)), np.nan)
+    for test in inline_data["pairwise_tests"]:
+        i, j = index[test["participant_a"]], index[test["participant_b"]]
+        p_values[i, j] = p_values[j, i] = test["p_value"]
+
+    ax = plt.subplot()
+    image = ax.imshow(p_values, cmap="viridis_r", vmin=0, vmax=1)
+    plt.colorbar(image, ax=ax, label="p-value")
+
+    shown = spaced_indices(len(tools)) if is_large_scale(len(tools)) else range(len(tools))
+    ax.set_xticks(shown)
+    ax.set_yticks(shown)
+    ax.set_xticklabels([tools[i] for i in shown], rotation=90)
+    ax.set_yticklabels([tools[i] for i in shown])
+    if len(tools) <= 30:
+        # p-values in the cells, starred below 0.05
+        for i in range(len(tools)):
+            for j in range(len(tools)):
+                if not np.isnan(p_values[i, j]):
+                    star = "*" if p_values[i, j] < 0.05 else ""
+                    ax.text(j, i, f"{p_values[i, j]:.3f}{star}", ha="center", va="center", fontsize=9,
+                            color="white" if p_values[i, j] < 0.5 else "black")
+
+    ax.set_title(f"{metric_name.capitalize()} paired permutation tests in challenge {challenge_acronym}")
 
     # Extract the challenge name and "Aggregation" from the id for the file name
     out_id = aggregation["_id"].split("_")
     del out_id[0]
     out_id = "_".join(out_id)
 
-    outname = os.path.join(challenge_dir,
-                           out_id + "_benchmark_" + metric_name + "_barplot.svg")
     fig = plt.gcf()
     fig.set_size_inches(18.5, 10.5)
-    fig.savefig(outname, dpi=100)
+    save_figure(fig, os.path.join(challenge_dir, out_id + "_heatmap"), chart_format)
 
     plt.close("all")
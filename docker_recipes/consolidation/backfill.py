@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+'''
+Backfill: rebuild the consolidation of every event from its historical assessments.
+
+After a change of the aggregation template or of the chart code, the results of
+past events are rebuilt in one run instead of one aggregation.py and
+merge_data_model_files.py process per participant:
+
+    python3 backfill.py -a <assessments_dir> -t <template> -o <outdir> [-v <validation_dir>] [-j 8]
+
+* Every assessment JSON under <assessments_dir> is read once and grouped by
+  challenge with get_metrics_per_challenge; the event of a challenge's
+  assessments is read from their ids (<community>:<event>_<challenge>_<participant>:<metric>).
+* Each (event, challenge) is rebuilt in a pool of processes, from the template,
+  with all its participants at once: aggregation file, per-participant
+  assessments, participant store and charts, in <outdir>/<event>/<challenge>/.
+* A challenge is only rebuilt when its inputs changed: its assessments, the
+  template, the chart format or the consolidation code. Their fingerprint, and
+  the files the rebuild wrote, are kept in <challenge_dir>/.backfill.json.
+* The Manifest and the consolidated result of each event (<outdir>/<event>/Manifest.json,
+  consolidated_result.json) are rewritten when one of its challenges was. The
+  validated participant objects of <validation_dir>, if given, come first in it,
+  as in merge_data_model_files.py.
+
+Progress and throughput are logged as the challenges complete. Permutation
+tests and case analytics are not rebuilt (they need the per-case tables).
+'''
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import aggregation
+import oeb_json  # importable once aggregation is (see aggregation.SCHEMAS_DIR)
+import storage
+from participant_store import ParticipantStore
+
+FINGERPRINT_FILE = ".backfill.json"
+
+# code the aggregation objects and charts are built with, relative to this directory
+CODE_FILES = ("aggregation.py", "leaderboard.py", "participant_store.py",
+              os.path.join("assessment_chart", "assessment_chart.py"))
+
+# objects schema-checked at a time while a consolidated result is written (see merge_data_model_files.py)
+BATCH_SIZE = 5000
+
+
+def parse_arguments():
+    '''
+    Parser of command-line arguments.
+    '''
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-a", "--assessments_dir", required=True,
+                        help="directory of the historical assessment JSONs (searched recursively)")
+    parser.add_argument("-t", "--template", required=True,
+                        help="path to the aggregation template")
+    parser.add_argument("-o", "--outdir", required=True,
+                        help="output directory; each event is rebuilt in <outdir>/<event>")
+    parser.add_argument("-v", "--validation_dir",
+                        help="directory of the validated participant JSONs, added to the consolidated results")
+    parser.add_argument("-e", "--event_id",
+                        help="event of the assessments whose ids do not name one")
+    parser.add_argument("-j", "--workers", type=int,
+                        help="processes rebuilding challenges (default: the number of CPUs)")
+    parser.add_argument("--chart_format", choices=["svg", "png", "webp"], default="svg",
+                        help="file format of the charts (default: svg)")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild every challenge, changed or not")
+    return parser
+
+
+##########################################
+# Grouping of the historical assessments
+##########################################
+
+def iter_json_paths(directory):
+    for subdir, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".json"):
+                yield os.path.join(subdir, file)
+
+
+def event_of(obj, default=None):
+    '''
+    Event id of an assessment (or validated participant) object, from its _id
+    "<community>:<event>_<challenge>_<participant>:<metric>" ("<community>:<event>_<participant>").
+    '''
+    prefix = obj["community_id"] + ":"
+    if obj["type"] == "assessment":
+        suffix = f"_{obj['challenge_id']}_{obj['participant_id']}:"
+        end = obj["_id"].rfind(suffix)
+    else:
+        suffix = f"_{obj['participant_id']}"
+        end = len(obj["_id"]) - len(suffix) if obj["_id"].endswith(suffix) else -1
+    if obj["_id"].startswith(prefix) and end > len(prefix):
+        return obj["_id"][len(prefix):end]
+    if default is None:
+        raise ValueError(f"{obj['_id']}: no event in the id, give one with --event_id")
+    return default
+
+
+def group_events(assessments_dir, default_event=None):
+    '''
+    Historical assessments by event and challenge:
+    {(event, challenge_id): (community_id, {participant_id: {metric_id: assessment}})}
+    '''
+    events = {}
+    for path in iter_json_paths(assessments_dir):
+        try:
+            community_id, participant_id, challenges = aggregation.get_metrics_per_challenge([path])
+        except (TypeError, KeyError) as e:
+            logging.warning(f"{path}: not an assessment file ({e}), skipped")
+            continue
+        for challenge_id, metrics in challenges.items():
+            event = event_of(next(iter(metrics.values())), default_event)
+            community, participants = events.setdefault((event, challenge_id), (community_id, {}))
+            if community != community_id:
+                raise ValueError(f"{path}: challenge {challenge_id} of event {event} in communities "
+                                 f"{community} and {community_id}")
+            # a later file of the same participant replaces its metrics one by one
+            participants.setdefault(participant_id, {}).update(metrics)
+    return events
+
+
+def fingerprint(participants, template, chart_format):
+    '''
+    Digest of everything a challenge's consolidation is built from.
+    '''
+    digest = hashlib.sha256()
+    for participant_id in sorted(participants):
+        metrics = participants[participant_id]
+        digest.update(json.dumps([metrics[m] for m in sorted(metrics)], sort_keys=True).encode("utf-8"))
+    with open(template, "rb") as f:
+        digest.update(f.read())
+    here = os.path.dirname(os.path.realpath(__file__))
+    for name in CODE_FILES:
+        path = os.path.join(here, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    digest.update(chart_format.encode())
+    return digest.hexdigest()
+
+
+def read_fingerprint(challenge_dir):
+    path = os.path.join(challenge_dir, FINGERPRINT_FILE)
+    return oeb_json.load(path) if os.path.isfile(path) else {}
+
+
+##########################################
+# Rebuild of one challenge
+##########################################
+
+def rebuild_challenge(event, challenge_id, community_id, participants, template, challenge_dir, chart_format,
+                      digest):
+    '''
+    Rebuild the consolidation of one challenge from the template with all its participants.
+    Returns (participant ids, seconds).
+    '''
+    start = time.perf_counter()
+    os.makedirs(challenge_dir, exist_ok=True)
+
+    # only the metrics every participant has are plotted and ranked
+    metrics_ids = [m for m in next(iter(participants.values())) if all(m in p for p in participants.values())]
+    stores = {}
+
+    def build(existing):
+        # the current file is ignored: the challenge is rebuilt from the template
+        objects = aggregation.load_aggregation_template(template, community_id, event, challenge_id, metrics_ids)
+        aggregation.check_oeb_objects(objects)
+        stores["store"] = ParticipantStore.from_aggregation(objects)
+        aggregation.add_participants_to_aggregation(objects, participants, stores["store"])
+        aggregation.check_oeb_objects(objects, fields=["datalink.inline_data.challenge_participants"])
+        return objects
+
+    def commit(objects):
+        # files of the previous rebuild that this one may not write again (e.g. charts of removed plots)
+        for name in read_fingerprint(challenge_dir).get("files", []):
+            path = os.path.join(challenge_dir, name)
+            if name != aggregation_name and os.path.isfile(path):
+                os.remove(path)
+        store = stores["store"]
+        store.save(challenge_dir)
+        for participant_id, metrics in participants.items():
+            oeb_json.dump(list(metrics.values()), os.path.join(challenge_dir, participant_id + ".json"))
+        aggregation.render_charts(challenge_dir, objects, challenge_id, chart_format, store)
+        written = sorted(name for name in os.listdir(challenge_dir)
+                         if name != FINGERPRINT_FILE and not name.startswith(storage.LOCK_FILE)
+                         and os.path.isfile(os.path.join(challenge_dir, name)))
+        oeb_json.dump({"fingerprint": digest, "files": written}, os.path.join(challenge_dir, FINGERPRINT_FILE))
+
+    aggregation_name = challenge_id.replace('.', '_') + ".json"
+    storage.update(os.path.join(challenge_dir, aggregation_name), build,
+                   storage.challenge_lock_path(challenge_dir), commit=commit)
+    return stores["store"].participants().tolist(), time.perf_counter() - start
+
+
+##########################################
+# Manifest and consolidated result of an event
+##########################################
+
+def validated_participants(validation_dir, event, participant_ids):
+    '''
+    Validated participant objects of an event's participants, from the JSONs of validation_dir.
+    '''
+    if not validation_dir:
+        return []
+    found = {}
+    for path in iter_json_paths(validation_dir):
+        for obj in oeb_json.iter_objects(path):
+            if (obj.get("type") == "participant" and obj["participant_id"] in participant_ids
+                    and event_of(obj, event) == event):
+                found[obj["participant_id"]] = obj
+    return [found[p] for p in participant_ids if p in found]
+
+
+def write_event(event_dir, event, challenges, events, validation_dir):
+    '''
+    Write the Manifest and the consolidated result of an event.
+    challenges: {challenge_id: participant ids} of the event, in order
+    '''
+    manifest = [{"id": challenge_id, "participants": participants}
+                for challenge_id, participants in challenges.items()]
+    aggregation.check_oeb_objects(manifest)
+    oeb_json.dump(manifest, os.path.join(event_dir, "Manifest.json"))
+
+    participant_ids = list(dict.fromkeys(p for participants in challenges.values() for p in participants))
+
+    def objects():
+        # same order as merge_data_model_files.py: validation, Manifest, assessments, aggregations
+        yield from validated_participants(validation_dir, event, participant_ids)
+        yield from manifest
+        for challenge_id in challenges:
+            for metrics in events[(event, challenge_id)][1].values():
+                yield from metrics.values()
+        for challenge_id in challenges:
+            name = challenge_id.replace('.', '_')
+            yield from oeb_json.iter_objects(os.path.join(event_dir, name, name + ".json"))
+
+    with oeb_json.ArrayWriter(os.path.join(event_dir, "consolidated_result.json")) as out:
+        batch = []
+        for obj in objects():
+            batch.append(obj)
+            if len(batch) == BATCH_SIZE:
+                aggregation.check_oeb_objects(batch)
+                out.extend(batch)
+                batch = []
+        aggregation.check_oeb_objects(batch)
+        out.extend(batch)
+
+
+##########################################
+# Backfill
+##########################################
+
+def main(options):
+    start = time.perf_counter()
+    events = group_events(options.assessments_dir, options.event_id)
+    if not events:
+        logging.warning(f"No assessments found in {options.assessments_dir}")
+        return 0
+
+    # tasks: the challenges whose inputs changed
+    tasks = {}
+    results = {}  # (event, challenge_id): participant ids
+    for (event, challenge_id), (community_id, participants) in sorted(events.items()):
+        challenge_dir = os.path.join(options.outdir, event, challenge_id.replace('.', '_'))
+        digest = fingerprint(participants, options.template, options.chart_format)
+        if not options.force and read_fingerprint(challenge_dir).get("fingerprint") == digest:
+            results[(event, challenge_id)] = list(participants)
+            continue
+        tasks[(event, challenge_id)] = (event, challenge_id, community_id, participants, options.template,
+                                        challenge_dir, options.chart_format, digest)
+    logging.info(f"{len(events)} challenge(s) in {len({e for e, _ in events})} event(s): "
+                 f"{len(tasks)} to rebuild, {len(events) - len(tasks)} unchanged")
+
+    failed = []
+    rebuilt = set()
+    if tasks:
+        workers = max(min(options.workers or os.cpu_count() or 1, len(tasks)), 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(rebuild_challenge, *task): key for key, task in tasks.items()}
+            n_participants = 0
+            for done, future in enumerate(as_completed(futures), 1):
+                event, challenge_id = key = futures[future]
+                try:
+                    participants, seconds = future.result()
+                except Exception as e:
+                    logging.error(f"[{done}/{len(tasks)}] {event}/{challenge_id}: failed: {e}")
+                    failed.append(key)
+                    continue
+                results[key] = participants
+                rebuilt.add(event)
+                n_participants += len(participants)
+                elapsed = time.perf_counter() - start
+                logging.info(f"[{done}/{len(tasks)}] {event}/{challenge_id}: {len(participants)} participant(s) "
+                             f"in {seconds:.1f}s; {done / elapsed:.2f} challenges/s, "
+                             f"{n_participants / elapsed:.1f} participants/s")
+
+    # Manifest and consolidated result of the events with a rebuilt (or failed) challenge
+    for event in sorted({e for e, _ in events}):
+        event_dir = os.path.join(options.outdir, event)
+        if event not in rebuilt and os.path.isfile(os.path.join(event_dir, "consolidated_result.json")):
+            continue
+        if any(e == event for e, _ in failed):
+            logging.error(f"Event {event}: not consolidated, a challenge failed")
+            continue
+        challenges = {c: results[(e, c)] for e, c in sorted(events) if e == event}
+        write_event(event_dir, event, challenges, events, options.validation_dir)
+        logging.info(f"Event {event}: Manifest and consolidated result written to {event_dir}")
+
+    elapsed = time.perf_counter() - start
+    logging.info(f"Backfill done in {elapsed:.1f}s: {len(tasks) - len(failed)} challenge(s) rebuilt, "
+                 f"{len(events) - len(tasks)} unchanged, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s:%(message)s', datefmt='%Y-%m-%d %H:%M:%S ')
+    sys.exit(main(parse_arguments().parse_args()))
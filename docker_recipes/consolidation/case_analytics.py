@@ -0,0 +1,136 @@
+'''
+Case-level analytics of a challenge, from its participants x cases outcome matrix
+(oeb_schemas/case_matrix.py, written by compute_metrics.py --cases_dir), without
+reading any predictions:
+
+* difficulty of each case: the share of participants that got it wrong, and the
+  mean probability they gave to its ground truth;
+* consensus: the share of participants sharing the majority outcome of each case;
+* the cases no participant got right;
+* pairwise agreement: for every pair of participants, the share of cases both got
+  right or both got wrong, and Cohen's kappa of their outcomes.
+
+Every figure is a reduction or a product of the whole matrix.
+'''
+import logging
+import os
+
+import numpy as np
+
+import oeb_json
+
+REPORT_FILE = "cases_report.json"
+CASES_FILE = "cases_report.csv"
+
+# cases listed in the report's rankings
+TOP_CASES = 20
+
+
+##########################################
+# Analytics
+##########################################
+
+def case_difficulty(correct, scores):
+    '''
+    Per case: the share of participants that got it wrong, and the mean probability given to its truth.
+    '''
+    return 1 - correct.mean(axis=0), np.asarray(scores).mean(axis=0, dtype=float)
+
+
+def consensus(correct):
+    '''
+    Per case: the share of participants sharing the majority outcome (right or wrong).
+    '''
+    share = correct.mean(axis=0)
+    return np.maximum(share, 1 - share)
+
+
+def pairwise_agreement(correct):
+    '''
+    Participants x participants matrices of the share of cases with the same outcome, and of Cohen's kappa.
+    '''
+    n = correct.shape[1]
+    # counts are exact in float32 up to 2**24 cases
+    a = correct.astype(np.float32)
+    right = a.sum(axis=1)
+    both_right = a @ a.T
+    both_wrong = n - right[:, None] - right[None, :] + both_right
+    agreement = (both_right + both_wrong) / n
+
+    p = right / n
+    expected = p[:, None] * p[None, :] + (1 - p[:, None]) * (1 - p[None, :])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kappa = np.where(expected < 1, (agreement - expected) / (1 - expected), np.nan)
+    return agreement.astype(float), kappa.astype(float)
+
+
+def case_report(matrix, top=TOP_CASES):
+    '''
+    Analytics of an outcome matrix (case_matrix.CaseMatrix).
+    Returns:
+    report: JSON-serialisable summary (rankings, cases no one got right, pairwise agreement)
+    cases: DataFrame of the per-case figures
+    '''
+    import pandas as pd
+
+    correct = matrix.correct()
+    difficulty, mean_score = case_difficulty(correct, matrix.scores())
+    agree = consensus(correct)
+    agreement, kappa = pairwise_agreement(correct)
+    images = np.asarray(matrix.cases).astype(str)
+
+    cases = pd.DataFrame({
+        "image": images,
+        "right": correct.sum(axis=0),
+        "difficulty": difficulty,
+        "mean_score": mean_score,
+        "consensus": agree,
+    })
+    # hardest: most often wrong, then least probability given to the truth
+    hardest = np.lexsort((mean_score, -difficulty))[:top]
+    contested = np.argsort(agree, kind="mergesort")[:top]
+
+    def ranking(index):
+        return [{"image": str(images[i]), "difficulty": float(difficulty[i]), "mean_score": float(mean_score[i]),
+                 "consensus": float(agree[i])} for i in index]
+
+    def rounded(values):
+        return [[None if np.isnan(v) else round(float(v), 6) for v in row] for row in values]
+
+    report = {
+        "participants": matrix.participants,
+        "cases": int(len(images)),
+        "mean_difficulty": float(difficulty.mean()) if len(images) else None,
+        "mean_consensus": float(agree.mean()) if len(images) else None,
+        "no_one_right": images[correct.sum(axis=0) == 0].tolist(),
+        "everyone_right": int((correct.sum(axis=0) == len(correct)).sum()),
+        "hardest_cases": ranking(hardest),
+        "contested_cases": ranking(contested),
+        # rows and columns in the order of "participants"
+        "pairwise": {"agreement": rounded(agreement), "kappa": rounded(kappa)},
+    }
+    return report, cases
+
+
+def write_case_report(challenge_dir, cases_dir, challenge_id, tier=None, top=TOP_CASES):
+    '''
+    Write the case analytics of a challenge to <challenge_dir>/cases_report.json and cases_report.csv.
+    Returns the report, or None when the challenge has no outcome matrix.
+    '''
+    import case_matrix
+
+    try:
+        matrix = case_matrix.open_matrix(cases_dir, challenge_id)
+    except ValueError as e:
+        logging.warning(f"Challenge {challenge_id}: {e}, no case report")
+        return None
+    if matrix is None or not len(matrix):
+        logging.info(f"Challenge {challenge_id}: no per-case outcomes, no case report")
+        return None
+
+    report, cases = case_report(matrix, top)
+    oeb_json.dump_tier(report, os.path.join(challenge_dir, REPORT_FILE), tier)
+    oeb_json.replace(cases.to_csv(index=False).encode("utf-8"), os.path.join(challenge_dir, CASES_FILE))
+    logging.info(f"Challenge {challenge_id}: case report of {len(matrix)} participants, "
+                 f"{len(report['no_one_right'])} case(s) no one got right")
+    return report
@@ -0,0 +1,95 @@
+'''
+Checkpoints of long-running resampling jobs, e.g. the permutation tests of significance.py.
+
+Between two batches a job may save its accumulators and the state of its numpy
+random generator to a small JSON file next to the task output. Restarted with the
+same inputs (checked with a fingerprint stored in the file), it restores both and
+carries on after the last saved batch, so its result is identical to that of an
+uninterrupted run.
+
+Saves are rationed by an overhead budget: a save is only made while the time spent
+saving stays within the given fraction of the time spent computing. A killed job
+therefore loses at most about (save time / budget) of work, and budget 0 turns
+checkpointing off.
+'''
+import hashlib
+import json
+import os
+import time
+
+# default fraction of a job's run time that may be spent writing checkpoints
+OVERHEAD_BUDGET = 0.01
+
+# assumed duration of a save before the first one has been measured (seconds)
+FIRST_SAVE_ESTIMATE = 0.001
+
+
+def fingerprint(*parts):
+    '''
+    sha256 of the inputs of a job (numpy arrays, numbers, strings, tuples of those).
+    '''
+    digest = hashlib.sha256()
+    for part in parts:
+        if hasattr(part, "tobytes"):
+            digest.update(str((part.dtype, part.shape)).encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    '''
+    Saved state of one job, in the JSON file path.
+
+        checkpoint = Checkpoint(path, fingerprint(inputs...))
+        state = checkpoint.load()            # None: start from scratch
+        ...
+        if checkpoint.due():                 # between batches
+            checkpoint.save({"rng": rng.bit_generator.state, ...})
+    '''
+
+    def __init__(self, path, key, budget=OVERHEAD_BUDGET):
+        self.path = path
+        self.key = key
+        self.budget = budget
+        self.started = time.perf_counter()
+        self.save_time = 0.0
+        self.last_save = FIRST_SAVE_ESTIMATE
+
+    def load(self):
+        '''
+        State saved by this job, or None if there is none (or the file belongs to other inputs).
+        '''
+        try:
+            with open(self.path, mode='r', encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(saved, dict) or saved.get("key") != self.key:
+            return None
+        return saved.get("state")
+
+    def due(self):
+        '''
+        Whether a save now keeps the time spent saving within the budget.
+        '''
+        if self.budget <= 0:
+            return False
+        computing = time.perf_counter() - self.started - self.save_time
+        return self.save_time + self.last_save <= self.budget * computing
+
+    def save(self, state):
+        '''
+        Replace the saved state atomically; state must be JSON-serialisable.
+        The json module is used on purpose: generator states hold integers above 64 bits.
+        '''
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, mode='w', encoding="utf-8") as f:
+            json.dump({"key": self.key, "state": state}, f)
+        os.replace(tmp_path, self.path)
+        self.last_save = time.perf_counter() - start
+        self.save_time += self.last_save
@@ -0,0 +1,278 @@
+'''
+Multi-metric leaderboard of the participants of a challenge.
+
+Participants are ranked on every leaderboard metric (ties share their average
+rank) and the ranks are aggregated into a mean rank, a Borda count and the
+depth of the participant's Pareto layer (1 = not dominated on all metrics).
+
+For every metric the leaderboard keeps the participants sorted on their
+values, and the rows sorted by mean rank; both orders are stored with the
+aggregation object next to the Pareto layers. A rank is read from the sorted
+values with bisect. Adding a participant inserts it with bisect, moves only
+the rows of the participants behind it, and only looks for dominating or
+dominated participants on the right side of the first metric, so nothing is
+sorted or ranked again.
+'''
+import bisect
+import math
+
+# metrics where a lower value ranks better
+LOWER_IS_BETTER = {
+    "brier_score",
+    "log_loss",
+    "expected_calibration_error",
+    "max_calibration_error",
+    "hamming_loss",
+}
+
+
+def lower_is_better(metric):
+    return metric in LOWER_IS_BETTER or metric.startswith(tuple(m + "_" for m in LOWER_IS_BETTER))
+
+
+def sort_key(metric, value):
+    '''
+    Ascending key of a metric value: best first, missing values last.
+    '''
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return math.inf
+    return value if lower_is_better(metric) else -value
+
+
+def dominates(a, b):
+    '''
+    Whether sort keys a dominate sort keys b: as good on every metric and better on one.
+    '''
+    return all(x <= y for x, y in zip(a, b)) and any(x < y for x, y in zip(a, b))
+
+
+class Leaderboard:
+    '''
+    Participants' values, per-metric sorted keys, row order and Pareto layers of one challenge.
+    '''
+
+    def __init__(self, metrics, values=None, ranking=None, order=None, layers=None):
+        '''
+        metrics: leaderboard metric ids
+        values: optional dict of participant id -> {metric: value} already ranked
+        ranking: optional dict of metric -> participant ids sorted on it, best first; sorted here
+            if missing
+        order: optional participant ids sorted by mean rank, then id; sorted here if missing
+        layers: optional Pareto layers ({participant id: layer}); computed here if missing
+        '''
+        self.metrics = list(metrics)
+        self.values = {p: {metric: v.get(metric) for metric in self.metrics} for p, v in (values or {}).items()}
+        self.points = {p: tuple(sort_key(metric, v[metric]) for metric in self.metrics)
+                       for p, v in self.values.items()}
+
+        # per metric, the sort keys in ascending order and the participants holding them
+        if ranking is None:
+            ranking = {metric: sorted(self.values, key=lambda p, i=i: self.points[p][i])
+                       for i, metric in enumerate(self.metrics)}
+        self.ids = {metric: list(ranking[metric]) for metric in self.metrics}
+        self.keys = {metric: [self.points[p][i] for p in self.ids[metric]] for i, metric in enumerate(self.metrics)}
+
+        # (twice the rank sum, participant id) of every row, in table order
+        self.order = [(self.rank_sum(p), p) for p in order or ()]
+        if len(self.order) != len(self.values) or any(a > b for a, b in zip(self.order, self.order[1:])):
+            self.order = sorted((self.rank_sum(p), p) for p in self.values)
+        self.sums = dict((p, s) for s, p in self.order)
+
+        if layers is None:
+            layers = pareto_layers(self.points)
+        self.layers = layers
+
+    def rank_sum(self, participant_id):
+        '''
+        Twice the sum of a participant's ranks (an integer: tied ranks end in .5).
+        '''
+        return sum(round(2 * self.rank(participant_id, metric)) for metric in self.metrics)
+
+    def reorder(self, participant_id, shift):
+        '''
+        Move a participant's row after its rank sum changed by shift (in half ranks).
+        '''
+        old = self.sums[participant_id]
+        del self.order[bisect.bisect_left(self.order, (old, participant_id))]
+        self.sums[participant_id] = old + shift
+        bisect.insort(self.order, (old + shift, participant_id))
+
+    def shift_behind(self, metric, key, step):
+        '''
+        Shift the ranks of the participants behind a key inserted (step 1) or removed (step -1):
+        one place behind it, half a place tied with it (average ranks).
+        '''
+        keys, ids = self.keys[metric], self.ids[metric]
+        lo, hi = bisect.bisect_left(keys, key), bisect.bisect_right(keys, key)
+        for p in ids[lo:hi]:
+            self.reorder(p, step)
+        for p in ids[hi:]:
+            self.reorder(p, 2 * step)
+
+    def add(self, participant_id, values):
+        '''
+        Insert (or replace) one participant with sorted insertion.
+        '''
+        if participant_id in self.values:
+            self.remove(participant_id)
+        self.values[participant_id] = {metric: values.get(metric) for metric in self.metrics}
+        point = self.points[participant_id] = tuple(sort_key(metric, v) for metric, v in
+                                                    self.values[participant_id].items())
+        for metric, key in zip(self.metrics, point):
+            self.shift_behind(metric, key, 1)
+            position = bisect.bisect_right(self.keys[metric], key)
+            self.keys[metric].insert(position, key)
+            self.ids[metric].insert(position, participant_id)
+        self.sums[participant_id] = self.rank_sum(participant_id)
+        bisect.insort(self.order, (self.sums[participant_id], participant_id))
+
+        ahead, behind = self.around(point)
+        self.layers[participant_id] = 1 + max((self.layers[p] for p in ahead
+                                               if dominates(self.points[p], point)), default=0)
+        # only the participants it dominates can move to a deeper layer; in lexicographic order,
+        # a participant comes after every one dominating it
+        below = sorted((p for p in behind if dominates(point, self.points[p])), key=self.points.get)
+        for i, p in enumerate(below):
+            deeper = max((self.layers[q] for q in [participant_id] + below[:i]
+                          if dominates(self.points[q], self.points[p])), default=0) + 1
+            self.layers[p] = max(self.layers[p], deeper)
+
+    def remove(self, participant_id):
+        point = self.points.pop(participant_id)
+        del self.values[participant_id]
+        old_sum = self.sums.pop(participant_id)
+        del self.order[bisect.bisect_left(self.order, (old_sum, participant_id))]
+        for metric, key in zip(self.metrics, point):
+            keys, ids = self.keys[metric], self.ids[metric]
+            position = ids.index(participant_id, bisect.bisect_left(keys, key), bisect.bisect_right(keys, key))
+            del keys[position]
+            del ids[position]
+            self.shift_behind(metric, key, -1)
+
+        del self.layers[participant_id]
+        _, behind = self.around(point)
+        for p in sorted((p for p in behind if dominates(point, self.points[p])), key=self.points.get):
+            ahead, _ = self.around(self.points[p])
+            self.layers[p] = 1 + max((self.layers[q] for q in ahead
+                                      if dominates(self.points[q], self.points[p])), default=0)
+
+    def around(self, point):
+        '''
+        Participants that may dominate sort keys point (as good on the first metric) and
+        that point may dominate (no better on it), from the first metric's sorted keys.
+        '''
+        keys, ids = self.keys[self.metrics[0]], self.ids[self.metrics[0]]
+        return (ids[:bisect.bisect_right(keys, point[0])], ids[bisect.bisect_left(keys, point[0]):])
+
+    def rank(self, participant_id, metric):
+        '''
+        1-based rank of a participant on a metric; ties share their average rank.
+        '''
+        key = sort_key(metric, self.values[participant_id][metric])
+        keys = self.keys[metric]
+        return (bisect.bisect_left(keys, key) + 1 + bisect.bisect_right(keys, key)) / 2
+
+    def ranks(self, participant_id):
+        '''
+        Ranks of a participant, one per metric.
+        '''
+        return {metric: self.rank(participant_id, metric) for metric in self.metrics}
+
+    def table(self):
+        '''
+        Leaderboard rows by mean rank (and so Borda count), then participant id.
+        '''
+        n = len(self.values)
+        rows = []
+        for position, (_, participant_id) in enumerate(self.order, 1):
+            participant_ranks = self.ranks(participant_id)
+            rows.append({
+                "participant_id": participant_id,
+                "values": self.values[participant_id],
+                "ranks": participant_ranks,
+                "mean_rank": sum(participant_ranks.values()) / len(self.metrics),
+                "borda": sum(n - r for r in participant_ranks.values()),
+                "pareto_layer": self.layers[participant_id],
+                "position": position,
+            })
+        return rows
+
+
+def pareto_layers(points, chunk=1024):
+    '''
+    Depth of the Pareto layer of every participant, on sort keys (lower is better):
+    a participant is dominated by one as good on every metric and better on one.
+    Input:
+    points: dict of participant id -> list of sort keys (or ranks), one per metric
+    Returns:
+    dict of participant id -> layer, 1 for the non-dominated participants
+    '''
+    import numpy as np
+
+    if not points:
+        return {}
+    participants = list(points)
+    points = np.array([points[p] for p in participants], dtype=float).reshape(len(participants), -1)
+    layer_of = np.zeros(len(participants), dtype=int)
+
+    # dominated_by[i, j]: j dominates i
+    dominated_by = np.zeros((len(points), len(points)), dtype=bool)
+    for start in range(0, len(points), chunk):
+        block = points[start:start + chunk]
+        as_good = np.ones((len(block), len(points)), dtype=bool)
+        better = np.zeros((len(block), len(points)), dtype=bool)
+        for m in range(points.shape[1]):
+            as_good &= points[None, :, m] <= block[:, None, m]
+            better |= points[None, :, m] < block[:, None, m]
+        dominated_by[start:start + chunk] = as_good & better
+
+    # non-dominated sorting: peel the participants no remaining one dominates
+    dominators = dominated_by.sum(axis=1)
+    front = dominators == 0
+    depth = 0
+    while front.any():
+        depth += 1
+        layer_of[front] = depth
+        dominators = dominators - dominated_by[:, front].sum(axis=1)
+        dominators[layer_of > 0] = -1
+        front = dominators == 0
+    return dict(zip(participants, layer_of.tolist()))
+
+
+def leaderboard_from_aggregation(item):
+    '''
+    Rebuild the Leaderboard stored in a leaderboard aggregation object.
+    '''
+    inline_data = item["datalink"]["inline_data"]
+    metrics = inline_data["visualization"]["metrics"]
+    rows = inline_data["challenge_participants"]
+    values = {row["participant_id"]: row.get("values", {}) for row in rows}
+
+    ranking = order = layers = None
+    stored = inline_data.get("sorted_participants")
+    if stored and all(len(stored.get(m, [])) == len(values) and set(stored[m]) == values.keys() for m in metrics):
+        # the stored orders and layers spare sorting and ranking everybody again
+        ranking = {m: stored[m] for m in metrics}
+        order = [row["participant_id"] for row in rows]
+        if all("pareto_layer" in row for row in rows):
+            layers = {row["participant_id"]: row["pareto_layer"] for row in rows}
+    return Leaderboard(metrics, values, ranking, order, layers)
+
+
+def update_leaderboard_aggregation(item, participants):
+    '''
+    Add participants to a leaderboard aggregation object and refresh its rows.
+    Input:
+    item: leaderboard aggregation object, updated in place
+    participants: dict of participant id -> {metric id: value}, added or replaced
+    Returns:
+    item
+    '''
+    leaderboard = leaderboard_from_aggregation(item)
+    for participant_id, values in participants.items():
+        leaderboard.add(participant_id, values)
+
+    inline_data = item["datalink"]["inline_data"]
+    inline_data["challenge_participants"] = leaderboard.table()
+    inline_data["sorted_participants"] = leaderboard.ids
+    return item
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
-import io
-import json
 import os
 import fnmatch
 from argparse import ArgumentParser
 
+from aggregation import check_oeb_objects
+import oeb_json  # importable once aggregation is (see aggregation.SCHEMAS_DIR)
+import profiling
+
+# objects schema-checked (and held in memory) at a time while the consolidated result is written
+BATCH_SIZE = 5000
+
 
 def main(args):
     # input parameters
@@ -20,50 +25,51 @@ def main(args):
     metrics_data = [m.strip('[').strip(']').strip(',') for m in metrics_data]
     validation_data = [v.strip('[').strip(']').strip(',') for v in validation_data]
 
-    # This is the final consolidated output
-    data_model_file = []
-
-    # get the output files from previous steps and concatenate
+    # the sources of the final consolidated output, in order:
+    sources = []
     # 1. from validation ("validated_participant_data")
     for v in validation_data:
-        data_model_file = join_json_files(v, data_model_file, "*.json")
+        sources.append((v, "*.json"))
 
     # 2. proceed with objects from Manifest...
-    data_model_file = join_json_files(manifest_data, data_model_file, "*.json")
+    sources.append((manifest_data, "*.json"))
 
     # ...and 3. from metrics ("assessment_out")
     for m in metrics_data:
-        data_model_file = join_json_files(m, data_model_file, "*.json")
+        sources.append((m, "*.json"))
 
     # 4. from consolidation part 1 (manage_assessment_data.py), "sample_out/results/challenge/challenge.json"
     # we have to do that for all challenges in the list
     for challenge in challenges:
         challenge = challenge.replace('.', '_')
-        c_aggregation_data = os.path.join(outdir, challenge)
-        data_model_file = join_json_files(c_aggregation_data, data_model_file, "*" + challenge + "*.json")
-
-    # write the merged data model file to json output
-    with open(consolidated_result, mode='w', encoding="utf-8") as f:
-        json.dump(data_model_file, f, sort_keys=True, indent=4, separators=(',', ': '))
-
-def join_json_files(data_directory, data_model_file, file_extension):
-    '''Add contents of specified file(s) to given json file
+        sources.append((os.path.join(outdir, challenge), "*" + challenge + "*.json"))
+
+    # stream the objects into the merged data model file, checking them batch by batch;
+    # the file only replaces a previous result once every object has passed (and never a higher tier)
+    with oeb_json.ArrayWriter(consolidated_result, tier=args.tier) as out:
+        batch = []
+        for data_directory, file_extension in sources:
+            for obj in iter_json_files(data_directory, file_extension):
+                batch.append(obj)
+                if len(batch) == BATCH_SIZE:
+                    check_oeb_objects(batch)
+                    out.extend(batch)
+                    batch = []
+        check_oeb_objects(batch)
+        out.extend(batch)
+
+def iter_json_files(data_directory, file_extension):
+    '''Yield the json objects (dicts) of the specified file(s) one at a time
     Input:
-    data_directory: Directory containing the file(s) to be added
-    data_model_file: list to be extended with json objects (dicts)
-    file_extension: filename or pattern to be matched, of the file(s) to be added
+    data_directory: File, or directory containing the file(s), to be read
+    file_extension: filename or pattern to be matched, of the file(s) to be read
     Returns:
-    data_model_file: data_model_file (which is a list) from input, extended by the json objects from the input file(s)
+    generator of the json objects of the file(s); a file holding a list yields its elements
     '''
 
     # add minimal datasets to data model file
     if os.path.isfile(data_directory):
-        with io.open(data_directory, mode='r', encoding="utf-8") as f:
-            content = json.load(f)
-            if isinstance(content, dict):
-                data_model_file.append(content)
-            else:
-                data_model_file.extend(content)
+        yield from oeb_json.iter_objects(data_directory)
 
     elif os.path.isdir(data_directory):  # if it is a directory loop over all files and search for the file with the given "extension" (=pattern, can be name)
 
@@ -71,27 +77,38 @@ def join_json_files(data_directory, data_model_file, file_extension):
             for file in files:
                 abs_result_file = os.path.join(subdir, file)
                 if fnmatch.fnmatch(file, file_extension) and os.path.isfile(abs_result_file):
-                    with io.open(abs_result_file, mode='r', encoding="utf-8") as f:
-                        content = json.load(f)
-                        if isinstance(content, dict):
-                            data_model_file.append(content)
-                        else:
-                            data_model_file.extend(content)
+                    yield from oeb_json.iter_objects(abs_result_file)
 
+def join_json_files(data_directory, data_model_file, file_extension):
+    '''Add contents of specified file(s) to given json file
+    Input:
+    data_directory: Directory containing the file(s) to be added
+    data_model_file: list to be extended with json objects (dicts)
+    file_extension: filename or pattern to be matched, of the file(s) to be added
+    Returns:
+    data_model_file: data_model_file (which is a list) from input, extended by the json objects from the input file(s)
+    '''
+    data_model_file.extend(iter_json_files(data_directory, file_extension))
     return data_model_file
 
 
 
-if __name__ == '__main__':
-
+def parse_arguments():
     parser = ArgumentParser()
     parser.add_argument("-v", "--validation_data", nargs="+", help="path to validated_result.json", required=True)
     parser.add_argument("-m", "--metrics_data", nargs="+", help="path to assessment_results.json", required=True)
     parser.add_argument("-c", "--challenges_ids", help="Ids of the challenges, separated by space", nargs='+', required=True)
     parser.add_argument("-a", "--outdir", help="output path where the minimal dataset JSON file will be written", required=True)
     parser.add_argument("-o", "--consolidated_result", help="Path to the consolidated result JSON file", required=True)
+    parser.add_argument("--tier", type=int, choices=[1, 2],
+                        help="Progressive results: 1 = provisional, 2 = final, replacing the provisional result")
+    profiling.add_arguments(parser)
+    return parser
+
+
+if __name__ == '__main__':
 
-    args = parser.parse_args()
+    args = parse_arguments().parse_args()
 
-    main(args)
+    profiling.run(main, args, args.consolidated_result, "merge")
 
@@ -0,0 +1,178 @@
+'''
+Columnar store of the participants' metrics of one challenge.
+
+The store is the source of truth of the bar-plot and 2D-plot aggregation objects:
+one row per (participant, metric) with the value and its error, kept in
+<challenge_dir>/participants.npy as a NumPy structured array. The
+challenge_participants lists of the aggregation objects are generated from it
+(see aggregation.add_to_aggregation), and charts read their series from it
+with vectorised queries instead of walking those lists:
+
+    store = ParticipantStore.open(challenge_dir)       # memory-mapped, read-only
+    tools, x, y = store.series("sensitivity", "specificity")
+    q1, median, q3 = store.quartiles("roc_auc")
+
+Rows are kept in insertion order, so participants come out in the order they
+were added; re-adding a participant replaces its rows. Only numeric values are
+stored (None is stored as NaN); curves and other list values are left out, as
+they cannot be plotted.
+'''
+import logging
+import numbers
+import os
+
+import numpy as np
+
+import oeb_json
+
+STORE_FILE = "participants.npy"
+
+# plot types whose participants come from the store (aggregation.Visualisations)
+BARPLOT = "bar-plot"
+TWODPLOT = "2D-plot"
+
+
+def store_file(challenge_dir):
+    return os.path.join(challenge_dir, STORE_FILE)
+
+
+def row_dtype(width_participant, width_metric):
+    return [("participant", f"U{max(width_participant, 1)}"), ("metric", f"U{max(width_metric, 1)}"),
+            ("value", "f8"), ("error", "f8")]
+
+
+def make_rows(participants, metrics, values, errors):
+    rows = np.empty(len(participants), dtype=row_dtype(max(map(len, participants), default=0),
+                                                       max(map(len, metrics), default=0)))
+    rows["participant"] = participants
+    rows["metric"] = metrics
+    rows["value"] = values
+    rows["error"] = errors
+    return rows
+
+
+def as_number(value):
+    if value is None:
+        return float("nan")
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+class ParticipantStore:
+    '''
+    (participant, metric, value, error) rows of one challenge.
+    '''
+
+    def __init__(self, rows=None):
+        self.rows = rows if rows is not None else make_rows([], [], [], [])
+
+    @classmethod
+    def open(cls, challenge_dir, mmap=True):
+        '''
+        Store of a challenge directory (empty if it has none), memory-mapped read-only by default.
+        '''
+        path = store_file(challenge_dir)
+        if not os.path.isfile(path):
+            return cls()
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    @classmethod
+    def from_aggregation(cls, aggregation):
+        '''
+        Store of the participants already listed in bar-plot and 2D-plot aggregation objects
+        (e.g. those of a template that carries earlier results).
+        '''
+        found = {}
+        for item in aggregation:
+            plot = item["datalink"]["inline_data"]["visualization"]
+            for participant in item["datalink"]["inline_data"]["challenge_participants"]:
+                pid = participant["participant_id"]
+                if plot["type"] == BARPLOT:
+                    found[(pid, plot["metric"])] = participant.get("metric_value")
+                elif plot["type"] == TWODPLOT:
+                    found[(pid, plot["x_axis"])] = participant.get("metric_x")
+                    found[(pid, plot["y_axis"])] = participant.get("metric_y")
+
+        store = cls()
+        by_participant = {}
+        for (pid, metric), value in found.items():
+            by_participant.setdefault(pid, {})[metric] = (value, None)
+        for pid, values in by_participant.items():
+            store.put(pid, values)
+        return store
+
+    def save(self, challenge_dir, tier=None):
+        '''
+        Atomically replace the store file of a challenge directory.
+        With a tier, it is recorded next to the store (<store>.tier) and a store of a higher
+        tier is not replaced, as with oeb_json.dump_tier. Returns whether the store was written.
+        '''
+        path = store_file(challenge_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, np.asarray(self.rows))
+        if tier is None:
+            os.replace(tmp_path, path)
+            return True
+        if not oeb_json.replace_tier(lambda: os.replace(tmp_path, path), path, tier):
+            os.remove(tmp_path)
+            return False
+        return True
+
+    def put(self, participant_id, values):
+        '''
+        Add a participant, replacing its earlier rows.
+        values: dict of metric id -> (value, error); non-numeric values are skipped
+        '''
+        metrics, numbers_, errors = [], [], []
+        for metric, (value, error) in values.items():
+            number = as_number(value)
+            if number is None:
+                logging.debug(f"{participant_id}: {metric} is not a number, not stored")
+                continue
+            metrics.append(metric)
+            numbers_.append(number)
+            error = as_number(error)
+            errors.append(float("nan") if error is None else error)
+
+        kept = self.rows[self.rows["participant"] != participant_id]
+        new = make_rows([participant_id] * len(metrics), metrics, numbers_, errors)
+        # widen the string columns to the longer of both (4 bytes per character)
+        dtype = row_dtype(max(kept.dtype["participant"].itemsize, new.dtype["participant"].itemsize) // 4,
+                          max(kept.dtype["metric"].itemsize, new.dtype["metric"].itemsize) // 4)
+        self.rows = np.concatenate([kept.astype(dtype), new.astype(dtype)])
+
+    def participants(self):
+        '''
+        Participant ids, in the order they were added.
+        '''
+        ids, first = np.unique(self.rows["participant"], return_index=True)
+        return ids[np.argsort(first)]
+
+    def column(self, metric):
+        '''
+        (participants, values, errors) of one metric, in participant order.
+        '''
+        rows = self.rows[self.rows["metric"] == metric]
+        return rows["participant"], rows["value"], rows["error"]
+
+    def series(self, x_metric, y_metric):
+        '''
+        (participants, x values, y values) of the participants having both metrics, in participant order.
+        '''
+        x_ids, x_values, _ = self.column(x_metric)
+        y_ids, y_values, _ = self.column(y_metric)
+        order = np.argsort(y_ids)
+        pos = np.searchsorted(y_ids, x_ids, sorter=order)
+        pos = order[np.minimum(pos, len(order) - 1)] if len(order) else pos
+        found = (y_ids[pos] == x_ids) if len(order) else np.zeros(len(x_ids), dtype=bool)
+        return x_ids[found], x_values[found], y_values[pos[found]]
+
+    def quartiles(self, metric):
+        '''
+        First quartile, median and third quartile of a metric over the participants (NaN ignored).
+        '''
+        _, values, _ = self.column(metric)
+        if not np.isfinite(values).any():
+            return (float("nan"),) * 3
+        return tuple(float(q) for q in np.nanpercentile(values, [25, 50, 75]))
@@ -0,0 +1,399 @@
+'''
+Paired permutation tests between all participants of a challenge.
+
+Every binary metric of compute_metrics.py but the curves can be tested. Most
+are written as a function of per-case additive statistics (e.g. the tp/fp/fn/tn
+indicators of each case), so the metric of a whole batch of permuted
+submissions is one matrix product away: with the swap masks M (permutations x
+cases) and the per-case difference D = B - A,
+
+    sums(A') = sums(A) + M @ D        sums(B') = sums(B) - M @ D
+
+The rank-based ROC AUC and PR AUC (RANK_BASED) are not sums over the cases:
+they are computed from the permuted scores of the whole batch at once, with
+one row-wise sort.
+
+Each pair of participants is tested on its own process with its own child of
+the fixed seed, so the p-values do not depend on the number of workers. Given a
+checkpoint directory, every pair saves its progress there (see checkpoint.py),
+and a restarted run resumes each pair where it stopped with identical p-values.
+'''
+import os
+import glob
+import shutil
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from checkpoint import OVERHEAD_BUDGET, Checkpoint, fingerprint
+
+# permutations drawn per matrix product
+BATCH_SIZE = 1000
+
+# default number of permutations per participant pair
+N_PERMUTATIONS = 10000
+
+# equal-width probability bins of the calibration errors (calibration.N_BINS of the metrics stage)
+CALIBRATION_BINS = 10
+
+
+##########################################
+# Metric registry
+##########################################
+
+def _div(num, den):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den == 0, np.nan, num / np.where(den == 0, 1, den))
+
+
+def confusion_case_stats(df):
+    '''
+    Per-case tp, fp, fn, tn indicators of a binary per-case table.
+    '''
+    y = df["label"].astype(int).to_numpy()
+    p = df["predicted_label"].astype(int).to_numpy()
+    return np.stack([(y == 1) & (p == 1), (y == 0) & (p == 1),
+                     (y == 1) & (p == 0), (y == 0) & (p == 0)], axis=1).astype(float)
+
+
+def squared_error_case_stats(df):
+    '''
+    Per-case squared error of the predicted probability, and a count column for the mean.
+    '''
+    y = df["label"].astype(float).to_numpy()
+    s = df["predicted_probability"].astype(float).to_numpy()
+    return np.stack([(s - y) ** 2, np.ones_like(y)], axis=1)
+
+
+def log_loss_case_stats(df):
+    '''
+    Per-case log-loss of the predicted probability, and a count column for the mean.
+    '''
+    y = df["label"].astype(float).to_numpy()
+    s = np.clip(df["predicted_probability"].astype(float).to_numpy(), 1e-15, 1 - 1e-15)
+    return np.stack([-(y * np.log(s) + (1 - y) * np.log1p(-s)), np.ones_like(y)], axis=1)
+
+
+def calibration_case_stats(df):
+    '''
+    Per-case predicted probability, label and count, each in the column block of the case's
+    calibration bin (as in calibration.summarize_calibration).
+    '''
+    y = df["label"].astype(float).to_numpy()
+    s = df["predicted_probability"].astype(float).to_numpy()
+    bins = np.searchsorted(np.linspace(0.0, 1.0, CALIBRATION_BINS + 1)[1:-1], s, side="right")
+    stats = np.zeros((len(s), 3 * CALIBRATION_BINS))
+    rows = np.arange(len(s))
+    stats[rows, bins] = s
+    stats[rows, CALIBRATION_BINS + bins] = y
+    stats[rows, 2 * CALIBRATION_BINS + bins] = 1
+    return stats
+
+
+def score_case_stats(df):
+    '''
+    Per-case label and predicted probability, for the rank-based metrics.
+    '''
+    return np.stack([df["label"].astype(float).to_numpy(),
+                     df["predicted_probability"].astype(float).to_numpy()], axis=1)
+
+
+def _calibration_gaps(c):
+    score_sum, positives, count = np.split(c, 3, axis=1)
+    return np.abs(score_sum - positives), count
+
+
+def _ece(c):
+    gap, count = _calibration_gaps(c)
+    return _div(gap.sum(axis=1), count.sum(axis=1))
+
+
+def _mce(c):
+    gap, count = _calibration_gaps(c)
+    largest = np.max(np.where(count > 0, _div(gap, count), -np.inf), axis=1)
+    return np.where(np.isinf(largest), np.nan, largest)
+
+
+def _average_ranks(scores):
+    '''
+    1-based ranks of every row of scores (batch x cases); ties share their average rank.
+    '''
+    n = scores.shape[1]
+    order = np.argsort(scores, axis=1, kind="mergesort")
+    ordered = np.take_along_axis(scores, order, axis=1)
+    positions = np.broadcast_to(np.arange(n), ordered.shape)
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, positions, n)[:, ::-1], axis=1)[:, ::-1]
+    ranks = np.empty(scores.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=1)
+    return ranks
+
+
+def _roc_auc(y, scores):
+    '''
+    ROC AUC of every row of scores (batch x cases): Mann-Whitney U of the average ranks.
+    '''
+    positives = y == 1
+    n_pos, n_neg = int(positives.sum()), int((~positives).sum())
+    if not n_pos or not n_neg:
+        return np.full(len(scores), np.nan)
+    return (_average_ranks(scores)[:, positives].sum(axis=1) - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
+def _pr_auc(y, scores):
+    '''
+    PR AUC of every row of scores (batch x cases): trapezoids between the (recall, precision)
+    points of the distinct scores, from (0, 1), as the pr_curve of compute_metrics.py.
+    '''
+    n = scores.shape[1]
+    n_pos = int((y == 1).sum())
+    if not n_pos or n_pos == n:
+        return np.full(len(scores), np.nan)
+    order = np.argsort(-scores, axis=1, kind="mergesort")
+    ordered = np.take_along_axis(scores, order, axis=1)
+    tps = np.cumsum(y[order], axis=1)
+    precision = tps / np.arange(1, n + 1)
+    recall = tps / n_pos
+    # the points are the last case of every score
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[:, :-1] = ordered[:, 1:] != ordered[:, :-1]
+    # the point before each case: the last end ahead of it (-1: the starting point (0, 1))
+    previous = np.full(ordered.shape, -1)
+    previous[:, 1:] = np.maximum.accumulate(np.where(ends, np.arange(n), -1), axis=1)[:, :-1]
+    start = previous < 0
+    previous = np.maximum(previous, 0)
+    recall_before = np.where(start, 0.0, np.take_along_axis(recall, previous, axis=1))
+    precision_before = np.where(start, 1.0, np.take_along_axis(precision, previous, axis=1))
+    trapezoids = (recall - recall_before) * (precision + precision_before) / 2
+    return np.where(ends, trapezoids, 0.0).sum(axis=1)
+
+
+def _mcc(c):
+    tp, fp, fn, tn = c.T
+    return _div(tp * tn - fp * fn, np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn)))
+
+
+def _kappa(c):
+    tp, fp, fn, tn = c.T
+    n = tp + fp + fn + tn
+    observed = _div(tp + tn, n)
+    expected = _div((tp + fp) * (tp + fn) + (fn + tn) * (fp + tn), n * n)
+    return _div(observed - expected, 1 - expected)
+
+
+# metric id -> (per-case statistics of a per-case table, metric of the (batch x statistics) sums,
+# or for RANK_BASED metrics of the labels and the (batch x cases) scores)
+METRICS = {
+    "accuracy":          (confusion_case_stats, lambda c: _div(c[:, 0] + c[:, 3], c.sum(axis=1))),
+    "sensitivity":       (confusion_case_stats, lambda c: _div(c[:, 0], c[:, 0] + c[:, 2])),
+    "specificity":       (confusion_case_stats, lambda c: _div(c[:, 3], c[:, 3] + c[:, 1])),
+    "precision":         (confusion_case_stats, lambda c: _div(c[:, 0], c[:, 0] + c[:, 1])),
+    "npv":               (confusion_case_stats, lambda c: _div(c[:, 3], c[:, 3] + c[:, 2])),
+    "f1_score":          (confusion_case_stats, lambda c: _div(2 * c[:, 0], 2 * c[:, 0] + c[:, 1] + c[:, 2])),
+    "balanced_accuracy": (confusion_case_stats, lambda c: (_div(c[:, 0], c[:, 0] + c[:, 2])
+                                                           + _div(c[:, 3], c[:, 3] + c[:, 1])) / 2),
+    "cohen_kappa":       (confusion_case_stats, _kappa),
+    # with two classes the quadratic weights are the unweighted kappa's
+    "weighted_cohen_kappa": (confusion_case_stats, _kappa),
+    "matthews_corrcoef": (confusion_case_stats, _mcc),
+    "brier_score":       (squared_error_case_stats, lambda c: _div(c[:, 0], c[:, 1])),
+    "log_loss":          (log_loss_case_stats, lambda c: _div(c[:, 0], c[:, 1])),
+    "expected_calibration_error": (calibration_case_stats, _ece),
+    "max_calibration_error":      (calibration_case_stats, _mce),
+    "roc_auc":           (score_case_stats, _roc_auc),
+    "pr_auc":            (score_case_stats, _pr_auc),
+}
+
+# metrics of METRICS computed from the permuted scores rather than from summed statistics
+RANK_BASED = {"roc_auc", "pr_auc"}
+
+
+def metric_value(metric, stats):
+    '''
+    Value of metric for one participant's per-case statistics.
+    '''
+    statistic = METRICS[metric][1]
+    if metric in RANK_BASED:
+        return float(statistic(stats[:, 0], stats[None, :, 1])[0])
+    return float(statistic(stats.sum(axis=0)[None, :])[0])
+
+
+##########################################
+# Per-case tables
+##########################################
+
+def read_cases(cases_dir, challenge_id):
+    '''
+    Read the per-case tables written by compute_metrics.py --cases_dir for one challenge.
+    Input:
+    cases_dir: directory holding <challenge>/<participant>.csv
+    challenge_id: challenge whose tables are read
+    Returns:
+    dict of participant id -> DataFrame, restricted to the images all participants share and sorted by image
+    '''
+    import pandas as pd
+
+    paths = sorted(glob.glob(os.path.join(cases_dir, challenge_id.replace('.', '_'), "*.csv")))
+    cases = {os.path.splitext(os.path.basename(p))[0]: pd.read_csv(p, dtype={"image": str}) for p in paths}
+    if not cases:
+        return {}
+
+    common = set.intersection(*(set(df["image"]) for df in cases.values()))
+    for participant, df in cases.items():
+        if len(df) != len(common):
+            logging.warning(
+                f"Participant {participant}: {len(df) - len(common)} case(s) not shared by all participants are left out of the tests")
+
+    return {participant: df[df["image"].isin(common)].sort_values("image").reset_index(drop=True)
+            for participant, df in cases.items()}
+
+
+##########################################
+# Tests
+##########################################
+
+def permutation_test(stats_a, stats_b, metric, n_permutations, seed, batch_size=BATCH_SIZE, checkpoint=None):
+    '''
+    Two-sided paired permutation test of metric(A) - metric(B).
+    Input:
+    stats_a, stats_b: (cases x statistics) per-case statistics of both participants
+    metric: metric id in METRICS
+    n_permutations: number of random swap masks
+    seed: numpy SeedSequence (or int) of this pair
+    checkpoint: optional Checkpoint to resume from and to save the count and generator state to
+    Returns:
+    observed difference, p-value
+    '''
+    statistic = METRICS[metric][1]
+    observed = metric_value(metric, stats_a) - metric_value(metric, stats_b)
+    if np.isnan(observed):
+        return observed, float("nan")
+
+    rng = np.random.default_rng(seed)
+    as_extreme = 0
+    done = 0
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None and "rng" in state:
+        rng.bit_generator.state = state["rng"]
+        as_extreme, done = state["as_extreme"], state["done"]
+
+    while done < n_permutations:
+        batch = min(batch_size, n_permutations - done)
+        masks = rng.random((batch, len(stats_a))) < 0.5
+        if metric in RANK_BASED:
+            # the labels are the same: swap the scores
+            labels, score_a, score_b = stats_a[:, 0], stats_a[:, 1], stats_b[:, 1]
+            permuted = (statistic(labels, np.where(masks, score_b, score_a))
+                        - statistic(labels, np.where(masks, score_a, score_b)))
+        else:
+            swaps = masks.astype(float) @ (stats_b - stats_a)
+            permuted = statistic(stats_a.sum(axis=0) + swaps) - statistic(stats_b.sum(axis=0) - swaps)
+        # tolerance so that permutations equal to the observed value count as extreme
+        as_extreme += int(np.sum(np.abs(permuted) >= abs(observed) - 1e-12))
+        done += batch
+        if checkpoint is not None and done < n_permutations and checkpoint.due():
+            checkpoint.save({"rng": rng.bit_generator.state, "as_extreme": as_extreme, "done": done})
+
+    return observed, (as_extreme + 1) / (n_permutations + 1)
+
+
+def seed_key(seed):
+    '''
+    Reproducible description of an int or SeedSequence seed, for checkpoint fingerprints.
+    '''
+    if isinstance(seed, np.random.SeedSequence):
+        return seed.entropy, seed.spawn_key
+    return seed
+
+
+def _test_pair(args):
+    participant_a, participant_b, stats_a, stats_b, metric, n_permutations, seed, checkpoint_path, budget = args
+    checkpoint = None
+    if checkpoint_path:
+        checkpoint = Checkpoint(checkpoint_path, budget=budget, key=fingerprint(
+            participant_a, participant_b, stats_a, stats_b, metric, n_permutations, seed_key(seed), BATCH_SIZE))
+        state = checkpoint.load()
+        if state is not None and "result" in state:
+            return state["result"]
+
+    observed, p_value = permutation_test(stats_a, stats_b, metric, n_permutations, seed, checkpoint=checkpoint)
+    result = {
+        "participant_a": participant_a,
+        "participant_b": participant_b,
+        "difference": observed,
+        "p_value": p_value,
+    }
+    if checkpoint is not None and checkpoint.due():
+        checkpoint.save({"result": result})
+    return result
+
+
+def pairwise_tests(cases, metric, n_permutations=N_PERMUTATIONS, seed=0, workers=None,
+                   checkpoint_dir=None, checkpoint_budget=OVERHEAD_BUDGET):
+    '''
+    Run the permutation test of metric for every pair of participants.
+    Input:
+    cases: dict of participant id -> aligned per-case table (see read_cases)
+    metric: metric id in METRICS
+    n_permutations, seed: number of permutations and the fixed seed shared by all pairs
+    workers: number of processes (default: number of CPUs; 1 runs in this process)
+    checkpoint_dir: optional directory of the per-pair checkpoints (pair_<i>.json), resumed if present
+    checkpoint_budget: fraction of the run time that may be spent saving checkpoints
+    Returns:
+    list of participant values ({participant_id, metric_value}) and list of pair results
+    '''
+    case_stats = METRICS[metric][0]
+    participants = sorted(cases)
+    stats = {p: case_stats(cases[p]) for p in participants}
+    values = [{"participant_id": p, "metric_value": metric_value(metric, stats[p])} for p in participants]
+
+    pairs = [(a, b) for i, a in enumerate(participants) for b in participants[i + 1:]]
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs))
+    tasks = [(a, b, stats[a], stats[b], metric, n_permutations, s,
+              os.path.join(checkpoint_dir, f"pair_{i}.json") if checkpoint_dir else None, checkpoint_budget)
+             for i, ((a, b), s) in enumerate(zip(pairs, seeds))]
+
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if workers == 1:
+        results = [_test_pair(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_test_pair, tasks))
+
+    return values, results
+
+
+def significance_aggregation(community_id, event, challenge_id, metric, cases, n_permutations=N_PERMUTATIONS,
+                             seed=0, workers=None, checkpoint_dir=None, checkpoint_budget=OVERHEAD_BUDGET):
+    '''
+    Build the significance-heatmap aggregation object of one metric of a challenge.
+    The checkpoints of its tests (in checkpoint_dir/<metric>) are removed once all pairs are done.
+    '''
+    metric_checkpoints = os.path.join(checkpoint_dir, metric) if checkpoint_dir else None
+    values, results = pairwise_tests(cases, metric, n_permutations, seed, workers,
+                                     metric_checkpoints, checkpoint_budget)
+    if metric_checkpoints:
+        shutil.rmtree(metric_checkpoints, ignore_errors=True)
+    return {
+        "_id": f"{community_id}:{event}_{challenge_id}_agg:{metric}_significance",
+        "challenges_ids": [challenge_id],
+        "datalink": {
+            "inline_data": {
+                "challenge_participants": values,
+                "pairwise_tests": results,
+                "visualization": {
+                    "type": "significance-heatmap",
+                    "metric": metric,
+                    "test": "paired permutation, two-sided",
+                    "permutations": n_permutations,
+                    "seed": seed,
+                }
+            }
+        },
+        "type": "aggregation"
+    }
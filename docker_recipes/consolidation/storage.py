@@ -0,0 +1,113 @@
+'''
+Storage of the consolidation results in an output directory shared by concurrent runs.
+
+* Every file is written to a temporary file that then replaces it (oeb_json.replace),
+  so readers (e.g. merge_data_model_files.py) never see a half-written file.
+* Each challenge directory has an advisory lock (<challenge_dir>/.lock, flock),
+  the Manifest one of its own (Manifest.json.lock), only ever taken while holding
+  a challenge lock. Runs that touch different challenges only wait for each other
+  while merging their Manifest entries.
+* Aggregation files are updated optimistically: a run reads the file and its
+  version, builds the new objects without holding the lock, and commits them
+  under the lock if the version has not changed meanwhile; otherwise it rebuilds
+  them from the newer file while holding the lock, so it cannot lose the race
+  twice. As files are only ever replaced by rename, (inode, size, mtime)
+  identifies a version.
+
+flock is advisory and per host (see oeb_schemas/locking.py); on file systems without
+it (or on Windows) the optimistic check alone still detects concurrent updates.
+'''
+import logging
+import os
+
+import oeb_json
+from locking import locked
+
+LOCK_FILE = ".lock"
+LOCK_SUFFIX = ".lock"
+
+# reads of a file that keeps being replaced before giving up
+MAX_ATTEMPTS = 10
+
+
+class VersionConflict(RuntimeError):
+    '''
+    A file kept changing while being read for MAX_ATTEMPTS rounds.
+    '''
+
+
+def challenge_lock_path(challenge_dir):
+    return os.path.join(challenge_dir, LOCK_FILE)
+
+
+def version(path):
+    '''
+    Version of a file: (inode, size, mtime_ns), or None if it does not exist.
+    '''
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def read_versioned(path):
+    '''
+    Contents of a JSON file and their version; (None, None) if it does not exist.
+    '''
+    for _ in range(MAX_ATTEMPTS):
+        before = version(path)
+        if before is None:
+            return None, None
+        try:
+            data = oeb_json.load(path)
+        except FileNotFoundError:
+            continue
+        # replaced while being read: read the new file
+        if version(path) == before:
+            return data, before
+    raise VersionConflict(f"{path} changed while being read {MAX_ATTEMPTS} times")
+
+
+def update(path, build, lock_path, tier=None, commit=None):
+    '''
+    Optimistic read-modify-write of the JSON file path.
+    Input:
+    build: function of the current contents (None if there is no file) returning the new contents;
+           called without the lock, and once more under it if another run replaced path meanwhile
+    lock_path: advisory lock held while committing
+    tier: progressive results tier of the write (see oeb_json.dump_tier)
+    commit: optional function of the new contents, run under the lock after writing them
+            (files derived from them, e.g. charts); not run if path holds results of a higher tier
+    Returns:
+    the new contents, or the contents of path if they are of a higher tier
+    '''
+    current, current_version = read_versioned(path)
+    new = build(current)
+    with locked(lock_path):
+        if version(path) != current_version:
+            # lost the race: rebuild from the newer file, now that no other run can commit
+            logging.info(f"{path} was updated by another run, rebuilding")
+            current, current_version = read_versioned(path)
+            new = build(current)
+        if not oeb_json.dump_tier(new, path, tier):
+            # a later tier is already there: neither the file nor what derives from it is touched
+            logging.info(f"{path} holds results of a higher tier than {tier}, left as is")
+            return current
+        if commit is not None:
+            commit(new)
+    return new
+
+
+def merge_manifest(manifest, path, tier=None):
+    '''
+    Write the manifest objects of some challenges into the Manifest file path, keeping the
+    entries of the other challenges; an entry replaces the one with the same id.
+    Returns the merged manifest.
+    '''
+    def build(current):
+        merged = {obj["id"]: obj for obj in current or []}
+        merged.update((obj["id"], obj) for obj in manifest)
+        return list(merged.values())
+
+    return update(path, build, path + LOCK_SUFFIX, tier)
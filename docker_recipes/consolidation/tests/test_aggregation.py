@@ -0,0 +1,31 @@
+import logging
+
+import pytest
+
+import aggregation
+
+
+def metric(value):
+    return {"metrics": {"value": value, "stderr": 0}}
+
+
+def leaderboard_item(metrics):
+    return {"type": "aggregation", "datalink": {"inline_data": {
+        "visualization": {"type": "leaderboard", "metrics": metrics}, "challenge_participants": []}}}
+
+
+def test_leaderboard_ranks_the_new_participants():
+    item = leaderboard_item(["accuracy", "f1_score"])
+    aggregation.add_participants_to_aggregation([item], {
+        "a": {"accuracy": metric(0.9), "f1_score": metric(0.8)},
+        "b": {"accuracy": metric(0.8), "f1_score": metric(0.8)},
+    })
+    rows = item["datalink"]["inline_data"]["challenge_participants"]
+    assert [(row["participant_id"], row["pareto_layer"]) for row in rows] == [("a", 1), ("b", 2)]
+
+
+def test_leaderboard_metric_missing_from_a_participant_is_logged(caplog):
+    item = leaderboard_item(["accuracy", "f1_score"])
+    with caplog.at_level(logging.ERROR), pytest.raises(KeyError, match="f1_score"):
+        aggregation.add_participants_to_aggregation([item], {"a": {"accuracy": metric(0.9)}})
+    assert "does not contain data for metrics f1_score" in caplog.text
@@ -0,0 +1,18 @@
+import warnings
+
+from assessment_chart import assessment_chart
+
+
+def barplot_aggregation(n):
+    return {"_id": "OEBC:E_C1_barplot",
+            "datalink": {"inline_data": {"visualization": {"type": "bar-plot", "metric": "roc_auc"},
+                                         "challenge_participants": [
+                                             {"participant_id": f"tool{i}", "metric_value": i / n} for i in range(n)]}}}
+
+
+def test_large_scale_barplot_draws_no_legend(tmp_path):
+    n = assessment_chart.LARGE_SCALE_THRESHOLD + 10
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assessment_chart.print_barplot(str(tmp_path), barplot_aggregation(n), "C1")
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,59 @@
+import logging
+import os
+
+import backfill
+import oeb_json
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "..", "..", "input_data", "minimal_aggregation_template.json")
+
+
+def write_assessments(directory, challenge, participant, metrics):
+    objects = [{"_id": f"C:E_{challenge}_{participant}:{metric}", "challenge_id": challenge, "community_id": "C",
+                "metrics": {"metric_id": metric, "stderr": 0.0, "value": value},
+                "participant_id": participant, "type": "assessment"}
+               for metric, value in metrics.items()]
+    oeb_json.dump(objects, os.path.join(directory, f"{challenge}_{participant}.json"))
+
+
+def run(tmp_path):
+    options = backfill.parse_arguments().parse_args([
+        "-a", str(tmp_path / "assessments"), "-t", TEMPLATE, "-o", str(tmp_path / "out"), "-j", "1",
+        "--chart_format", "png"])
+    return backfill.main(options)
+
+
+def modified(tmp_path, challenge):
+    path = tmp_path / "out" / "E" / challenge / f"{challenge}.json"
+    return path.stat().st_mtime_ns
+
+
+def test_only_changed_challenges_are_rebuilt(tmp_path, caplog):
+    assessments = tmp_path / "assessments"
+    assessments.mkdir()
+    for challenge in ("CH1", "CH2"):
+        for i, participant in enumerate(("toolA", "toolB")):
+            write_assessments(assessments, challenge, participant, {"sensitivity": 0.5 + i / 10, "specificity": 0.6})
+
+    caplog.set_level(logging.INFO)
+    assert run(tmp_path) == 0
+    assert "2 to rebuild, 0 unchanged" in caplog.text
+    manifest = oeb_json.load(str(tmp_path / "out" / "E" / "Manifest.json"))
+    assert manifest == [{"id": "CH1", "participants": ["toolA", "toolB"]},
+                        {"id": "CH2", "participants": ["toolA", "toolB"]}]
+    before = {challenge: modified(tmp_path, challenge) for challenge in ("CH1", "CH2")}
+
+    caplog.clear()
+    assert run(tmp_path) == 0
+    assert "0 to rebuild, 2 unchanged" in caplog.text
+    assert {challenge: modified(tmp_path, challenge) for challenge in ("CH1", "CH2")} == before
+
+    # a new participant in CH2 only
+    write_assessments(assessments, "CH2", "toolC", {"sensitivity": 0.9, "specificity": 0.1})
+    caplog.clear()
+    assert run(tmp_path) == 0
+    assert "1 to rebuild, 1 unchanged" in caplog.text
+    assert modified(tmp_path, "CH1") == before["CH1"]
+    assert modified(tmp_path, "CH2") != before["CH2"]
+    assert os.path.isfile(tmp_path / "out" / "E" / "CH2" / "toolC.json")
+    consolidated = oeb_json.load(str(tmp_path / "out" / "E" / "consolidated_result.json"))
+    assert {"id": "CH2", "participants": ["toolA", "toolB", "toolC"]} in consolidated
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import case_analytics
+import case_matrix
+
+
+def fill_matrix(cases_dir, correct, scores):
+    images = [f"img_{i:03d}" for i in range(correct.shape[1])]
+    path = case_matrix.matrix_path(str(cases_dir), "A")
+    for i, (right, score) in enumerate(zip(correct, scores)):
+        # written in reverse case order: the matrix sorts the cases
+        case_matrix.write_outcomes(path, f"tool_{i}", images[::-1], right[::-1], score[::-1])
+    return case_matrix.open_matrix(str(cases_dir), "A")
+
+
+def test_matrix_round_trip_and_replaced_rows(tmp_path):
+    rng = np.random.default_rng(0)
+    correct = rng.random((4, 13)) < 0.6  # 13 cases: the bit rows are padded
+    scores = rng.random((4, 13)).astype(np.float32)
+    matrix = fill_matrix(tmp_path, correct, scores)
+    np.testing.assert_array_equal(matrix.correct(), correct)
+    np.testing.assert_array_equal(matrix.scores(), scores)
+
+    # scoring tool_1 again adds a row that replaces its old one
+    case_matrix.write_outcomes(matrix.path, "tool_1", matrix.cases, ~correct[1], scores[1])
+    matrix = case_matrix.open_matrix(str(tmp_path), "A")
+    assert matrix.participants == ["tool_0", "tool_1", "tool_2", "tool_3"]
+    np.testing.assert_array_equal(matrix.correct()[1], ~correct[1])
+    np.testing.assert_array_equal(matrix.correct()[[0, 2, 3]], correct[[0, 2, 3]])
+
+
+def test_difficulty_consensus_and_agreement():
+    from sklearn.metrics import cohen_kappa_score
+
+    rng = np.random.default_rng(1)
+    correct = rng.random((5, 40)) < 0.7
+    scores = rng.random((5, 40))
+
+    difficulty, mean_score = case_analytics.case_difficulty(correct, scores)
+    for case in range(40):
+        wrong = sum(not correct[p, case] for p in range(5))
+        assert difficulty[case] == pytest.approx(wrong / 5)
+        assert case_analytics.consensus(correct)[case] == pytest.approx(max(wrong, 5 - wrong) / 5)
+    np.testing.assert_allclose(mean_score, scores.mean(axis=0))
+
+    agreement, kappa = case_analytics.pairwise_agreement(correct)
+    for a in range(5):
+        for b in range(5):
+            assert agreement[a, b] == pytest.approx(np.mean(correct[a] == correct[b]))
+            assert kappa[a, b] == pytest.approx(cohen_kappa_score(correct[a], correct[b]), abs=1e-6)
+
+
+def test_case_report(tmp_path):
+    correct = np.array([[1, 1, 0, 1],
+                        [1, 0, 0, 1],
+                        [1, 0, 0, 0]], dtype=bool)
+    scores = np.array([[0.9, 0.6, 0.2, 0.7],
+                       [0.8, 0.4, 0.1, 0.6],
+                       [0.7, 0.3, 0.3, 0.4]], dtype=np.float32)
+    report, cases = case_analytics.case_report(fill_matrix(tmp_path, correct, scores))
+
+    assert report["no_one_right"] == ["img_002"]
+    assert report["everyone_right"] == 1
+    assert [c["image"] for c in report["hardest_cases"]] == ["img_002", "img_001", "img_003", "img_000"]
+    assert {c["image"] for c in report["contested_cases"][:2]} == {"img_001", "img_003"}
+    assert report["contested_cases"][0]["consensus"] == pytest.approx(2 / 3)
+    assert cases["right"].tolist() == [3, 1, 0, 2]
+    assert report["pairwise"]["agreement"][0][1] == 0.75
+    assert all(v is not None for row in report["pairwise"]["kappa"] for v in row)
@@ -0,0 +1,64 @@
+import random
+import subprocess
+import sys
+
+import pytest
+
+from leaderboard import Leaderboard, leaderboard_from_aggregation, update_leaderboard_aggregation
+
+
+def board_item(metrics):
+    return {"datalink": {"inline_data": {"visualization": {"type": "leaderboard", "metrics": metrics},
+                                         "challenge_participants": []}}}
+
+
+@pytest.mark.parametrize("metrics", [["roc_auc"], ["roc_auc", "brier_score"],
+                                     ["roc_auc", "brier_score", "f1_score"]])
+def test_insertions_match_a_full_ranking(metrics):
+    rng = random.Random(len(metrics))
+    item = board_item(metrics)
+    for i in range(60):
+        participant_id = f"tool_{rng.randrange(25)}"  # some participants are replaced
+        values = {m: rng.choice([None, rng.randrange(6) / 5]) if rng.random() < 0.1 else rng.randrange(6) / 5
+                  for m in metrics}
+        update_leaderboard_aggregation(item, {participant_id: values})
+
+        incremental = leaderboard_from_aggregation(item)
+        full = Leaderboard(metrics, incremental.values)
+        assert incremental.layers == full.layers
+        assert item["datalink"]["inline_data"]["challenge_participants"] == full.table()
+
+
+def test_batch_update_equals_one_by_one():
+    metrics = ["roc_auc", "brier_score"]
+    rng = random.Random(0)
+    participants = {f"tool_{i}": {m: rng.randrange(5) / 4 for m in metrics} for i in range(30)}
+    one_by_one = board_item(metrics)
+    for participant_id, values in participants.items():
+        update_leaderboard_aggregation(one_by_one, {participant_id: values})
+    assert update_leaderboard_aggregation(board_item(metrics), participants) == one_by_one
+
+
+def test_ties_share_their_average_rank():
+    board = Leaderboard(["roc_auc", "brier_score"])
+    board.add("a", {"roc_auc": 0.9, "brier_score": 0.1})
+    board.add("b", {"roc_auc": 0.8, "brier_score": 0.1})
+    board.add("c", {"roc_auc": 0.7, "brier_score": 0.2})
+    assert board.ranks("c") == {"roc_auc": 3, "brier_score": 3}
+    assert board.ranks("a")["brier_score"] == 1.5
+    assert [row["participant_id"] for row in board.table()] == ["a", "b", "c"]
+
+
+@pytest.mark.parametrize("metrics", [["accuracy", "f1_score"], ["f1_score", "accuracy"]])
+def test_pareto_layers_do_not_depend_on_the_metric_order(metrics):
+    board = Leaderboard(metrics)
+    board.add("a", {"accuracy": 0.9, "f1_score": 0.8})
+    board.add("b", {"accuracy": 0.8, "f1_score": 0.8})
+    assert board.layers == {"a": 1, "b": 2}
+
+
+def test_leaderboard_does_not_import_matplotlib():
+    code = "import leaderboard, sys; leaderboard.Leaderboard(['a', 'b']).add('x', {}); print('matplotlib' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=sys.modules["leaderboard"].__file__.rsplit("/", 1)[0], check=True).stdout
+    assert out.strip() == "False"
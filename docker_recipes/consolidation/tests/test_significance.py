@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import significance
+from checkpoint import Checkpoint
+
+
+class Killed(Exception):
+    pass
+
+
+class KilledAfter(Checkpoint):
+    '''
+    Checkpoint saving after every batch, whose job is killed after its n-th save.
+    '''
+
+    def __init__(self, path, key, saves):
+        super().__init__(path, key)
+        self.saves = saves
+
+    def due(self):
+        return True
+
+    def save(self, state):
+        super().save(state)
+        self.saves -= 1
+        if not self.saves:
+            raise Killed()
+
+
+def case_stats(seed, n=300):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"label": rng.integers(0, 2, n), "predicted_label": rng.integers(0, 2, n)})
+    return significance.confusion_case_stats(df)
+
+
+def test_resumed_permutation_test_equals_an_uninterrupted_run(tmp_path):
+    a, b = case_stats(1), case_stats(2)
+    args = (a, b, "accuracy", 5000, np.random.SeedSequence(7).spawn(1)[0])
+    expected = significance.permutation_test(*args, batch_size=500)
+
+    path = str(tmp_path / "pair_0.json")
+    with pytest.raises(Killed):
+        significance.permutation_test(*args, batch_size=500, checkpoint=KilledAfter(path, "k", saves=3))
+    assert Checkpoint(path, "k").load()["done"] == 1500
+
+    resumed = significance.permutation_test(*args, batch_size=500, checkpoint=Checkpoint(path, "k"))
+    assert resumed == expected
+    # a checkpoint of other inputs is ignored
+    assert Checkpoint(path, "other").load() is None
+
+
+def test_pairwise_tests_do_not_depend_on_the_workers(tmp_path):
+    rng = np.random.default_rng(3)
+    cases = {f"tool{i}": pd.DataFrame({"label": rng.integers(0, 2, 80), "predicted_label": rng.integers(0, 2, 80)})
+             for i in range(3)}
+    one = significance.pairwise_tests(cases, "f1_score", n_permutations=999, seed=5, workers=1)
+    two = significance.pairwise_tests(cases, "f1_score", n_permutations=999, seed=5, workers=2,
+                                      checkpoint_dir=str(tmp_path))
+    assert one == two
+
+
+def scored_cases(seed, n=120):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 2, n)
+    s = np.round(np.clip(rng.random(n) * 0.7 + 0.3 * y, 0, 1), 2)  # rounded: ties
+    return pd.DataFrame({"image": [f"img_{i}" for i in range(n)], "label": y,
+                         "predicted_probability": s, "predicted_label": (s > 0.5).astype(int)})
+
+
+def test_metric_values_match_compute_metrics():
+    import compute_metrics
+
+    df = scored_cases(0)
+    expected = compute_metrics.compute_binary_metrics(df)
+    for metric in significance.METRICS:
+        stats = significance.METRICS[metric][0](df)
+        assert significance.metric_value(metric, stats) == pytest.approx(expected[metric][0]), metric
+
+
+def test_rank_based_auc_is_tested():
+    cases = {"a": scored_cases(1), "b": scored_cases(1)}
+    cases["b"]["predicted_probability"] = 1 - cases["b"]["predicted_probability"]  # worse than chance
+    values, results = significance.pairwise_tests(cases, "roc_auc", n_permutations=199, seed=0, workers=1)
+    assert values[0]["metric_value"] > 0.5 > values[1]["metric_value"]
+    assert results[0]["p_value"] == pytest.approx(1 / 200)
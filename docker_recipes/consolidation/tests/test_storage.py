@@ -0,0 +1,70 @@
+import os
+
+import aggregation
+import oeb_json
+from participant_store import ParticipantStore
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "..", "..", "input_data", "minimal_aggregation_template.json")
+CHALLENGE = "CH1"
+
+
+def assessments(participant, metrics):
+    return [{"_id": f"C:E_{CHALLENGE}_{participant}:{metric}", "challenge_id": CHALLENGE, "community_id": "C",
+             "metrics": {"metric_id": metric, "stderr": 0.0, "value": value},
+             "participant_id": participant, "type": "assessment"}
+            for metric, value in metrics.items()]
+
+
+def consolidate(outdir, participant, metrics, tier=None, shared_outdir=False):
+    community_id, participant_id, challenges = aggregation.group_assessments(assessments(participant, metrics))
+    return aggregation.aggregate_challenges(community_id, participant_id, challenges, str(outdir), "E", TEMPLATE,
+                                            chart_format="png", tier=tier, shared_outdir=shared_outdir)
+
+
+def test_update_skips_the_commit_of_a_lower_tier(tmp_path):
+    import storage
+
+    path = str(tmp_path / "agg.json")
+    committed = []
+    storage.update(path, lambda current: ["final"], str(tmp_path / ".lock"), oeb_json.FINAL_TIER, committed.append)
+    result = storage.update(path, lambda current: ["provisional"], str(tmp_path / ".lock"),
+                            oeb_json.PROVISIONAL_TIER, committed.append)
+    assert committed == [["final"]]
+    assert result == ["final"] and oeb_json.load(path) == ["final"]
+
+
+def test_late_provisional_run_keeps_the_final_results(tmp_path):
+    final = {"sensitivity": 0.8, "specificity": 0.7, "roc_auc": 0.9}
+    consolidate(tmp_path, "toolA", final, tier=oeb_json.FINAL_TIER, shared_outdir=True)
+    consolidate(tmp_path, "toolA", {"sensitivity": 0.1, "specificity": 0.2}, tier=oeb_json.PROVISIONAL_TIER)
+    consolidate(tmp_path, "toolB", {"sensitivity": 0.5, "specificity": 0.6, "roc_auc": 0.7}, shared_outdir=True)
+
+    store = ParticipantStore.open(str(tmp_path / CHALLENGE))
+    tools, values, _ = store.column("roc_auc")
+    assert dict(zip(tools.tolist(), values.tolist())) == {"toolA": 0.9, "toolB": 0.7}
+    tools, values, _ = store.column("sensitivity")
+    assert dict(zip(tools.tolist(), values.tolist()))["toolA"] == 0.8
+
+
+def test_participant_store_refuses_a_lower_tier(tmp_path):
+    final = ParticipantStore()
+    final.put("toolA", {"roc_auc": (0.9, 0.01)})
+    assert final.save(str(tmp_path), oeb_json.FINAL_TIER)
+
+    provisional = ParticipantStore()
+    provisional.put("toolA", {"sensitivity": (0.1, 0.0)})
+    assert not provisional.save(str(tmp_path), oeb_json.PROVISIONAL_TIER)
+
+    tools, values, _ = ParticipantStore.open(str(tmp_path)).column("roc_auc")
+    assert tools.tolist() == ["toolA"] and values.tolist() == [0.9]
+    assert not [p for p in os.listdir(tmp_path) if ".tmp" in p]
+
+
+def test_shared_outdir_reads_a_nan_metric(tmp_path):
+    import math
+    import storage
+
+    path = str(tmp_path / "agg.json")
+    oeb_json.dump_tier([{"metric_value": float("nan")}], path, pretty=True)
+    data, version = storage.read_versioned(path)
+    assert math.isnan(data[0]["metric_value"]) and version is not None
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Calibration metrics of the predicted probabilities.
+
+All metrics are derived from one binned summary of the scores, built in a
+single pass with ``np.searchsorted`` and ``np.bincount``:
+
+* per bin: number of cases, sum of predicted probabilities, number of positives;
+* overall: number of cases, summed squared error and summed log-loss.
+
+Every field is a sum, so summaries of separate chunks (or sites) are merged by
+adding them with :func:`merge_calibration_summaries`, and the metrics of the
+merged summary equal those of the concatenated data.
+
+**Metrics** – Brier score, log-loss, expected and maximum calibration error
+(ECE / MCE, equal-width bins), and the reliability curve as one compact
+array: ``[mean predicted probability, observed positive rate, cases]`` per
+non-empty bin, in bin order.
+"""
+from __future__ import annotations
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+# default number of equal-width probability bins
+N_BINS = 10
+
+# probabilities are clipped to [EPS, 1 - EPS] for the log-loss
+EPS = 1e-15
+
+
+def summarize_calibration(y_true, y_score, n_bins: int = N_BINS) -> Dict[str, object]:
+    """Return the binned calibration summary of binary labels *y_true* and scores *y_score*."""
+    y_true  = np.asarray(y_true, dtype=float)
+    y_score = np.asarray(y_score, dtype=float)
+
+    # bin i holds scores in [i/n, (i+1)/n); a score of exactly 1 falls in the last bin
+    inner_edges = np.linspace(0.0, 1.0, n_bins + 1)[1:-1]
+    bins = np.searchsorted(inner_edges, y_score, side="right")
+
+    clipped = np.clip(y_score, EPS, 1 - EPS)
+    log_loss = -(y_true * np.log(clipped) + (1 - y_true) * np.log1p(-clipped))
+
+    return {
+        "n_bins":    n_bins,
+        "count":     np.bincount(bins, minlength=n_bins).astype(np.int64),
+        "score_sum": np.bincount(bins, weights=y_score, minlength=n_bins),
+        "positives": np.bincount(bins, weights=y_true, minlength=n_bins),
+        "n":         int(y_true.size),
+        "sq_error":  float(np.sum((y_score - y_true) ** 2)),
+        "log_loss":  float(np.sum(log_loss)),
+    }
+
+
+def merge_calibration_summaries(*summaries: Dict[str, object]) -> Dict[str, object]:
+    """Add up summaries built with the same number of bins."""
+    n_bins = {s["n_bins"] for s in summaries}
+    if len(n_bins) != 1:
+        raise ValueError(f"Cannot merge calibration summaries with different bin counts: {sorted(n_bins)}")
+
+    merged = dict(summaries[0])
+    for s in summaries[1:]:
+        for key in ("count", "score_sum", "positives", "n", "sq_error", "log_loss"):
+            merged[key] = merged[key] + s[key]
+    return merged
+
+
+def calibration_metrics(summary: Dict[str, object]) -> Dict[str, Tuple[float | list, float]]:
+    """Compute the calibration metrics of a summary as ``{name: (value, stderr)}``."""
+    n = summary["n"]
+    count = summary["count"]
+    filled = count > 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_score = np.where(filled, summary["score_sum"] / count, np.nan)
+        observed   = np.where(filled, summary["positives"] / count, np.nan)
+    if n == 0:
+        brier = log_loss = ece = mce = float("nan")
+    else:
+        gap = np.abs(mean_score[filled] - observed[filled])
+
+        brier    = summary["sq_error"] / n
+        log_loss = summary["log_loss"] / n
+        ece      = float(np.sum(count[filled] * gap) / n)
+        mce      = float(np.max(gap))
+
+    metrics = {
+        "brier_score":                (brier,    0.0),
+        "log_loss":                   (log_loss, 0.0),
+        "expected_calibration_error": (ece,      0.0),
+        "max_calibration_error":      (mce,      0.0),
+    }
+    curve = [list(point) for point in zip(mean_score[filled].tolist(), observed[filled].tolist(),
+                                          count[filled].tolist())]
+    metrics["reliability_curve"] = (curve, 0.0)
+    return metrics
@@ -6,194 +6,850 @@ This replaces the old segmentation‐centric *compute_metrics.py*.
 
 **Key points**
 ──────────────
-1. **Inputs**  – a *predictions.csv* (columns: `image`, `predicted_probability`, `predicted_label`) and a *gt.csv* (`image`, `label`).
-2. **Metrics** – Sensitivity, Specificity, Precision, NPV, Accuracy, F1, Balanced Accuracy, Cohen’s κ, Weighted κ (quadratic), MCC, ROC-AUC, PR-AUC.
-3. **Curve data** – FPR and TPR lists (added directly to the JSON output).
+1. **Inputs**  – a *predictions.csv* (columns: `image`, `predicted_probability`, `predicted_label`) and a *gt.csv* (`image`, `label`),
+   either per challenge (`<goldstandard_dir>/<challenge>/gt.csv`) or shared (`<goldstandard_dir>/gt.csv`).
+   The predictions may be gzip/zstd-compressed or inside a tar archive; they are streamed, not extracted (`submission_io.py`).
+2. **Metrics** – Sensitivity, Specificity, Precision, NPV, Accuracy, F1, Balanced Accuracy, Cohen’s κ, Weighted κ (quadratic), MCC, ROC-AUC, PR-AUC,
+   and the calibration metrics of `calibration.py`: Brier score, log-loss, ECE, MCE and the reliability curve.
+   Wide `prob_<class>` predictions are scored by the multi-class / multi-label engine of `multiclass.py`.
+3. **Curve data** – FPR and TPR lists (`fpr_curve`, `tpr_curve`), added to the JSON output when requested.
 4. **Outputs** – A JSON list of assessment objects matching the format produced by `JSON_templates.write_assessment_dataset`.
 5. **Robust paths** – Works whether `-o` is an absolute or a simple filename.
+6. **Several challenges** – All challenges given with `-c` are scored in one run, concurrently,
+   from a single parse of the predictions, into one assessment list.
+7. **Progressive results** – `--tier 1` writes only the confusion-matrix metrics, within seconds,
+   as provisional results; `--tier 2` writes all metrics (ROC-AUC with its DeLong standard error,
+   curves, calibration) and atomically replaces them (see `oeb_json.dump_tier`).
+8. **Streaming engine** – `--engine sketch` reads the predictions in chunks into the
+   fixed-size, mergeable sketches of `sketch.py` (binary predictions only). `--sketch_state`
+   keeps the sketches between runs, so each run appends a new chunk of predictions, and
+   `--merge_sketches` adds the sketches of other sites. Its assessments are flagged
+   `approximate` and carry the `error_bound` of their value.
+9. **Segmentation** – a challenge whose gold standard is a directory of reference masks
+   (`gt_<case>.nii[.gz]`, no gt.csv) is scored on the predicted masks of the submission
+   (`brain_<case>.nii[.gz]`) with the lesion-wise detection metrics of `lesions.py`
+   (lesion sensitivity, precision, F1 and per-lesion Dice), and with the label-wise Dice, Jaccard and
+   volume similarity of `labels.py` (multi-label masks, from one sparse confusion per case),
+   the cases in parallel processes.
+10. **Metric registry** – the binary metrics and the intermediates they share (confusion, sorted
+   scores, cumulative sums, curves, calibration summary) are registered in `registry.py`. Only the
+   metrics given with `--metrics` or referenced by `--aggregation_template` are computed, each
+   intermediate once; `--metric_plugins` registers more metrics. The other engines' results are filtered.
 """
 from __future__ import annotations
 
-import io
-import json
 import sys
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Tuple, List
 import os
-import numpy as np
-import pandas as pd
-from sklearn.metrics import (
-    confusion_matrix,
-    accuracy_score,
-    f1_score,
-    balanced_accuracy_score,
-    cohen_kappa_score,
-    matthews_corrcoef,
-    roc_curve,
-    precision_recall_curve,
-    auc,
-)
-
-import JSON_templates  # provided by the evaluation environment
+
+# shared OEB modules: in the images they are copied next to this script, in a source checkout they are in ../oeb_schemas
+SCHEMAS_DIR = str(Path(__file__).resolve().parent.parent / "oeb_schemas")
+if SCHEMAS_DIR not in sys.path:
+    sys.path.append(SCHEMAS_DIR)
+import oeb_json
+import gt_store
+from gt_store import goldstandard_path
+import submission_io
+import profiling
+import registry
+from oeb_validation import check_oeb_objects
+
+# pandas, numpy, scikit-learn and JSON_templates are imported inside the
+# functions that need them, so that importing this module (or running it with
+# --help / bad arguments) does not pay their start-up cost.
 
 # -----------------------------------------------------------------------------
 # CLI argument parsing
 # -----------------------------------------------------------------------------
-parser = ArgumentParser(
-    description="Compute binary-classification metrics for EuCanImage challenges.")
-parser.add_argument("-i", "--input", required=True,
-                    help="Predictions CSV file.")
-parser.add_argument("-g", "--goldstandard_file", required=True,
-                    help="Ground-truth CSV file.")
-parser.add_argument("-c", "--challenges_ids", nargs='+', required=True,
-                    help="Challenge id(s), space-separated.")
-parser.add_argument("-p", "--participant_id", required=True,
-                    help="Tool / model id (participant).")
-parser.add_argument("-com", "--community_id", required=True,
-                    help="Benchmarking community id (e.g. 'EuCanImage').")
-parser.add_argument("-e", "--event_id", required=True,
-                    help="Benchmarking event id.")
-parser.add_argument("-o", "--outdir", required=True,
-                    help="Path to metrics JSON (other artefacts share the same basename).")
-
-args = parser.parse_args()
+
+def parse_arguments() -> ArgumentParser:
+    """Return the command-line parser of the metrics stage."""
+    parser = ArgumentParser(
+        description="Compute binary-classification metrics for EuCanImage challenges.")
+    parser.add_argument("-i", "--input", required=True,
+                        help="Predictions CSV file, possibly gzip/zstd-compressed or in a tar archive.")
+    parser.add_argument("-g", "--goldstandard_file", required=True,
+                        help="Ground-truth directory, with <challenge>/gt.csv per challenge or a shared gt.csv "
+                             "(or, for segmentation challenges, reference masks gt_<case>.nii[.gz]).")
+    parser.add_argument("-c", "--challenges_ids", nargs='+', required=True,
+                        help="Challenge id(s), space-separated.")
+    parser.add_argument("-p", "--participant_id", required=True,
+                        help="Tool / model id (participant).")
+    parser.add_argument("-com", "--community_id", required=True,
+                        help="Benchmarking community id (e.g. 'EuCanImage').")
+    parser.add_argument("-e", "--event_id", required=True,
+                        help="Benchmarking event id.")
+    parser.add_argument("--cases_dir",
+                        help="Optional directory for the per-case tables (<challenge>/<participant>.csv) "
+                             "used by the consolidation's permutation tests, and for the participants x cases "
+                             "outcome matrix of each challenge (<challenge>/outcomes, see case_matrix.py).")
+    parser.add_argument("-o", "--outdir", required=True,
+                        help="Path to metrics JSON (other artefacts share the same basename).")
+    parser.add_argument("--tier", type=int, choices=[1, 2],
+                        help="Progressive results: 1 = provisional confusion-matrix metrics only, "
+                             "2 = all metrics, replacing the provisional ones (default: all metrics, no tier marker).")
+    parser.add_argument("--engine", choices=["exact", "sketch"], default="exact",
+                        help="exact: whole tables (default); sketch: streamed, approximate AUCs from "
+                             "fixed-size score histograms (see sketch.py).")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE,
+                        help=f"Sketch engine: predictions read per chunk (default: {CHUNK_SIZE}).")
+    parser.add_argument("--sketch_bins", type=int,
+                        help="Sketch engine: score bins of new sketches (default: sketch.N_BINS).")
+    parser.add_argument("--sketch_state",
+                        help="Sketch engine: JSON file of the sketches so far; the predictions are "
+                             "appended to it (once per file content) and it is rewritten.")
+    parser.add_argument("--merge_sketches", nargs='+', default=[],
+                        help="Sketch engine: sketch files of other sites, merged into the metrics "
+                             "(but not into --sketch_state).")
+    parser.add_argument("--lesion_iou", type=float, default=LESION_IOU,
+                        help=f"Segmentation: IoU above which a predicted lesion detects a reference lesion "
+                             f"(default: {LESION_IOU}).")
+    parser.add_argument("--lesion_connectivity", type=int, choices=[1, 2, 3], default=LESION_CONNECTIVITY,
+                        help="Segmentation: voxels of a lesion share a face (1), an edge (2) or a corner (3, default).")
+    parser.add_argument("--workers", type=int,
+                        help="Segmentation: processes scoring the cases (default: the number of CPUs).")
+    parser.add_argument("--metrics", nargs='+',
+                        help="Metrics to compute, by id; a multi-class family (e.g. f1_score) also "
+                             "requests its averages and classes (default: all the default metrics, see registry.py).")
+    parser.add_argument("--aggregation_template",
+                        help="Compute only the metrics referenced by this aggregation template "
+                             "(with --metrics: those as well).")
+    parser.add_argument("--metric_plugins", nargs='+', default=[],
+                        help="Modules (names or .py paths) registering more metrics in registry.py.")
+    profiling.add_arguments(parser)
+    return parser
+
+
+# predictions read at a time by the sketch engine
+CHUNK_SIZE = 100_000
+
+# lesion matching of segmentation challenges (the defaults of lesions.py, which needs numpy to import)
+LESION_IOU = 0.1
+LESION_CONNECTIVITY = 3
+
 
 # -----------------------------------------------------------------------------
 # Helpers
 # -----------------------------------------------------------------------------
 
 def safe_div(num: float, denom: float) -> float:
-    """Return *num/denom* or *np.nan* if the denominator is zero."""
-    return float(num) / float(denom) if denom else np.nan
+    """Return *num/denom* or *nan* if the denominator is zero."""
+    return float(num) / float(denom) if denom else float("nan")
 
 
-# -----------------------------------------------------------------------------
-# Main routine
-# -----------------------------------------------------------------------------
+def roc_auc_stderr(y_true, y_score) -> float:
+    """DeLong standard error of the ROC-AUC, from the mid-ranks of the scores (no pairwise loop)."""
+    import numpy as np
 
-def main(cfg):
-    pred_path = Path(cfg.input)
-    gt_path = Path(os.path.join(cfg.goldstandard_file, "gt.csv"))
+    def midranks(x):
+        order = np.argsort(x, kind="mergesort")
+        xs = x[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(xs)) + 1]
+        ends = np.r_[starts[1:], len(xs)]
+        ranks = np.empty(len(x))
+        ranks[order] = np.repeat((starts + ends + 1) / 2, ends - starts)
+        return ranks
 
-    if not pred_path.is_file():
-        sys.exit(f"ERROR: Predictions file '{pred_path}' does not exist.")
-    if not gt_path.is_file():
-        sys.exit(f"ERROR: Ground-truth file '{gt_path}' does not exist.")
+    pos = y_score[y_true == 1]
+    neg = y_score[y_true == 0]
+    m, n = len(pos), len(neg)
+    if m < 2 or n < 2:
+        return float("nan")
+    ranks = midranks(np.concatenate([pos, neg]))
+    v10 = (ranks[:m] - midranks(pos)) / n        # per positive: share of negatives scored lower
+    v01 = 1 - (ranks[m:] - midranks(neg)) / m    # per negative: share of positives scored higher
+    return float(np.sqrt(v10.var(ddof=1) / m + v01.var(ddof=1) / n))
 
-    # 1. Load and align CSVs ------------------------------------------------
-    pred_df = pd.read_csv(pred_path)
-    gt_df   = pd.read_csv(gt_path)
 
-    required_pred_cols = {"image", "predicted_probability", "predicted_label"}
-    required_gt_cols   = {"image", "label"}
+def open_goldstandard(gt_path: Path):
+    """Open the gold standard *gt_path* once, as ``(gt_df, store)``.
 
-    if not required_pred_cols.issubset(pred_df.columns):
-        sys.exit(f"ERROR: Predictions CSV missing columns: {required_pred_cols - set(pred_df.columns)}")
-    if not required_gt_cols.issubset(gt_df.columns):
-        sys.exit(f"ERROR: Ground-truth CSV missing columns: {required_gt_cols - set(gt_df.columns)}")
+    *store* is the compiled store of the CSV (see ``validation/compile_goldstandard.py``)
+    when it is up to date, and *gt_df* is read from it; otherwise *store* is
+    ``None`` and *gt_df* is read from the CSV. Both give the same table, in
+    gt.csv order with stripped image ids (``gt_store.normalise``). Long-running
+    callers (see ``pipeline/scoring_service.py``) replace this with a cached
+    reader, so the result must not be modified in place.
+    """
+    store = gt_store.open_store(gt_path)
+    if store is not None:
+        return store.frame(), store
+
+    import pandas as pd
+    return gt_store.normalise(pd.read_csv(gt_path)), None
+
+
+def read_goldstandard(gt_path: Path):
+    """Read the ground-truth CSV into a DataFrame (see :func:`open_goldstandard`)."""
+    return open_goldstandard(gt_path)[0]
 
-    pred_df["image"] = pred_df["image"].astype(str).str.strip()
-    gt_df["image"]   = gt_df["image"].astype(str).str.strip()
 
-    df = gt_df.merge(pred_df, on="image", how="inner", validate="one_to_one")
-    if len(df) != len(gt_df) or len(df) != len(pred_df):
-        missing_pred = set(gt_df["image"]) - set(pred_df["image"])
-        extra_pred   = set(pred_df["image"]) - set(gt_df["image"])
+# -----------------------------------------------------------------------------
+# Scoring steps (usable on in-memory data)
+# -----------------------------------------------------------------------------
+
+def join_on_store(pred_df, gt_df, store, subset: bool = False):
+    """Join *pred_df* to *gt_df*, read from *store*, by looking its image ids up in the store.
+
+    Returns the same table as the one-to-one merge of :func:`align_predictions`,
+    or exits with the same errors when the image ids differ.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rows = store.lookup(pred_df["image"].to_numpy(dtype=str))
+    if subset:
+        pred_df, rows = pred_df[rows >= 0], rows[rows >= 0]
+    extra_pred = int((rows < 0).sum())
+    missing_pred = len(store.unmatched(rows))
+    if extra_pred or missing_pred:
         if missing_pred:
-            print(f"ERROR: {len(missing_pred)} image id(s) present in GT but missing in predictions.")
+            print(f"ERROR: {missing_pred} image id(s) present in GT but missing in predictions.")
         if extra_pred:
-            print(f"ERROR: {len(extra_pred)} extra image id(s) present in predictions but not in GT.")
+            print(f"ERROR: {extra_pred} extra image id(s) present in predictions but not in GT.")
         sys.exit(1)
+    if len(rows) != len(gt_df):
+        sys.exit("ERROR: Duplicate image id(s) in predictions.")
+
+    # every ground-truth row is matched once: put the predictions in gt.csv order
+    order = np.argsort(rows, kind="stable")
+    pred_part = pred_df.drop(columns="image").iloc[order].reset_index(drop=True)
+    return pd.concat([gt_df.reset_index(drop=True), pred_part], axis=1)
+
+
+def align_predictions(pred_df, gt_df, subset: bool = False, store=None):
+    """Check the columns of both tables and join them one-to-one on ``image``.
+
+    Exits with an error if columns are missing or the image ids differ. With
+    *subset* the predictions may also hold images of other challenges, which
+    are left out instead of being reported as extra. Predictions with
+    `prob_<class>` columns are checked against the multi-class / multi-label
+    schema of `multiclass.py`. With the compiled *store* *gt_df* was read from,
+    the image ids are looked up in it instead of being hashed for a merge; the
+    joined table is the same, in gt.csv order.
+    """
+    from multiclass import PROB_PREFIX, LABEL_PREFIX, prob_columns, label_columns
+
+    classes = [c[len(PROB_PREFIX):] for c in prob_columns(pred_df)]
+    if not classes:
+        required_pred_cols = {"image", "predicted_probability", "predicted_label"}
+        required_gt_cols   = {"image", "label"}
+    elif label_columns(gt_df):
+        required_pred_cols = {"image"}
+        required_gt_cols   = {"image"} | {LABEL_PREFIX + c for c in classes}
+    else:
+        required_pred_cols = {"image"}
+        required_gt_cols   = {"image", "label"}
 
-    y_true  = df["label"].astype(int).to_numpy()
-    y_pred  = df["predicted_label"].astype(int).to_numpy()
-    y_score = df["predicted_probability"].astype(float).to_numpy()
+    if not required_pred_cols.issubset(pred_df.columns):
+        sys.exit(f"ERROR: Predictions CSV missing columns: {required_pred_cols - set(pred_df.columns)}")
+    if not required_gt_cols.issubset(gt_df.columns):
+        sys.exit(f"ERROR: Ground-truth CSV missing columns: {required_gt_cols - set(gt_df.columns)}")
 
-    # 2. Confusion-matrix metrics ------------------------------------------
-    tn, fp, fn, tp = confusion_matrix(y_true, y_pred, labels=[0, 1]).ravel()
-    sensitivity = safe_div(tp, tp + fn)
-    specificity = safe_div(tn, tn + fp)
-    precision   = safe_div(tp, tp + fp)
-    npv         = safe_div(tn, tn + fn)
-
-    # 3. Other sklearn metrics ---------------------------------------------
-    accuracy       = accuracy_score(y_true, y_pred)
-    f1             = f1_score(y_true, y_pred)
-    bal_accuracy   = balanced_accuracy_score(y_true, y_pred)
-    kappa          = safe_div(cohen_kappa_score(y_true, y_pred), 1)  # ensure float
-    weighted_kappa = safe_div(cohen_kappa_score(y_true, y_pred, weights="quadratic"), 1)
-    mcc            = matthews_corrcoef(y_true, y_pred)
-
-    # 4. Curves & AUCs ------------------------------------------------------
-    if len(np.unique(y_true)) == 2:
-        fpr, tpr, roc_thresholds = roc_curve(y_true, y_score)
-        roc_auc = auc(fpr, tpr)
-
-        precision_curve, recall_curve, pr_thresholds = precision_recall_curve(y_true, y_score)
-        pr_auc = auc(recall_curve, precision_curve)
-
-        # Convert to required list formats ---------------------------------
-        fpr_list = [float(x) for x in fpr]
-        tpr_list = [{"v": float(v), "e": 0.0} for v in tpr]
+    pred_df = pred_df.assign(image=pred_df["image"].astype(str).str.strip())
+    gt_df   = gt_df.assign(image=gt_df["image"].astype(str).str.strip())
+    shared = (set(gt_df.columns) & set(pred_df.columns)) - {"image"}
+    if store is not None and len(store) == len(gt_df) and not shared:
+        df = join_on_store(pred_df, gt_df, store, subset)
     else:
-        fpr_list = []
-        tpr_list = []
-        roc_auc = pr_auc = np.nan
+        if subset:
+            pred_df = pred_df[pred_df["image"].isin(gt_df["image"])]
+        df = gt_df.merge(pred_df, on="image", how="inner", validate="one_to_one")
+        if len(df) != len(gt_df) or len(df) != len(pred_df):
+            missing_pred = set(gt_df["image"]) - set(pred_df["image"])
+            extra_pred   = set(pred_df["image"]) - set(gt_df["image"])
+            if missing_pred:
+                print(f"ERROR: {len(missing_pred)} image id(s) present in GT but missing in predictions.")
+            if extra_pred:
+                print(f"ERROR: {len(extra_pred)} extra image id(s) present in predictions but not in GT.")
+            sys.exit(1)
+
+    if classes and "label" in required_gt_cols:
+        for column in ("label", "predicted_label"):
+            if column in df.columns:
+                unknown = set(df[column].astype(str).str.strip()) - set(classes)
+                if unknown:
+                    sys.exit(f"ERROR: '{column}' holds class(es) without a prob_<class> column: {sorted(unknown)}")
+    return df
+
+
+# -----------------------------------------------------------------------------
+# Binary metrics and their intermediates (see registry.py)
+# -----------------------------------------------------------------------------
+
+@registry.intermediate("y_true")
+def binary_truth(df):
+    return df["label"].astype(int).to_numpy()
+
+
+@registry.intermediate("y_pred")
+def binary_prediction(df):
+    return df["predicted_label"].astype(int).to_numpy()
+
+
+@registry.intermediate("y_score")
+def binary_score(df):
+    return df["predicted_probability"].astype(float).to_numpy()
+
+
+@registry.intermediate("confusion", requires=("y_true", "y_pred"))
+def binary_confusion(y_true, y_pred):
+    from multiclass import confusion_matrix
+    return confusion_matrix(y_true, y_pred, 2)
+
+
+@registry.intermediate("confusion_metrics", requires=("confusion",))
+def binary_confusion_metrics(cm):
+    return confusion_metrics(cm)
+
+
+@registry.intermediate("sorted_scores", requires=("y_true", "y_score"))
+def sorted_scores(y_true, y_score):
+    """Labels and scores by decreasing score (stable, so that ties keep their order)."""
+    import numpy as np
+    order = np.argsort(-y_score, kind="mergesort")
+    return y_true[order], y_score[order]
+
+
+@registry.intermediate("cumulative_sums", requires=("sorted_scores",))
+def cumulative_sums(sorted_scores):
+    """False and true positives above each distinct score, or ``None`` with a single class."""
+    import numpy as np
+    y, score = sorted_scores
+    last = np.r_[np.flatnonzero(np.diff(score)), len(score) - 1] if len(score) else np.zeros(0, dtype=int)
+    tps = np.cumsum(y)[last]
+    fps = last + 1 - tps
+    if not len(last) or not tps[-1] or not fps[-1]:
         print("WARNING: Only one class present – ROC/PR curves not computed.")
+        return None
+    return fps, tps
+
+
+@registry.intermediate("roc_curve", requires=("cumulative_sums",))
+def roc_curve(sums):
+    """FPR and TPR of every threshold, from (0, 0)."""
+    import numpy as np
+    if sums is None:
+        return None
+    fps, tps = sums
+    return np.r_[0.0, fps / fps[-1]], np.r_[0.0, tps / tps[-1]]
+
+
+@registry.intermediate("pr_curve", requires=("cumulative_sums",))
+def pr_curve(sums):
+    """Precision and recall of every threshold, by decreasing recall, down to (1, 0)."""
+    import numpy as np
+    if sums is None:
+        return None
+    fps, tps = sums
+    return np.r_[(tps / (tps + fps))[::-1], 1.0], np.r_[(tps / tps[-1])[::-1], 0.0]
+
+
+@registry.intermediate("calibration", requires=("y_true", "y_score"))
+def binary_calibration(y_true, y_score):
+    """Calibration metrics from one binned pass (see calibration.py)."""
+    from calibration import summarize_calibration, calibration_metrics
+    return calibration_metrics(summarize_calibration(y_true, y_score))
+
+
+CONFUSION_METRICS = ("sensitivity", "specificity", "precision", "npv", "accuracy", "f1_score",
+                     "balanced_accuracy", "cohen_kappa", "weighted_cohen_kappa", "matthews_corrcoef")
+CALIBRATION_METRICS = ("brier_score", "log_loss", "expected_calibration_error", "max_calibration_error")
+
+# families of the multi-class engine (macro / micro / weighted averages, per class)
+registry.register_group("precision", "sensitivity", "f1_score", "roc_auc", "pr_auc")
+
+for _name in CONFUSION_METRICS:
+    registry.register_metric(_name, ("confusion_metrics",), lambda m, name=_name: m[name], provisional=True)
+
+
+@registry.metric("roc_auc", requires=("roc_curve", "y_true", "y_score"))
+def roc_auc_metric(curve, y_true, y_score):
+    from sklearn.metrics import auc
+    if curve is None:
+        return float("nan"), float("nan")
+    return auc(*curve), roc_auc_stderr(y_true, y_score)
+
+
+@registry.metric("pr_auc", requires=("pr_curve",))
+def pr_auc_metric(curve):
+    from sklearn.metrics import auc
+    if curve is None:
+        return float("nan"), 0.0
+    precision_curve, recall_curve = curve
+    return auc(recall_curve, precision_curve), 0.0
+
+
+for _name in CALIBRATION_METRICS:
+    registry.register_metric(_name, ("calibration",), lambda m, name=_name: m[name])
+
+
+@registry.metric("reliability_curve", requires=("calibration",))
+def reliability_curve_metric(m):
+    """The reliability curve, one ``[predicted, observed, cases]`` entry per non-empty bin (see calibration.py)."""
+    return m["reliability_curve"]
 
-    # 5. Collect metrics ----------------------------------------------------
-    metrics: Dict[str, Tuple[float | list, float]] = {
-        "sensitivity":          (sensitivity, 0.0),
-        "specificity":          (specificity, 0.0),
-        "precision":            (precision,   0.0),
-        "npv":                  (npv,         0.0),
-        "accuracy":             (accuracy,    0.0),
-        "f1_score":             (f1,          0.0),
-        "balanced_accuracy":    (bal_accuracy, 0.0),
-        "cohen_kappa":          (kappa,        0.0),
-        "weighted_cohen_kappa": (weighted_kappa, 0.0),
-        "matthews_corrcoef":    (mcc,          0.0),
-        "roc_auc":              (roc_auc,      0.0),
-        "pr_auc":               (pr_auc,       0.0),
-        # Added curve data -------------------------------------------------
-#        "fpr_curve":            (fpr_list,     0.0),
-#        "tpr_curve":            (tpr_list,     0.0),
+
+# curve data, only when requested (e.g. --metrics fpr_curve tpr_curve)
+@registry.metric("fpr_curve", requires=("roc_curve",), default=False)
+def fpr_curve_metric(curve):
+    return ([float(x) for x in curve[0]] if curve is not None else []), 0.0
+
+
+@registry.metric("tpr_curve", requires=("roc_curve",), default=False)
+def tpr_curve_metric(curve):
+    return ([{"v": float(v), "e": 0.0} for v in curve[1]] if curve is not None else []), 0.0
+
+
+def compute_binary_metrics(df, requested: List[str] | None = None) -> Dict[str, Tuple[float | list, float]]:
+    """Compute the requested metrics of an aligned table as ``{name: (value, stderr)}``.
+
+    Only the intermediates of the requested metrics are computed, each once
+    (see ``registry.py``); ``None`` computes the default metrics.
+    """
+    return registry.compute(df, requested)
+
+
+def compute_point_metrics(df, requested: List[str] | None = None) -> Dict[str, Tuple[float | list, float]]:
+    """Provisional tier: only the confusion-matrix metrics of a binary table, from one count.
+
+    Same names and values as :func:`compute_binary_metrics`, without curves,
+    AUCs or calibration.
+    """
+    return registry.compute(df, requested, provisional=True)
+
+
+def confusion_metrics(cm) -> Dict[str, Tuple[float | list, float]]:
+    """Confusion-matrix metrics of a binary 2×2 count matrix (rows: truth, columns: prediction)."""
+    import numpy as np
+    from multiclass import cohen_kappa, multiclass_mcc
+
+    (tn, fp), (fn, tp) = cm.tolist()
+
+    sensitivity = safe_div(tp, tp + fn)
+    specificity = safe_div(tn, tn + fp)
+    kappa = cohen_kappa(cm)  # with two classes the quadratic weights equal the unweighted ones
+    mcc = multiclass_mcc(cm)
+    metrics = {
+        "sensitivity":          sensitivity,
+        "specificity":          specificity,
+        "precision":            safe_div(tp, tp + fp),
+        "npv":                  safe_div(tn, tn + fn),
+        "accuracy":             safe_div(tp + tn, tp + tn + fp + fn),
+        "f1_score":             safe_div(2 * tp, 2 * tp + fp + fn) if tp + fp + fn else 0.0,
+        "balanced_accuracy":    float(np.nanmean([sensitivity, specificity])),
+        "cohen_kappa":          kappa,
+        "weighted_cohen_kappa": kappa,
+        "matthews_corrcoef":    0.0 if np.isnan(mcc) else mcc,
     }
+    return {name: (value, 0.0) for name, value in metrics.items()}
 
-    # 6. Write assessment JSON ---------------------------------------------
-    challenge = cfg.challenges_ids[0] if isinstance(cfg.challenges_ids, list) else cfg.challenges_ids
-    base_id   = f"{cfg.community_id}:{cfg.event_id}_{challenge}_{cfg.participant_id}:"
+
+def compute_classification_metrics(df, tier: int | None = None,
+                                   requested: List[str] | None = None) -> Dict[str, Tuple[float | list, float]]:
+    """Compute the requested metrics of an aligned table with the engine matching its schema.
+
+    ``tier=1`` computes only the provisional confusion-matrix metrics.
+    """
+    from multiclass import prob_columns, label_columns, compute_multiclass_metrics, compute_multilabel_metrics
+
+    point_only = tier == 1
+    if not prob_columns(df):
+        return compute_point_metrics(df, requested) if point_only else compute_binary_metrics(df, requested)
+    if label_columns(df):
+        return registry.select(compute_multilabel_metrics(df, point_only), requested)
+    return registry.select(compute_multiclass_metrics(df, point_only), requested)
+
+
+def compute_sketch_metrics(sketch) -> Tuple[Dict[str, Tuple[float | list, float]], Dict[str, float]]:
+    """Compute the metrics of a sketch (see ``sketch.py``) as ``{name: (value, stderr)}``.
+
+    Same names as :func:`compute_binary_metrics`; also returns ``{name: error bound}``,
+    which is 0 for the metrics that are exact.
+    """
+    from calibration import calibration_metrics
+    from sketch import roc_auc, pr_auc
+
+    metrics = confusion_metrics(sketch["confusion"])
+    roc_auc_value, roc_auc_se, roc_auc_bound = roc_auc(sketch)
+    pr_auc_value, pr_auc_bound = pr_auc(sketch)
+    metrics["roc_auc"] = (roc_auc_value, roc_auc_se)
+    metrics["pr_auc"] = (pr_auc_value, 0.0)
+    metrics.update(calibration_metrics(sketch["calibration"]))
+
+    bounds = {name: 0.0 for name in metrics}
+    bounds["roc_auc"] = roc_auc_bound
+    bounds["pr_auc"] = pr_auc_bound
+    return metrics, bounds
+
+
+def build_assessments(metrics: Dict[str, Tuple[float | list, float]], challenge: str,
+                      participant_id: str, community_id: str, event_id: str) -> List[dict]:
+    """Wrap ``{name: (value, stderr)}`` into OEB assessment objects of one challenge."""
+    import JSON_templates  # provided by the evaluation environment
+
+    base_id = f"{community_id}:{event_id}_{challenge}_{participant_id}:"
 
     assessments: List[dict] = []
     for name, (val, std) in metrics.items():
         assessments.append(
             JSON_templates.write_assessment_dataset(
                 base_id + name,
-                cfg.community_id,
+                community_id,
                 challenge,
-                cfg.participant_id,
+                participant_id,
                 name,
                 val,
                 std,
             )
         )
+    return assessments
+
 
-    out_json_path = Path(cfg.outdir)
+def write_assessments(assessments: List[dict], outdir: str, tier: int | None = None) -> Path:
+    """Write the assessment list to *outdir* (a JSON path) and return the path written.
+
+    With a *tier*, the file is replaced atomically with a tier marker and never by a lower tier.
+    """
+    out_json_path = Path(outdir)
     # If a simple filename was given, place it in the current directory
     if not out_json_path.is_absolute():
         out_json_path = Path.cwd() / out_json_path
     if out_json_path.parent != Path('.'):
         out_json_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with io.open(out_json_path, mode="w", encoding="utf-8") as fp:
-        json.dump(assessments, fp, indent=4, sort_keys=True, separators=(",", ": "))
+    if not oeb_json.dump_tier(assessments, str(out_json_path), tier):
+        print(f"INFO: {out_json_path} already holds final results, tier {tier} results dropped.")
+        return out_json_path
 
     print(f"INFO: Wrote metrics JSON → {out_json_path}")
+    return out_json_path
+
+
+def flag_approximate(assessments: List[dict], bounds: Dict[str, float]) -> List[dict]:
+    """Mark assessments of the sketch engine: ``approximate`` and the ``error_bound`` of their value."""
+    for assessment in assessments:
+        assessment["metrics"]["approximate"] = True
+        assessment["metrics"]["error_bound"] = bounds[assessment["metrics"]["metric_id"]]
+    return assessments
+
+
+def write_cases(df, cases_dir: str, challenge: str, participant_id: str) -> Path:
+    """Write the aligned per-case table to ``<cases_dir>/<challenge>/<participant>.csv``."""
+    path = Path(cases_dir) / challenge.replace(".", "_") / f"{participant_id}.csv"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.sort_values("image").to_csv(path, index=False)
+    return path
+
+
+def case_outcomes(df):
+    """Return whether each case of an aligned table was predicted right, and the probability given to its truth."""
+    import numpy as np
+    from multiclass import prob_columns, case_outcomes as wide_case_outcomes
+
+    if prob_columns(df):
+        return wide_case_outcomes(df)
+    y = df["label"].astype(int).to_numpy()
+    p = df["predicted_probability"].astype(float).to_numpy()
+    return df["predicted_label"].astype(int).to_numpy() == y, np.where(y == 1, p, 1 - p)
+
+
+def write_case_outcomes(df, cases_dir: str, challenge: str, participant_id: str) -> None:
+    """Add the per-case outcomes of an aligned table to the challenge's outcome matrix (see ``case_matrix.py``)."""
+    import case_matrix
+
+    correct, scores = case_outcomes(df)
+    try:
+        case_matrix.write_outcomes(case_matrix.matrix_path(cases_dir, challenge), participant_id,
+                                   df["image"].astype(str).to_numpy(), correct, scores)
+    except ValueError as e:
+        sys.exit(f"ERROR: {e}")
+
+
+def score_challenges(pred_df, goldstandards: Dict[str, object], participant_id: str,
+                     community_id: str, event_id: str, cases_dir: str | None = None,
+                     tier: int | None = None, requested: List[str] | None = None,
+                     stores: Dict[str, object] | None = None) -> List[dict]:
+    """Score the predictions against the ground truth of every challenge.
+
+    *goldstandards* maps each challenge id to its ground-truth DataFrame (the
+    same object may be shared by several challenges). The challenges are
+    scored concurrently and their assessments returned in challenge order.
+    With *cases_dir* the aligned per-case tables and outcomes are kept as well; ``tier=1``
+    computes the provisional metrics only (see :func:`compute_classification_metrics`), and
+    *requested* the given metrics only (see ``registry.py``). *stores* maps
+    challenges to the compiled store their ground truth was read from, if any
+    (see :func:`align_predictions`).
+    """
+    stores = stores or {}
+    distinct = {id(gt_df): gt_df for gt_df in goldstandards.values()}
+    subset = len(distinct) > 1
+    if subset:
+        # predictions span several gold standards: each image must belong to one of them
+        known = set()
+        for gt_df in distinct.values():
+            known.update(gt_df["image"].astype(str).str.strip())
+        extra_pred = set(pred_df["image"].astype(str).str.strip()) - known
+        if extra_pred:
+            sys.exit(f"ERROR: {len(extra_pred)} extra image id(s) present in predictions but in no challenge's GT.")
+
+    def score(challenge):
+        df = align_predictions(pred_df, goldstandards[challenge], subset=subset, store=stores.get(challenge))
+        metrics = compute_classification_metrics(df, tier, requested)
+        if cases_dir:
+            write_cases(df, cases_dir, challenge, participant_id)
+            write_case_outcomes(df, cases_dir, challenge, participant_id)
+        return build_assessments(metrics, challenge, participant_id, community_id, event_id)
+
+    workers = max(min(len(goldstandards), os.cpu_count() or 1), 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        per_challenge = list(pool.map(score, goldstandards))
+
+    return [assessment for assessments in per_challenge for assessment in assessments]
+
+
+def load_sketch_file(path: str) -> dict:
+    """Read a sketch file (``{"version", "challenges": {challenge: sketch}, "inputs": {challenge: [sha256]}}``)."""
+    from sketch import FORMAT_VERSION
+
+    saved = oeb_json.load(path)
+    if saved.get("version") != FORMAT_VERSION:
+        sys.exit(f"ERROR: Sketch file '{path}' has format version {saved.get('version')}, expected {FORMAT_VERSION}.")
+    return saved
+
+
+def load_sketches(path: str) -> Dict[str, dict]:
+    """Read the sketches of a sketch file, as ``{challenge: sketch}``."""
+    from sketch import sketch_from_json
+
+    return {challenge: sketch_from_json(obj) for challenge, obj in load_sketch_file(path)["challenges"].items()}
+
+
+def load_sketch_inputs(path: str) -> Dict[str, List[str]]:
+    """Read the sha256 of the prediction files merged into each sketch of a sketch file."""
+    return load_sketch_file(path).get("inputs", {})
+
+
+def save_sketches(sketches: Dict[str, dict], path: str, inputs: Dict[str, List[str]] | None = None) -> None:
+    """Atomically write the sketches of every challenge, and the *inputs* merged into them, to *path*."""
+    from sketch import FORMAT_VERSION, sketch_to_json
+
+    data = {"version": FORMAT_VERSION,
+            "challenges": {challenge: sketch_to_json(sk) for challenge, sk in sketches.items()}}
+    if inputs:
+        data["inputs"] = inputs
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    oeb_json.replace(oeb_json.dumps(data, pretty=False), path)
+
+
+def stream_sketches(pred_path: Path, goldstandards: Dict[str, object], sketches: Dict[str, dict],
+                    chunksize: int = CHUNK_SIZE, n_bins: int | None = None) -> Dict[str, dict]:
+    """Append the predictions in *pred_path*, read *chunksize* rows at a time, to the sketches.
+
+    *sketches* maps challenges to their sketches so far (missing ones start empty);
+    memory use is bounded by the chunk and the gold standards. Each chunk is joined to
+    every challenge's gold standard; images in no gold standard are an error, images
+    not predicted yet are not (a duplicate spread over two chunks goes unnoticed).
+    """
+    from multiclass import prob_columns
+    from sketch import N_BINS, summarize_scores, merge_sketches
+
+    gt_dfs = {}
+    for challenge, gt_df in goldstandards.items():
+        if not {"image", "label"}.issubset(gt_df.columns):
+            sys.exit(f"ERROR: Ground-truth CSV missing columns: {({'image', 'label'}) - set(gt_df.columns)}")
+        gt_dfs[challenge] = gt_df.assign(image=gt_df["image"].astype(str).str.strip())[["image", "label"]]
+    known = set().union(*(set(gt_df["image"]) for gt_df in gt_dfs.values()))
+
+    sketches = dict(sketches)
+    required = {"image", "predicted_probability", "predicted_label"}
+    for chunk in submission_io.iter_predictions(pred_path, chunksize=chunksize):
+        if prob_columns(chunk):
+            sys.exit("ERROR: The sketch engine scores binary predictions only (no prob_<class> columns).")
+        if not required.issubset(chunk.columns):
+            sys.exit(f"ERROR: Predictions CSV missing columns: {required - set(chunk.columns)}")
+        chunk = chunk.assign(image=chunk["image"].astype(str).str.strip())
+        extra_pred = set(chunk["image"]) - known
+        if extra_pred:
+            sys.exit(f"ERROR: {len(extra_pred)} extra image id(s) present in predictions but in no challenge's GT.")
+
+        for challenge, gt_df in gt_dfs.items():
+            df = gt_df.merge(chunk, on="image", how="inner", validate="one_to_one")
+            chunk_sketch = summarize_scores(
+                df["label"].astype(int).to_numpy(),
+                df["predicted_probability"].astype(float).to_numpy(),
+                df["predicted_label"].astype(int).to_numpy(),
+                n_bins or (sketches[challenge]["n_bins"] if challenge in sketches else N_BINS))
+            sketches[challenge] = (merge_sketches(sketches[challenge], chunk_sketch)
+                                   if challenge in sketches else chunk_sketch)
+    return sketches
+
+
+def sketch_challenges(pred_path: Path, goldstandards: Dict[str, object], participant_id: str,
+                      community_id: str, event_id: str, cfg) -> List[dict]:
+    """Score the predictions with the sketch engine; return the approximate assessments.
+
+    The sketches in ``cfg.sketch_state`` (if it exists) are extended with the
+    predictions and saved back; those in ``cfg.merge_sketches`` are added for the metrics only.
+    The state records the sha256 of the prediction files merged into each sketch,
+    so a file is merged once however many times the run is repeated (e.g. retried).
+    """
+    from sketch import merge_sketches
+
+    state, inputs = {}, {}
+    if cfg.sketch_state and Path(cfg.sketch_state).is_file():
+        state = load_sketches(cfg.sketch_state)
+        inputs = {challenge: list(hashes) for challenge, hashes in load_sketch_inputs(cfg.sketch_state).items()}
+    digest = gt_store.content_hash(pred_path) if cfg.sketch_state and pred_path.is_file() else None
+    done = {challenge for challenge in goldstandards if digest in inputs.get(challenge, [])}
+    if done:
+        print(f"INFO: {pred_path} is already in the sketches of {sorted(done)}, not merged again.")
+    try:
+        if set(goldstandards) - done:
+            streamed = stream_sketches(pred_path, goldstandards, state, cfg.chunksize, cfg.sketch_bins)
+            for challenge in set(goldstandards) - done:
+                state[challenge] = streamed[challenge]
+                if digest:
+                    inputs.setdefault(challenge, []).append(digest)
+        sites = [load_sketches(path) for path in cfg.merge_sketches]
+        merged = {challenge: merge_sketches(state[challenge], *(site[challenge] for site in sites if challenge in site))
+                  for challenge in goldstandards}
+    except ValueError as e:  # includes submission_io.SubmissionError
+        sys.exit(f"ERROR: {e}")
+    if cfg.sketch_state:
+        save_sketches(state, cfg.sketch_state, inputs)
+
+    assessments = []
+    for challenge in goldstandards:
+        metrics, bounds = compute_sketch_metrics(merged[challenge])
+        metrics = registry.select(metrics, requested_metrics(cfg))
+        assessments.extend(flag_approximate(
+            build_assessments(metrics, challenge, participant_id, community_id, event_id), bounds))
+    return assessments
+
+
+def score_segmentations(pred_path: Path, mask_dirs: Dict[str, str], participant_id: str,
+                        community_id: str, event_id: str, cfg) -> List[dict]:
+    """Score the predicted masks of the submission with the lesion- and label-wise metrics of every segmentation challenge.
+
+    *mask_dirs* maps each challenge id to its directory of reference masks;
+    challenges sharing a directory are scored once, each directory on the
+    predicted masks of its own cases.
+    """
+    from labels import label_metrics
+    from lesions import lesion_metrics, score_cases
+
+    dir_masks = {mask_dir: submission_io.reference_masks(mask_dir) for mask_dir in dict.fromkeys(mask_dirs.values())}
+    all_cases = {case for gt_masks in dir_masks.values() for case in gt_masks}
+    per_dir = {}
+    for mask_dir, gt_masks in dir_masks.items():
+        try:
+            stats = score_cases(pred_path, gt_masks, getattr(cfg, "workers", None),
+                                getattr(cfg, "lesion_connectivity", LESION_CONNECTIVITY),
+                                getattr(cfg, "lesion_iou", LESION_IOU),
+                                other_cases=all_cases - set(gt_masks))
+        except ValueError as e:  # includes submission_io.SubmissionError
+            sys.exit(f"ERROR: {e}")
+        print(f"INFO: {len(stats)} case(s) scored against the reference masks of {mask_dir}")
+        per_dir[mask_dir] = registry.select({**lesion_metrics(stats.values()),
+                                             **label_metrics(s["labels"] for s in stats.values())},
+                                            requested_metrics(cfg))
+
+    assessments = []
+    for challenge, mask_dir in mask_dirs.items():
+        assessments.extend(build_assessments(per_dir[mask_dir], challenge, participant_id, community_id, event_id))
+    return assessments
+
+
+def template_metrics(aggregation_template: str) -> List[str]:
+    """Names of the metrics referenced by the plots and leaderboards of an aggregation template."""
+    names = []
+    for item in oeb_json.load(aggregation_template):
+        viz = item["datalink"]["inline_data"]["visualization"]
+        names.extend(viz[key] for key in ("metric", "x_axis", "y_axis") if key in viz)
+        names.extend(viz.get("metrics", []))
+    return list(dict.fromkeys(names))
+
+
+def requested_metrics(cfg) -> List[str] | None:
+    """The metrics requested by ``--metrics`` and ``--aggregation_template``, or ``None`` for the default ones."""
+    if getattr(cfg, "aggregation_template", None) is None:
+        return getattr(cfg, "metrics", None)
+    return list(dict.fromkeys((getattr(cfg, "metrics", None) or []) + template_metrics(cfg.aggregation_template)))
+
+
+# -----------------------------------------------------------------------------
+# Main routine
+# -----------------------------------------------------------------------------
+
+def main(cfg) -> List[dict]:
+    """Score one submission and write its assessment JSON.
+
+    *cfg* is an ``argparse.Namespace`` (or any object) carrying the attributes
+    defined in :func:`parse_arguments`. Returns the list of assessment objects.
+    """
+    registry.load_plugins(getattr(cfg, "metric_plugins", []))
+    pred_path = Path(cfg.input)
+    challenges = cfg.challenges_ids if isinstance(cfg.challenges_ids, list) else [cfg.challenges_ids]
+    challenges = list(dict.fromkeys(challenges))  # drop repeated ids, keep order
+    mask_dirs = {challenge: submission_io.reference_mask_dir(cfg.goldstandard_file, challenge)
+                 for challenge in challenges}
+    mask_dirs = {challenge: mask_dir for challenge, mask_dir in mask_dirs.items() if mask_dir}
+    gt_paths = {challenge: goldstandard_path(cfg.goldstandard_file, challenge)
+                for challenge in challenges if challenge not in mask_dirs}
+
+    if not pred_path.is_file():
+        sys.exit(f"ERROR: Predictions file '{pred_path}' does not exist.")
+    for gt_path in gt_paths.values():
+        if not gt_path.is_file():
+            sys.exit(f"ERROR: Ground-truth file '{gt_path}' does not exist.")
+
+    # 1. Load CSVs: each distinct gold standard once, predictions once ------
+    loaded = {gt_path: open_goldstandard(gt_path) for gt_path in set(gt_paths.values())}
+    goldstandards = {challenge: loaded[gt_path][0] for challenge, gt_path in gt_paths.items()}
+    stores = {challenge: loaded[gt_path][1] for challenge, gt_path in gt_paths.items()}
+
+    assessments = []
+    if goldstandards and getattr(cfg, "engine", "exact") == "sketch":
+        # 2.-5. Stream the predictions into the sketches --------------------
+        if cfg.cases_dir:
+            print("WARNING: --cases_dir is ignored by the sketch engine (it keeps no per-case table).")
+        assessments = sketch_challenges(
+            pred_path, goldstandards, cfg.participant_id, cfg.community_id, cfg.event_id, cfg)
+    elif goldstandards:
+        # 2.-5. Align and compute the metrics of every challenge ------------
+        try:
+            pred_df = submission_io.read_predictions(pred_path)
+        except submission_io.SubmissionError as e:
+            sys.exit(f"ERROR: {e}")
+        assessments = score_challenges(
+            pred_df, goldstandards,
+            cfg.participant_id, cfg.community_id, cfg.event_id, cfg.cases_dir, getattr(cfg, "tier", None),
+            requested_metrics(cfg), stores)
+
+    if mask_dirs:
+        # 2.-5. Lesion- and label-wise metrics of the segmentation challenges
+        if cfg.cases_dir:
+            print("INFO: no per-case tables are kept for segmentation challenges.")
+        assessments.extend(score_segmentations(
+            pred_path, mask_dirs, cfg.participant_id, cfg.community_id, cfg.event_id, cfg))
+        order = {challenge: i for i, challenge in enumerate(challenges)}
+        assessments.sort(key=lambda a: order[a["challenge_id"]])
+
+    # 6. Check and write assessment JSON -----------------------------------
+    try:
+        check_oeb_objects(assessments)
+    except ValueError as e:
+        sys.exit(f"ERROR: {e}")
+    write_assessments(assessments, cfg.outdir, getattr(cfg, "tier", None))
 
     # 7. All done -----------------------------------------------------------
-    sys.exit(0)
+    return assessments
 
 
 if __name__ == "__main__":
-    main(args)
+    options = parse_arguments().parse_args()
+    profiling.run(main, options, options.outdir, "metrics")
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Label-wise overlap metrics of multi-label segmentation masks.
+
+**Input** – a predicted and a reference label map per case (NIfTI volumes of
+integer labels, 0 is background), e.g. brain parcellations with 100+ labels.
+
+**Confusion** – every voxel's (reference label, predicted label) pair is
+encoded into one integer key, and a single ``np.bincount`` (or ``np.unique``
+when the label range is too wide for a dense count) gives the sparse confusion
+of the case: the voxels of every pair that occurs. No per-label mask and no
+dense labels × labels array is built, so the cost is linear in the voxels
+whatever the number of labels.
+
+**Metrics** – per label, from the reference volume (row sum), the predicted
+volume (column sum) and the voxels labelled alike (diagonal):
+
+* Dice: 2·|R∩P| / (|R| + |P|);
+* Jaccard: |R∩P| / |R∪P|;
+* volume similarity: 1 − ||P| − |R|| / (|P| + |R|).
+
+The labels of a case are those of its reference or prediction (a label only
+predicted scores 0). ``label_dice``, ``label_jaccard`` and
+``label_volume_similarity`` average them over the labels of each case, then
+over the cases, with the standard error across cases.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+# label of the voxels outside all structures, not scored
+BACKGROUND = 0
+
+# (reference, predicted) label pairs counted in a dense array, above which the keys are made unique first
+DENSE_PAIRS = 1 << 22
+
+
+def as_labels(volume) -> np.ndarray:
+    """Return the labels of a volume as a flat int64 array (float label maps are rounded)."""
+    volume = np.asarray(volume)
+    if volume.dtype.kind == "f":
+        volume = np.rint(volume)
+    return volume.astype(np.int64, copy=False).ravel()
+
+
+def label_confusion(ref, pred) -> Dict[str, np.ndarray]:
+    """Sparse confusion of two label maps of the same shape.
+
+    Returns ``{"reference": ..., "predicted": ..., "voxels": ...}``, three
+    arrays holding, for every (reference label, predicted label) pair that
+    occurs, its labels and its number of voxels.
+    """
+    ref = as_labels(ref)
+    pred = as_labels(pred)
+    if ref.shape != pred.shape:
+        raise ValueError(f"label maps of {ref.size} and {pred.size} voxels")
+    if not ref.size:
+        empty = np.zeros(0, dtype=np.int64)
+        return {"reference": empty, "predicted": empty, "voxels": empty}
+
+    lo = min(ref.min(), pred.min())
+    span = int(max(ref.max(), pred.max()) - lo + 1)
+    if span > 1 << 31:
+        # labels too far apart to pair in an int64 key: number them first
+        values, inverse = np.unique(np.concatenate([ref, pred]), return_inverse=True)
+        ref, pred, lo, span = inverse[:ref.size], inverse[ref.size:], 0, len(values)
+    else:
+        values = None
+
+    keys = (ref - lo) * span + (pred - lo)
+    if span * span <= DENSE_PAIRS:
+        counts = np.bincount(keys, minlength=span * span)
+        pairs = np.flatnonzero(counts)
+        voxels = counts[pairs]
+    else:
+        pairs, voxels = np.unique(keys, return_counts=True)
+
+    ref_labels, pred_labels = pairs // span + lo, pairs % span + lo
+    if values is not None:
+        ref_labels, pred_labels = values[ref_labels], values[pred_labels]
+    return {"reference": ref_labels, "predicted": pred_labels, "voxels": voxels.astype(np.int64)}
+
+
+def per_label_metrics(confusion: Dict[str, np.ndarray], background: int = BACKGROUND) -> Dict[str, np.ndarray]:
+    """Dice, Jaccard and volume similarity of every label of a sparse confusion.
+
+    Returns ``{"label": ..., "dice": ..., "jaccard": ..., "volume_similarity": ...}``,
+    one entry per label other than *background* found in the reference or the
+    prediction.
+    """
+    ref, pred, voxels = confusion["reference"], confusion["predicted"], confusion["voxels"]
+    labels = np.union1d(ref, pred)
+    labels = labels[labels != background]
+    n = len(labels)
+
+    def volumes(ids, keep):
+        return np.bincount(np.searchsorted(labels, ids[keep]), weights=voxels[keep], minlength=n)
+
+    ref_volume = volumes(ref, ref != background)
+    pred_volume = volumes(pred, pred != background)
+    common = volumes(ref, (ref == pred) & (ref != background))
+
+    total = ref_volume + pred_volume
+    return {
+        "label": labels,
+        "dice": 2 * common / total,
+        "jaccard": common / (total - common),
+        "volume_similarity": 1 - np.abs(pred_volume - ref_volume) / total,
+    }
+
+
+def label_metrics(confusions: Iterable[Dict[str, np.ndarray]],
+                  background: int = BACKGROUND) -> Dict[str, Tuple[float, float]]:
+    """Average the label-wise metrics of the cases into ``{metric: (value, stderr)}``.
+
+    Each case weighs the same whatever its number of labels; cases without any
+    label (empty reference and prediction) are left out.
+    """
+    per_case = {"dice": [], "jaccard": [], "volume_similarity": []}
+    for confusion in confusions:
+        metrics = per_label_metrics(confusion, background)
+        if not len(metrics["label"]):
+            continue
+        for name, values in per_case.items():
+            values.append(float(metrics[name].mean()))
+
+    results = {}
+    for name, values in per_case.items():
+        values = np.asarray(values)
+        if not len(values):
+            results["label_" + name] = (float("nan"), float("nan"))
+        else:
+            stderr = float(values.std(ddof=1) / np.sqrt(len(values))) if len(values) > 1 else 0.0
+            results["label_" + name] = (float(values.mean()), stderr)
+    return results
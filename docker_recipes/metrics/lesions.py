@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Lesion-wise detection metrics of segmentation masks.
+
+**Input** – a predicted and a reference mask per case (NIfTI volumes, any
+non-zero voxel is lesion). Each mask is split into lesions, its connected
+components (``scipy.ndimage.label``), once.
+
+**Matching** – the voxels where both masks are lesion pair a reference lesion
+with a predicted one; a single ``np.bincount`` over the paired component ids
+gives the sparse overlap matrix (reference lesion, predicted lesion, voxels in
+common), without looping over lesion pairs. A reference and a predicted lesion
+match when each is the other's best-overlapping lesion (highest IoU) and their
+IoU exceeds ``MATCH_IOU``: the matching is one-to-one, and sorting the
+overlapping pairs once yields it for all lesions.
+
+**Metrics** – over all the cases of a challenge:
+
+* ``lesion_sensitivity``: matched reference lesions / reference lesions;
+* ``lesion_precision``: matched predicted lesions / predicted lesions;
+* ``lesion_f1``: 2·TP / (2·TP + FP + FN);
+* ``lesion_dice``: per-lesion Dice, averaged over matched pairs, missed
+  reference lesions and false-positive predicted lesions (the last two
+  counting 0), so that both detection and delineation weigh in.
+
+Cases are scored in parallel processes (:func:`score_cases`), each decoding its
+two volumes and returning only lesion counts, the Dice of its matches and the
+sparse label confusion of ``labels.py``.
+"""
+from __future__ import annotations
+
+import io
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+# lesions of IoU at most this with their best match are not detected
+MATCH_IOU = 0.1
+
+# voxels of a lesion: 3 = sharing a face, an edge or a corner (26-neighbourhood in 3D), 1 = a face only
+CONNECTIVITY = 3
+
+# (reference, predicted) lesion pairs counted in a dense array, above which the keys are made unique first
+DENSE_PAIRS = 1 << 22
+
+
+# -----------------------------------------------------------------------------
+# Lesions of one case
+# -----------------------------------------------------------------------------
+
+def label_components(mask, connectivity: int = CONNECTIVITY) -> Tuple[np.ndarray, int]:
+    """Return the lesion (connected component) id of each voxel, 0 outside lesions, and the number of lesions."""
+    from scipy import ndimage
+
+    mask = np.asarray(mask) != 0
+    structure = ndimage.generate_binary_structure(mask.ndim, min(connectivity, mask.ndim))
+    labels, n = ndimage.label(mask, structure=structure)
+    return labels, int(n)
+
+
+def overlap_matrix(ref_labels, n_ref: int, pred_labels, n_pred: int):
+    """Sparse overlap of the reference and predicted lesions.
+
+    Returns the reference lesion ids, predicted lesion ids and voxels in common
+    of every overlapping pair (ids from 1), and the size of every reference and
+    predicted lesion.
+    """
+    ref = ref_labels.ravel()
+    pred = pred_labels.ravel()
+    ref_sizes = np.bincount(ref, minlength=n_ref + 1)[1:]
+    pred_sizes = np.bincount(pred, minlength=n_pred + 1)[1:]
+
+    both = (ref != 0) & (pred != 0)
+    keys = ref[both].astype(np.int64) * (n_pred + 1) + pred[both]
+    if (n_ref + 1) * (n_pred + 1) <= DENSE_PAIRS:
+        counts = np.bincount(keys, minlength=(n_ref + 1) * (n_pred + 1))
+        pairs = np.flatnonzero(counts)
+        overlap = counts[pairs]
+    else:
+        pairs, inverse = np.unique(keys, return_inverse=True)
+        overlap = np.bincount(inverse)
+    return pairs // (n_pred + 1), pairs % (n_pred + 1), overlap, ref_sizes, pred_sizes
+
+
+def best_pairs(ids, iou) -> np.ndarray:
+    """Mask of the pairs holding the highest IoU of their lesion *ids* (ties: the first pair)."""
+    order = np.lexsort((-iou, ids))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = ids[order][1:] != ids[order][:-1]
+    best = np.zeros(len(order), dtype=bool)
+    best[order[first]] = True
+    return best
+
+
+def match_lesions(ref_ids, pred_ids, overlap, ref_sizes, pred_sizes, iou_threshold: float = MATCH_IOU):
+    """Return the mask of the matched pairs of an overlap matrix, and the Dice of every pair."""
+    ref_size = ref_sizes[ref_ids - 1]
+    pred_size = pred_sizes[pred_ids - 1]
+    iou = overlap / (ref_size + pred_size - overlap)
+    dice = 2 * overlap / (ref_size + pred_size)
+    matched = (iou > iou_threshold) & best_pairs(ref_ids, iou) & best_pairs(pred_ids, iou)
+    return matched, dice
+
+
+def lesion_stats(ref_mask, pred_mask, connectivity: int = CONNECTIVITY,
+                 iou_threshold: float = MATCH_IOU) -> dict:
+    """Lesion counts of one case: reference and predicted lesions, matches, and the Dice of each match."""
+    ref_labels, n_ref = label_components(ref_mask, connectivity)
+    pred_labels, n_pred = label_components(pred_mask, connectivity)
+    ref_ids, pred_ids, overlap, ref_sizes, pred_sizes = overlap_matrix(ref_labels, n_ref, pred_labels, n_pred)
+    matched, dice = match_lesions(ref_ids, pred_ids, overlap, ref_sizes, pred_sizes, iou_threshold)
+    return {"reference": n_ref, "predicted": n_pred, "matched": int(matched.sum()), "dice": dice[matched]}
+
+
+# -----------------------------------------------------------------------------
+# Metrics of a challenge
+# -----------------------------------------------------------------------------
+
+def lesion_metrics(stats: Iterable[dict]) -> Dict[str, Tuple[float, float]]:
+    """Pool the lesion counts of all cases into ``{metric: (value, stderr)}``."""
+    stats = list(stats)
+    n_ref = sum(s["reference"] for s in stats)
+    n_pred = sum(s["predicted"] for s in stats)
+    tp = sum(s["matched"] for s in stats)
+    fn, fp = n_ref - tp, n_pred - tp
+
+    def rate(k, n):
+        if not n:
+            return float("nan"), float("nan")
+        p = k / n
+        return p, float(np.sqrt(p * (1 - p) / n))
+
+    # one Dice per lesion: matched pairs, then 0 for missed and false-positive lesions
+    dice = np.concatenate([s["dice"] for s in stats] + [np.zeros(fn + fp)])
+    if len(dice):
+        lesion_dice = (float(dice.mean()), float(dice.std(ddof=1) / np.sqrt(len(dice))) if len(dice) > 1 else 0.0)
+    else:
+        lesion_dice = (float("nan"), float("nan"))
+
+    return {
+        "lesion_sensitivity": rate(tp, n_ref),
+        "lesion_precision": rate(tp, n_pred),
+        "lesion_f1": (2 * tp / (2 * tp + fp + fn) if tp + fp + fn else float("nan"), 0.0),
+        "lesion_dice": lesion_dice,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Parallel scoring of the cases of a submission
+# -----------------------------------------------------------------------------
+
+def case_stats(case: str, pred_bytes: bytes, gt_path: str, connectivity: int, iou_threshold: float):
+    """Worker: decode the predicted (raw NIfTI bytes) and reference masks of a case and return its lesion counts.
+
+    The counts also hold the sparse label confusion of the two masks (``"labels"``).
+    """
+    import nibabel
+    import submission_io
+    from labels import label_confusion
+
+    pred = submission_io.read_volume(io.BytesIO(pred_bytes))
+    ref = nibabel.load(gt_path)
+    if pred.shape != ref.shape:
+        raise ValueError(f"case {case}: predicted mask of shape {pred.shape}, reference mask of shape {ref.shape}")
+    ref, pred = np.asanyarray(ref.dataobj), np.asanyarray(pred.dataobj)
+    stats = lesion_stats(ref, pred, connectivity, iou_threshold)
+    stats["labels"] = label_confusion(ref, pred)
+    return case, stats
+
+
+def score_cases(pred_path: Path, gt_masks: Dict[str, str], workers: int | None = None,
+                connectivity: int = CONNECTIVITY, iou_threshold: float = MATCH_IOU,
+                other_cases: Iterable[str] = ()) -> Dict[str, dict]:
+    """Lesion counts of every case of a submission, as ``{case: stats}``.
+
+    The predicted masks (``brain_<case>.nii[.gz]``) are streamed from the
+    submission one at a time and handed to a pool of processes, with at most
+    two cases per process in flight. *gt_masks* maps each case to its reference
+    mask; a case missing from the submission, or in neither *gt_masks* nor
+    *other_cases* (the cases of the other segmentation challenges of the
+    submission, skipped), is an error (``ValueError``).
+    """
+    import submission_io
+
+    workers = max(workers or os.cpu_count() or 1, 1)
+    results: Dict[str, dict] = {}
+    pending = {}  # future: case
+    seen = set()
+    other_cases = set(other_cases)
+
+    def collect(done):
+        for future in done:
+            case, stats = future.result()
+            results[case] = stats
+            del pending[future]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for member in submission_io.iter_members(pred_path):
+            if member.kind != submission_io.NIFTI:
+                continue
+            case = submission_io.case_id(member.name, submission_io.PRED_MASK_PREFIX)
+            if case in other_cases and case not in gt_masks:
+                continue
+            if case not in gt_masks:
+                raise ValueError(f"predicted mask {member.name}: no reference mask for case {case}")
+            if case in seen:
+                raise ValueError(f"case {case}: more than one predicted mask")
+            seen.add(case)
+            future = pool.submit(case_stats, case, member.stream.read(), gt_masks[case], connectivity, iou_threshold)
+            pending[future] = case
+            if len(pending) >= 2 * workers:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        collect(list(pending))
+
+    missing = sorted(set(gt_masks) - set(results))
+    if missing:
+        raise ValueError(f"{len(missing)} case(s) without a predicted mask, e.g. {missing[:5]}")
+    return results
+
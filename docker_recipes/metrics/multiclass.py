@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Multi-class and multi-label metrics for the wide prediction schema.
+
+**Input schema**
+────────────────
+* predictions: `image`, one `prob_<class>` column per class and, optionally,
+  `predicted_label` (multi-class only; the arg-max class when absent);
+* multi-class ground truth: `image`, `label` (one class name per image);
+* multi-label ground truth: `image`, one 0/1 `label_<class>` column per class.
+  Predicted labels are the scores thresholded at 0.5.
+
+The order of the `prob_<class>` columns is the class order, which the quadratic
+kappa treats as ordinal (e.g. tumour grades).
+
+**Metrics** – computed with array algebra rather than per-class sklearn calls:
+the K×K confusion matrix (multi-class) or the K stacked 2×2 matrices
+(multi-label) come from a single ``np.bincount``; macro, micro and weighted
+precision, sensitivity (recall) and F1, the multi-class MCC and the quadratic
+kappa are derived from it. One-vs-rest ROC-AUC and PR-AUC (average precision)
+of all classes come from one batched ``argsort`` of the score matrix.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# column prefixes of the schema, shared with the validation stage (oeb_schemas, on sys.path via compute_metrics.py)
+from submission_io import PROB_PREFIX, LABEL_PREFIX
+
+# score threshold for the multi-label hard predictions
+THRESHOLD = 0.5
+
+
+def safe_div(num, den):
+    """Element-wise division returning NaN where the denominator is 0."""
+    num = np.asarray(num, dtype=float)
+    den = np.asarray(den, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den == 0, np.nan, num / np.where(den == 0, 1, den))
+
+
+def prob_columns(df) -> List[str]:
+    """Return the `prob_<class>` columns of *df*, in order."""
+    return [c for c in df.columns if str(c).startswith(PROB_PREFIX)]
+
+
+def label_columns(df) -> List[str]:
+    """Return the `label_<class>` columns of *df*, in order."""
+    return [c for c in df.columns if str(c).startswith(LABEL_PREFIX)]
+
+
+# -----------------------------------------------------------------------------
+# Counting
+# -----------------------------------------------------------------------------
+
+def confusion_matrix(y_true, y_pred, k: int):
+    """K×K confusion matrix (rows: truth, columns: prediction) of class indices, in one bincount."""
+    return np.bincount(k * np.asarray(y_true) + np.asarray(y_pred), minlength=k * k).reshape(k, k)
+
+
+def stacked_confusion(Y_true, Y_pred):
+    """Per-class 2×2 confusion matrices of n×K 0/1 matrices, as a K×2×2 array, in one bincount."""
+    k = Y_true.shape[1]
+    keys = 4 * np.arange(k) + 2 * Y_true.astype(np.int64) + Y_pred.astype(np.int64)
+    return np.bincount(keys.ravel(), minlength=4 * k).reshape(k, 2, 2)
+
+
+# -----------------------------------------------------------------------------
+# Metrics from counts
+# -----------------------------------------------------------------------------
+
+def averaged_scores(tp, fp, fn) -> Dict[str, float]:
+    """Macro, micro and support-weighted precision, sensitivity and F1 of per-class counts."""
+    precision   = safe_div(tp, tp + fp)
+    sensitivity = safe_div(tp, tp + fn)
+    f1          = safe_div(2 * tp, 2 * tp + fp + fn)
+    support = tp + fn
+
+    micro_p  = float(safe_div(tp.sum(), tp.sum() + fp.sum()))
+    micro_r  = float(safe_div(tp.sum(), tp.sum() + fn.sum()))
+    micro_f1 = float(safe_div(2 * tp.sum(), 2 * tp.sum() + fp.sum() + fn.sum()))
+
+    def weighted(values):
+        return float(safe_div(np.nansum(values * support), support.sum()))
+
+    return {
+        "precision_macro":     float(np.nanmean(precision)) if np.isfinite(precision).any() else np.nan,
+        "sensitivity_macro":   float(np.nanmean(sensitivity)) if np.isfinite(sensitivity).any() else np.nan,
+        "f1_score_macro":      float(np.nanmean(f1)) if np.isfinite(f1).any() else np.nan,
+        "precision_micro":     micro_p,
+        "sensitivity_micro":   micro_r,
+        "f1_score_micro":      micro_f1,
+        "precision_weighted":  weighted(precision),
+        "sensitivity_weighted": weighted(sensitivity),
+        "f1_score_weighted":   weighted(f1),
+    }
+
+
+def multiclass_mcc(cm) -> float:
+    """Matthews correlation coefficient of a K×K confusion matrix (Gorodkin's R_K)."""
+    cm = cm.astype(float)
+    s = cm.sum()
+    c = np.trace(cm)
+    t = cm.sum(axis=1)  # true occurrences per class
+    p = cm.sum(axis=0)  # predictions per class
+    return float(safe_div(c * s - t @ p, np.sqrt((s * s - p @ p) * (s * s - t @ t))))
+
+
+def quadratic_kappa(cm) -> float:
+    """Quadratic-weighted Cohen's kappa of a K×K confusion matrix with ordinal classes."""
+    cm = cm.astype(float)
+    k = cm.shape[0]
+    idx = np.arange(k)
+    weights = (idx[:, None] - idx[None, :]) ** 2 / max((k - 1) ** 2, 1)
+    expected = np.outer(cm.sum(axis=1), cm.sum(axis=0)) / cm.sum()
+    return float(1 - safe_div((weights * cm).sum(), (weights * expected).sum()))
+
+
+def cohen_kappa(cm) -> float:
+    """Unweighted Cohen's kappa of a K×K confusion matrix."""
+    cm = cm.astype(float)
+    s = cm.sum()
+    observed = np.trace(cm) / s
+    expected = cm.sum(axis=1) @ cm.sum(axis=0) / (s * s)
+    return float(safe_div(observed - expected, 1 - expected))
+
+
+def one_vs_rest_auc(Y, S) -> Tuple[np.ndarray, np.ndarray]:
+    """ROC-AUC and PR-AUC (average precision) of every column of the n×K labels *Y* / scores *S*.
+
+    One ``argsort`` along the cases serves all classes: ties get their average
+    rank for the ROC-AUC (Mann-Whitney U) and are treated as one threshold for
+    the average precision, matching sklearn. Classes without both positives
+    and negatives get NaN.
+    """
+    Y = np.asarray(Y, dtype=float)
+    S = np.asarray(S, dtype=float)
+    n, k = S.shape
+    positives = Y.sum(axis=0)
+    negatives = n - positives
+
+    order = np.argsort(S, axis=0, kind="mergesort")  # ascending, per class
+    s_sorted = np.take_along_axis(S, order, axis=0)
+    y_sorted = np.take_along_axis(Y, order, axis=0)
+
+    # first / last row of each run of equal scores, per column
+    rows = np.arange(n)[:, None]
+    new_run = np.ones((n, k), dtype=bool)
+    new_run[1:] = s_sorted[1:] != s_sorted[:-1]
+    end_run = np.ones((n, k), dtype=bool)
+    end_run[:-1] = new_run[1:]
+    first = np.maximum.accumulate(np.where(new_run, rows, 0), axis=0)
+    last = np.minimum.accumulate(np.where(end_run, rows, n - 1)[::-1], axis=0)[::-1]
+
+    # ROC-AUC from the average ranks of the positives
+    ranks = (first + last) / 2 + 1
+    rank_sum = (ranks * y_sorted).sum(axis=0)
+    roc_auc = safe_div(rank_sum - positives * (positives + 1) / 2, positives * negatives)
+
+    # average precision, scanning the ascending order from the top: the cases
+    # ranked at or above row i are rows i..n-1, so each run is one threshold
+    above = np.cumsum(y_sorted[::-1], axis=0)[::-1]  # positives at or above row i
+    above = np.vstack([above, np.zeros((1, k))])     # row n: none
+    tp = np.take_along_axis(above, first, axis=0)
+    gain = tp - np.take_along_axis(above, last + 1, axis=0)
+    precision = tp / (n - first)
+    pr_auc = safe_div(np.where(new_run, gain * precision, 0).sum(axis=0), positives)
+
+    missing = (positives == 0) | (negatives == 0)
+    roc_auc = np.where(missing, np.nan, roc_auc)
+    pr_auc = np.where(missing, np.nan, pr_auc)
+    return roc_auc, pr_auc
+
+
+def auc_metrics(classes: List[str], Y, S) -> Dict[str, float]:
+    """Per-class and macro-averaged one-vs-rest ROC / PR AUCs."""
+    roc_auc, pr_auc = one_vs_rest_auc(Y, S)
+    metrics = {
+        "roc_auc": float(np.nanmean(roc_auc)) if np.isfinite(roc_auc).any() else np.nan,
+        "pr_auc":  float(np.nanmean(pr_auc)) if np.isfinite(pr_auc).any() else np.nan,
+    }
+    for name, roc, pr in zip(classes, roc_auc, pr_auc):
+        metrics[f"roc_auc_{name}"] = float(roc)
+        metrics[f"pr_auc_{name}"] = float(pr)
+    return metrics
+
+
+# -----------------------------------------------------------------------------
+# Engines
+# -----------------------------------------------------------------------------
+
+def compute_multiclass_metrics(df, point_only: bool = False) -> Dict[str, Tuple[float, float]]:
+    """Metrics of an aligned multi-class table as ``{name: (value, stderr)}``.
+
+    *point_only* keeps the confusion-matrix metrics (the provisional tier) and skips the AUCs.
+    """
+    columns = prob_columns(df)
+    classes = [c[len(PROB_PREFIX):] for c in columns]
+    k = len(classes)
+    index = {name: i for i, name in enumerate(classes)}
+
+    S = df[columns].astype(float).to_numpy()
+    y_true = df["label"].astype(str).str.strip().map(index).to_numpy()
+    if "predicted_label" in df.columns:
+        y_pred = df["predicted_label"].astype(str).str.strip().map(index).to_numpy()
+    else:
+        y_pred = S.argmax(axis=1)
+
+    cm = confusion_matrix(y_true, y_pred, k)
+    tp = np.diag(cm).astype(float)
+    fp = cm.sum(axis=0) - tp
+    fn = cm.sum(axis=1) - tp
+
+    metrics = {
+        "accuracy":          float(safe_div(tp.sum(), cm.sum())),
+        "balanced_accuracy": float(np.nanmean(safe_div(tp, tp + fn))),
+    }
+    metrics.update(averaged_scores(tp, fp, fn))
+    metrics["cohen_kappa"] = cohen_kappa(cm)
+    metrics["weighted_cohen_kappa"] = quadratic_kappa(cm)
+    metrics["matthews_corrcoef"] = multiclass_mcc(cm)
+    if not point_only:
+        metrics.update(auc_metrics(classes, np.eye(k)[y_true], S))
+
+    # one compact object: rows are the true classes, columns the predicted ones
+    metrics["confusion_matrix"] = {"classes": classes, "counts": cm.tolist()}
+    return {name: (value, 0.0) for name, value in metrics.items()}
+
+
+def compute_multilabel_metrics(df, point_only: bool = False) -> Dict[str, Tuple[float, float]]:
+    """Metrics of an aligned multi-label table as ``{name: (value, stderr)}``.
+
+    *point_only* keeps the confusion-matrix metrics (the provisional tier) and skips the AUCs.
+    """
+    columns = prob_columns(df)
+    classes = [c[len(PROB_PREFIX):] for c in columns]
+
+    S = df[columns].astype(float).to_numpy()
+    Y = df[[LABEL_PREFIX + name for name in classes]].astype(int).to_numpy()
+    P = (S >= THRESHOLD).astype(int)
+
+    counts = stacked_confusion(Y, P)  # [class, truth, prediction]
+    tp = counts[:, 1, 1].astype(float)
+    fp = counts[:, 0, 1].astype(float)
+    fn = counts[:, 1, 0].astype(float)
+
+    metrics = {
+        "subset_accuracy": float(np.mean((Y == P).all(axis=1))),
+        "hamming_loss":    float(np.mean(Y != P)),
+    }
+    metrics.update(averaged_scores(tp, fp, fn))
+    if not point_only:
+        metrics.update(auc_metrics(classes, Y, S))
+
+    # the 2×2 counts of every class, as one compact object
+    metrics["confusion_matrix"] = {"classes": classes, "tp": counts[:, 1, 1].tolist(), "fp": counts[:, 0, 1].tolist(),
+                                   "fn": counts[:, 1, 0].tolist(), "tn": counts[:, 0, 0].tolist()}
+    return {name: (value, 0.0) for name, value in metrics.items()}
+
+
+# -----------------------------------------------------------------------------
+# Per-case outcomes
+# -----------------------------------------------------------------------------
+
+def case_outcomes(df) -> Tuple[np.ndarray, np.ndarray]:
+    """Whether each case of an aligned wide table was predicted right, and the probability given to its truth.
+
+    Multi-class: the predicted class (as in :func:`compute_multiclass_metrics`) is the true one.
+    Multi-label: every class is right at :data:`THRESHOLD`; the probability is the mean over the classes.
+    """
+    columns = prob_columns(df)
+    classes = [c[len(PROB_PREFIX):] for c in columns]
+    S = df[columns].astype(float).to_numpy()
+
+    if "label" in df.columns:
+        index = {name: i for i, name in enumerate(classes)}
+        y_true = df["label"].astype(str).str.strip().map(index).to_numpy()
+        if "predicted_label" in df.columns:
+            y_pred = df["predicted_label"].astype(str).str.strip().map(index).to_numpy()
+        else:
+            y_pred = S.argmax(axis=1)
+        return y_pred == y_true, S[np.arange(len(S)), y_true]
+
+    Y = df[[LABEL_PREFIX + name for name in classes]].astype(int).to_numpy()
+    return ((S >= THRESHOLD) == (Y == 1)).all(axis=1), np.where(Y == 1, S, 1 - S).mean(axis=1)
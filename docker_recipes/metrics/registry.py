@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Metric registry of the binary-classification engine.
+
+**Registration** – every metric declares the intermediates it is computed from
+(:func:`metric`), and every intermediate the ones it is computed from in turn
+(:func:`intermediate`), e.g. ``roc_auc`` ← ``roc_curve`` ← ``cumulative_sums``
+← ``sorted_scores`` ← ``y_true``, ``y_score`` ← ``table``. ``compute_metrics.py``
+registers the built-in metrics; plugins (``--metric_plugins``) are modules
+that import this one and register more, without touching the engine.
+
+**Resolution** – :func:`compute` walks the dependencies of the requested
+metrics only: each intermediate they need is computed exactly once, however
+many metrics share it, and the others not at all. A metric is requested by its
+exact name (``"accuracy"`` does not request ``balanced_accuracy``). Without a
+request the default metrics are computed.
+
+**Provisional tier** – metrics registered with ``provisional=True`` are cheap
+enough for the provisional results (``--tier 1``).
+
+**Variants** – names registered with :func:`register_group` (e.g. ``roc_auc``
+of the multi-class engine) also request their variants ``<name>_<suffix>``
+(``roc_auc_<class>``, ``f1_score_macro``).
+"""
+from __future__ import annotations
+
+import importlib
+import importlib.util
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+Intermediate = namedtuple("Intermediate", ["name", "requires", "compute"])
+Metric = namedtuple("Metric", ["name", "requires", "compute", "default", "provisional"])
+
+# name: Intermediate / Metric, in registration order
+INTERMEDIATES: Dict[str, Intermediate] = {}
+METRICS: Dict[str, Metric] = {}
+
+# names requesting their variants <name>_<suffix> too (see register_group)
+GROUPS: Set[str] = set()
+
+# the intermediate holding the engine's input (an aligned predictions / ground-truth table)
+ROOT = "table"
+
+
+def intermediate(name: str, requires: Iterable[str] = (ROOT,)) -> Callable:
+    """Decorator registering a function as the intermediate *name*.
+
+    The function is called with the values of the intermediates *requires*, in order.
+    """
+    def register(func):
+        INTERMEDIATES[name] = Intermediate(name, tuple(requires), func)
+        return func
+    return register
+
+
+def register_metric(name: str, requires: Iterable[str], func: Callable, default: bool = True,
+                    provisional: bool = False) -> None:
+    """Register the metric *name*: ``func(*intermediates)`` returns its ``(value, stderr)``.
+
+    *default* metrics are computed when no metric is requested; *provisional*
+    ones also in the provisional tier.
+    """
+    METRICS[name] = Metric(name, tuple(requires), func, default, provisional)
+
+
+def metric(name: str, requires: Iterable[str], default: bool = True, provisional: bool = False) -> Callable:
+    """Decorator form of :func:`register_metric`."""
+    def register(func):
+        register_metric(name, requires, func, default, provisional)
+        return func
+    return register
+
+
+def register_group(*names: str) -> None:
+    """Make each of *names* request its variants ``<name>_<suffix>`` as well as itself."""
+    GROUPS.update(names)
+
+
+def is_requested(name: str, requested: Iterable[str] | None) -> bool:
+    """Whether the metric *name* is requested (``None``: no request, every metric is)."""
+    return requested is None or any(name == r or (r in GROUPS and name.startswith(r + "_")) for r in requested)
+
+
+def resolve(requested: Iterable[str] | None = None, provisional: bool = False) -> List[str]:
+    """Names of the registered metrics to compute, in registration order."""
+    requested = None if requested is None else list(requested)
+    return [m.name for m in METRICS.values()
+            if (m.default if requested is None else is_requested(m.name, requested))
+            and (m.provisional or not provisional)]
+
+
+def compute(table, requested: Iterable[str] | None = None,
+            provisional: bool = False) -> Dict[str, Tuple[float | list, float]]:
+    """Compute the requested metrics of *table* as ``{name: (value, stderr)}``."""
+    values = {ROOT: table}
+
+    def value(name):
+        if name not in values:
+            if name not in INTERMEDIATES:
+                raise KeyError(f"unknown intermediate '{name}'")
+            step = INTERMEDIATES[name]
+            values[name] = step.compute(*[value(r) for r in step.requires])
+        return values[name]
+
+    metrics = {}
+    for name in resolve(requested, provisional):
+        m = METRICS[name]
+        metrics[name] = m.compute(*[value(r) for r in m.requires])
+    return metrics
+
+
+def select(metrics: Dict[str, object], requested: Iterable[str] | None) -> Dict[str, object]:
+    """Keep the requested entries of an engine's ``{name: ...}`` results (engines without a registry)."""
+    if requested is None:
+        return metrics
+    requested = list(requested)
+    return {name: v for name, v in metrics.items() if is_requested(name, requested)}
+
+
+def load_plugins(plugins: Iterable[str]) -> None:
+    """Import the plugin modules (module names or ``.py`` paths) that register metrics."""
+    for plugin in plugins:
+        if plugin.endswith(".py"):
+            path = Path(plugin)
+            spec = importlib.util.spec_from_file_location(f"metric_plugin_{path.stem}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        else:
+            importlib.import_module(plugin)
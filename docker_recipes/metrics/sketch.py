@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Bounded-memory sketch of a stream of binary predictions.
+
+A sketch holds, whatever the number of cases it has seen:
+
+* two fine histograms of the predicted probabilities over ``n_bins`` equal-width
+  bins of [0, 1], one for the positive and one for the negative cases;
+* the 2×2 confusion matrix of the predicted labels;
+* the binned calibration summary of ``calibration.py``.
+
+Every field is a count or a sum, so the sketch of a new chunk of predictions is
+appended with :func:`merge_sketches`, and sketches of separate sites merge the
+same way; the merged sketch equals the sketch of the concatenated data.
+
+**Accuracy** – the confusion-matrix and calibration metrics are exact. The AUCs
+are computed as if the scores of each bin were tied, with these error bounds:
+
+* ROC-AUC: ``|exact - sketch| <= 0.5 * Σ_b pos_b·neg_b / (P·N)``, i.e. half the
+  share of positive/negative pairs that fall in the same bin;
+* PR-AUC: the points of the curve at the bin edges are exact; between two edges
+  the exact precision lies within ``[tp₁/(tp₁+fp₂), tp₂/(tp₂+fp₁)]``, so the
+  error is at most the sum over bins of the recall gained times that interval.
+
+Both bounds are computed from the sketch itself and shrink with finer bins.
+The ROC-AUC standard error is DeLong's, for the binned scores.
+"""
+from __future__ import annotations
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+from calibration import summarize_calibration, merge_calibration_summaries
+
+# default number of score bins (memory: two int64 arrays of this size per sketch)
+N_BINS = 4096
+
+# version of the serialised format (sketch_to_json)
+FORMAT_VERSION = 1
+
+
+def summarize_scores(y_true, y_score, y_pred, n_bins: int = N_BINS) -> Dict[str, object]:
+    """Return the sketch of binary labels *y_true*, scores *y_score* and predicted labels *y_pred*."""
+    y_true  = np.asarray(y_true, dtype=np.int64)
+    y_score = np.asarray(y_score, dtype=float)
+    y_pred  = np.asarray(y_pred, dtype=np.int64)
+
+    # bin i holds scores in [i/n, (i+1)/n); a score of exactly 1 falls in the last bin
+    bins = np.clip((np.clip(y_score, 0.0, 1.0) * n_bins).astype(np.int64), 0, n_bins - 1)
+    return {
+        "n_bins":      n_bins,
+        "positives":   np.bincount(bins[y_true == 1], minlength=n_bins).astype(np.int64),
+        "negatives":   np.bincount(bins[y_true != 1], minlength=n_bins).astype(np.int64),
+        "confusion":   np.bincount(2 * y_true + y_pred, minlength=4).astype(np.int64).reshape(2, 2),
+        "calibration": summarize_calibration(y_true, y_score),
+    }
+
+
+def merge_sketches(*sketches: Dict[str, object]) -> Dict[str, object]:
+    """Add up sketches built with the same number of bins."""
+    n_bins = {s["n_bins"] for s in sketches}
+    if len(n_bins) != 1:
+        raise ValueError(f"Cannot merge sketches with different bin counts: {sorted(n_bins)}")
+
+    merged = dict(sketches[0])
+    for s in sketches[1:]:
+        for key in ("positives", "negatives", "confusion"):
+            merged[key] = merged[key] + s[key]
+    merged["calibration"] = merge_calibration_summaries(*(s["calibration"] for s in sketches))
+    return merged
+
+
+def sketch_to_json(sketch: Dict[str, object]) -> Dict[str, object]:
+    """Return *sketch* as JSON-serialisable lists and numbers."""
+    calibration = sketch["calibration"]
+    return {
+        "n_bins":      sketch["n_bins"],
+        "positives":   sketch["positives"].tolist(),
+        "negatives":   sketch["negatives"].tolist(),
+        "confusion":   sketch["confusion"].tolist(),
+        "calibration": {key: value.tolist() if isinstance(value, np.ndarray) else value
+                        for key, value in calibration.items()},
+    }
+
+
+def sketch_from_json(obj: Dict[str, object]) -> Dict[str, object]:
+    """Inverse of :func:`sketch_to_json`."""
+    calibration = dict(obj["calibration"])
+    calibration["count"] = np.asarray(calibration["count"], dtype=np.int64)
+    for key in ("score_sum", "positives"):
+        calibration[key] = np.asarray(calibration[key], dtype=float)
+    return {
+        "n_bins":      int(obj["n_bins"]),
+        "positives":   np.asarray(obj["positives"], dtype=np.int64),
+        "negatives":   np.asarray(obj["negatives"], dtype=np.int64),
+        "confusion":   np.asarray(obj["confusion"], dtype=np.int64).reshape(2, 2),
+        "calibration": calibration,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Metrics from a sketch
+# -----------------------------------------------------------------------------
+
+def roc_auc(sketch: Dict[str, object]) -> Tuple[float, float, float]:
+    """Return the ROC-AUC of a sketch, its DeLong standard error and its error bound."""
+    pos = sketch["positives"].astype(float)
+    neg = sketch["negatives"].astype(float)
+    m, n = pos.sum(), neg.sum()
+    if m == 0 or n == 0:
+        return float("nan"), float("nan"), float("nan")
+
+    neg_below = np.cumsum(neg) - neg
+    pos_above = m - np.cumsum(pos)
+    v10 = (neg_below + 0.5 * neg) / n    # per positive of a bin: share of negatives scored lower
+    v01 = (pos_above + 0.5 * pos) / m    # per negative of a bin: share of positives scored higher
+    auc = float(np.dot(pos, v10) / m)
+    bound = float(0.5 * np.dot(pos, neg) / (m * n))
+
+    if m < 2 or n < 2:
+        return auc, float("nan"), bound
+    var10 = np.dot(pos, (v10 - auc) ** 2) / (m - 1)
+    var01 = np.dot(neg, (v01 - auc) ** 2) / (n - 1)
+    return auc, float(np.sqrt(var10 / m + var01 / n)), bound
+
+
+def pr_auc(sketch: Dict[str, object]) -> Tuple[float, float]:
+    """Return the PR-AUC (trapezoidal, as ``auc(recall, precision)``) of a sketch and its error bound."""
+    pos = sketch["positives"][::-1].astype(float)
+    neg = sketch["negatives"][::-1].astype(float)
+    filled = (pos + neg) > 0
+    total = pos.sum()
+    if total == 0 or neg.sum() == 0:
+        return float("nan"), float("nan")
+
+    # curve points at the bin edges, from the highest threshold down, after (recall 0, precision 1)
+    tp = np.r_[0.0, np.cumsum(pos)[filled]]
+    fp = np.r_[0.0, np.cumsum(neg)[filled]]
+    recall = tp / total
+    precision = np.r_[1.0, tp[1:] / (tp[1:] + fp[1:])]
+    auc = float(np.sum(np.diff(recall) * (precision[1:] + precision[:-1]) / 2))
+
+    # within a bin the exact precision stays between these two
+    den = tp[:-1] + fp[1:]
+    low = np.where(den > 0, tp[:-1] / np.maximum(den, 1), 1.0)
+    high = np.r_[1.0, tp[2:] / (tp[2:] + fp[1:-1])]
+    bound = float(np.sum(np.diff(recall) * (high - low)))
+    return auc, bound
@@ -0,0 +1,36 @@
+import math
+
+import numpy as np
+import pytest
+
+from calibration import calibration_metrics, merge_calibration_summaries, summarize_calibration
+
+
+def test_metrics_of_a_known_input():
+    y_true = [0, 1, 0, 1, 1]
+    y_score = [0.05, 0.15, 0.25, 0.75, 1.0]
+    metrics = calibration_metrics(summarize_calibration(y_true, y_score, n_bins=2))
+
+    assert metrics["brier_score"][0] == pytest.approx((0.05**2 + 0.85**2 + 0.25**2 + 0.25**2) / 5)
+    assert metrics["log_loss"][0] == pytest.approx(
+        -(math.log(0.95) + math.log(0.15) + math.log(0.75) + math.log(0.75) + math.log(1 - 1e-15)) / 5)
+    # bin [0, 0.5): mean score 0.15, 1 positive of 3; bin [0.5, 1]: mean score 0.875, 2 of 2
+    np.testing.assert_allclose(metrics["reliability_curve"][0], [[0.15, 1 / 3, 3], [0.875, 1.0, 2]])
+    assert metrics["expected_calibration_error"][0] == pytest.approx((3 * (1 / 3 - 0.15) + 2 * 0.125) / 5)
+    assert metrics["max_calibration_error"][0] == pytest.approx(1 / 3 - 0.15)
+
+
+def test_empty_bins_are_left_out_of_the_curve():
+    metrics = calibration_metrics(summarize_calibration([0, 1], [0.05, 0.95]))
+    assert [count for _, _, count in metrics["reliability_curve"][0]] == [1, 1]
+    assert metrics["max_calibration_error"][0] == pytest.approx(0.05)
+
+
+def test_merged_summaries_equal_the_concatenated_data():
+    rng = np.random.default_rng(0)
+    y_true, y_score = rng.integers(0, 2, 200), rng.random(200)
+    merged = merge_calibration_summaries(summarize_calibration(y_true[:70], y_score[:70]),
+                                         summarize_calibration(y_true[70:], y_score[70:]))
+    whole = calibration_metrics(summarize_calibration(y_true, y_score))
+    for name, (value, _) in calibration_metrics(merged).items():
+        np.testing.assert_allclose(value, whole[name][0])
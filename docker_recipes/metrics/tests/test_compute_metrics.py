@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import compute_metrics
+import gt_store
+
+
+def compiled(tmp_path, n=50):
+    gt_path = tmp_path / "gt.csv"
+    rng = np.random.default_rng(0)
+    pd.DataFrame({"image": [f"img_{i}" for i in range(n)],
+                  "label": rng.integers(0, 2, n)}).to_csv(gt_path, index=False)
+    gt_df = compute_metrics.read_goldstandard(gt_path)
+    gt_store.compile_store(gt_df, gt_path)
+    return gt_path
+
+
+def predictions(images, seed=1):
+    rng = np.random.default_rng(seed)
+    scores = rng.random(len(images))
+    return pd.DataFrame({"image": images, "predicted_probability": scores,
+                         "predicted_label": (scores > 0.5).astype(int)})
+
+
+def test_store_and_csv_read_the_same_goldstandard(tmp_path):
+    gt_path = compiled(tmp_path)
+    csv_df = gt_store.normalise(pd.read_csv(gt_path))
+    pd.testing.assert_frame_equal(compute_metrics.read_goldstandard(gt_path), csv_df)
+
+
+@pytest.mark.parametrize("subset", [False, True])
+def test_join_on_store_equals_merge(tmp_path, subset):
+    gt_path = compiled(tmp_path)
+    gt_df = compute_metrics.read_goldstandard(gt_path)
+    store = gt_store.open_store(gt_path)
+    images = list(gt_df["image"][::-1]) + (["other_challenge_1"] if subset else [])
+    pred_df = predictions(images)
+
+    merged = compute_metrics.align_predictions(pred_df, gt_df, subset=subset)
+    looked_up = compute_metrics.align_predictions(pred_df, gt_df, subset=subset, store=store)
+    pd.testing.assert_frame_equal(looked_up, merged)
+
+
+def test_join_on_store_reports_missing_images(tmp_path, capsys):
+    gt_path = compiled(tmp_path)
+    gt_df = compute_metrics.read_goldstandard(gt_path)
+    with pytest.raises(SystemExit):
+        compute_metrics.align_predictions(predictions(list(gt_df["image"][1:])), gt_df,
+                                          store=gt_store.open_store(gt_path))
+    assert "1 image id(s) present in GT but missing" in capsys.readouterr().out
+
+
+def test_main_opens_each_goldstandard_store_once(tmp_path, monkeypatch):
+    gt_path = compiled(tmp_path)
+    pred_path = tmp_path / "predictions.csv"
+    predictions(list(compute_metrics.read_goldstandard(gt_path)["image"])).to_csv(pred_path, index=False)
+
+    opened = []
+    open_store = gt_store.open_store
+    monkeypatch.setattr(gt_store, "open_store", lambda path: opened.append(path) or open_store(path))
+    cfg = compute_metrics.parse_arguments().parse_args([
+        "-i", str(pred_path), "-g", str(tmp_path), "-c", "A", "B", "-p", "tool", "-com", "com", "-e", "ev",
+        "-o", str(tmp_path / "assessment.json"), "--metrics", "accuracy"])
+    assessments = compute_metrics.main(cfg)
+    assert opened == [gt_path]
+    assert [a["challenge_id"] for a in assessments] == ["A", "B"]
+
+
+def scored_table(n=200, seed=2):
+    rng = np.random.default_rng(seed)
+    scores = rng.random(n) * 0.6  # the top bins stay empty
+    return pd.DataFrame({"image": [f"img_{i}" for i in range(n)], "label": (rng.random(n) < scores).astype(int),
+                         "predicted_probability": scores, "predicted_label": (scores > 0.5).astype(int)})
+
+
+def test_only_the_reliability_curve_is_an_array():
+    df = scored_table()
+    metrics = compute_metrics.compute_classification_metrics(df)
+    assert [name for name, (value, _) in metrics.items() if isinstance(value, (list, dict))] == ["reliability_curve"]
+
+    curve = metrics["reliability_curve"][0]
+    assert len(curve) == 6  # the top bins stay empty
+    in_bin = df[(df["predicted_probability"] >= 0.2) & (df["predicted_probability"] < 0.3)]
+    assert curve[2] == pytest.approx([in_bin["predicted_probability"].mean(), in_bin["label"].mean(), len(in_bin)])
+    assert compute_metrics.compute_classification_metrics(df, requested=["reliability_curve"]) == \
+        {"reliability_curve": metrics["reliability_curve"]}
+
+
+def test_multiclass_confusion_matrix():
+    df = pd.DataFrame({"image": ["a", "b", "c", "d"], "label": ["x", "y", "y", "z"],
+                       "prob_x": [0.8, 0.1, 0.2, 0.1], "prob_y": [0.1, 0.8, 0.1, 0.1],
+                       "prob_z": [0.1, 0.1, 0.7, 0.8]})
+    metrics = compute_metrics.compute_classification_metrics(df)
+    assert metrics["confusion_matrix"] == ({"classes": ["x", "y", "z"],
+                                            "counts": [[1, 0, 0], [0, 1, 1], [0, 0, 1]]}, 0.0)
+    assert not any(name.startswith("confusion_matrix_") for name in metrics)
+
+
+def sketch_cfg(state):
+    from types import SimpleNamespace
+    return SimpleNamespace(sketch_state=str(state), chunksize=7, sketch_bins=None, merge_sketches=[])
+
+
+def sketch_counts(state):
+    return {challenge: int(sk["confusion"].sum()) for challenge, sk in compute_metrics.load_sketches(state).items()}
+
+
+def test_sketch_state_merges_each_input_once(tmp_path):
+    gt_df = compute_metrics.read_goldstandard(compiled(tmp_path, n=40))
+    goldstandards = {"A": gt_df}
+    state = tmp_path / "state.json"
+    first, second = tmp_path / "first.csv", tmp_path / "second.csv"
+    predictions(list(gt_df["image"][:25])).to_csv(first, index=False)
+    predictions(list(gt_df["image"][25:]), seed=3).to_csv(second, index=False)
+
+    compute_metrics.sketch_challenges(first, goldstandards, "p", "c", "e", sketch_cfg(state))
+    assert sketch_counts(state) == {"A": 25}
+    # a retried run with the same input leaves the state as it was
+    retried = compute_metrics.sketch_challenges(first, goldstandards, "p", "c", "e", sketch_cfg(state))
+    assert sketch_counts(state) == {"A": 25}
+    assert retried[0]["metrics"]["value"] is not None
+
+    compute_metrics.sketch_challenges(second, goldstandards, "p", "c", "e", sketch_cfg(state))
+    assert sketch_counts(state) == {"A": 40}
+    assert len(compute_metrics.load_sketch_inputs(state)["A"]) == 2
+
+
+def test_delong_stderr_matches_the_pairwise_formula():
+    rng = np.random.default_rng(4)
+    y = rng.integers(0, 2, 120)
+    s = np.round(rng.random(120) + 0.4 * y, 1)  # rounded: many ties
+    pos, neg = s[y == 1], s[y == 0]
+    psi = (pos[:, None] > neg[None, :]) + 0.5 * (pos[:, None] == neg[None, :])
+    v10, v01 = psi.mean(axis=1), psi.mean(axis=0)
+    expected = np.sqrt(v10.var(ddof=1) / len(pos) + v01.var(ddof=1) / len(neg))
+    assert compute_metrics.roc_auc_stderr(y, s) == pytest.approx(expected)
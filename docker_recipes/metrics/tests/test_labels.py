@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import labels
+
+
+def dense_metrics(ref, pred):
+    ref, pred = ref.ravel(), pred.ravel()
+    out = {}
+    for label in sorted((set(np.unique(ref)) | set(np.unique(pred))) - {labels.BACKGROUND}):
+        r, p = ref == label, pred == label
+        out[label] = (2 * (r & p).sum() / (r.sum() + p.sum()), (r & p).sum() / (r | p).sum())
+    return out
+
+
+@pytest.mark.parametrize("dense_pairs", [labels.DENSE_PAIRS, 1])  # bincount and np.unique paths
+def test_sparse_confusion_matches_per_label_masks(monkeypatch, dense_pairs):
+    monkeypatch.setattr(labels, "DENSE_PAIRS", dense_pairs)
+    rng = np.random.default_rng(0)
+    ref = rng.integers(0, 150, (20, 20, 20))
+    pred = np.where(rng.random(ref.shape) < 0.8, ref, rng.integers(0, 160, ref.shape))
+
+    metrics = labels.per_label_metrics(labels.label_confusion(ref, pred))
+    expected = dense_metrics(ref, pred)
+    assert metrics["label"].tolist() == list(expected)
+    assert metrics["dice"] == pytest.approx([d for d, _ in expected.values()])
+    assert metrics["jaccard"] == pytest.approx([j for _, j in expected.values()])
+
+
+def test_labels_far_apart():
+    ref = np.array([0, 5, 5, 2**40])
+    pred = np.array([0, 5, 2**40, 2**40])
+    metrics = labels.per_label_metrics(labels.label_confusion(ref, pred))
+    assert metrics["label"].tolist() == [5, 2**40]
+    assert metrics["dice"].tolist() == pytest.approx([2 / 3, 2 / 3])
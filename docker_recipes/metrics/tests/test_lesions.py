@@ -0,0 +1,72 @@
+import tarfile
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import lesions
+
+
+def test_mutual_best_iou_matching():
+    ref = np.zeros((20, 20), dtype=np.uint8)
+    pred = np.zeros_like(ref)
+    ref[1:5, 1:5] = 1      # detected: same square
+    pred[1:5, 1:5] = 1
+    ref[10:14, 10:14] = 1  # missed: barely touched (IoU 1/31 < MATCH_IOU)
+    pred[13:15, 13:15] = 1
+    pred[17:19, 1:3] = 1   # false positive
+
+    stats = lesions.lesion_stats(ref, pred)
+    assert (stats["reference"], stats["predicted"], stats["matched"]) == (2, 3, 1)
+    assert stats["dice"].tolist() == [1.0]
+
+    metrics = lesions.lesion_metrics([stats])
+    assert metrics["lesion_sensitivity"][0] == pytest.approx(1 / 2)
+    assert metrics["lesion_precision"][0] == pytest.approx(1 / 3)
+    assert metrics["lesion_f1"][0] == pytest.approx(2 / (2 + 2 + 1))
+    # one matched Dice of 1, and 0 for the missed and the two false-positive lesions
+    assert metrics["lesion_dice"][0] == pytest.approx(1 / 4)
+
+
+def test_one_predicted_lesion_matches_one_reference_lesion():
+    ref = np.zeros((10, 10), dtype=np.uint8)
+    ref[1:4, 1:4] = 1
+    ref[1:4, 5:8] = 1
+    pred = np.zeros_like(ref)
+    pred[1:4, 1:8] = 1  # covers both reference lesions
+    stats = lesions.lesion_stats(ref, pred)
+    assert stats["matched"] == 1
+
+
+def write_mask(path, data):
+    import nibabel
+    nibabel.save(nibabel.Nifti1Image(data.astype(np.uint8), np.eye(4)), str(path))
+
+
+def test_submission_of_two_segmentation_challenges(tmp_path):
+    import compute_metrics
+
+    rng = np.random.default_rng(0)
+    members = []
+    for challenge, cases in (("SEG_A", ("a1", "a2")), ("SEG_B", ("b1",))):
+        (tmp_path / "gt" / challenge).mkdir(parents=True)
+        for case in cases:
+            mask = (rng.random((8, 8, 4)) > 0.7)
+            write_mask(tmp_path / "gt" / challenge / f"gt_{case}.nii.gz", mask)
+            write_mask(tmp_path / f"brain_{case}.nii.gz", mask)
+            members.append(f"brain_{case}.nii.gz")
+    submission = tmp_path / "masks.nii.gz.tar"
+    with tarfile.open(submission, "w") as tar:
+        for name in members:
+            tar.add(tmp_path / name, arcname=name)
+
+    mask_dirs = {challenge: str(tmp_path / "gt" / challenge) for challenge in ("SEG_A", "SEG_B")}
+    cfg = SimpleNamespace(workers=1)
+    assessments = compute_metrics.score_segmentations(submission, mask_dirs, "tool", "C", "E", cfg)
+    dice = {a["challenge_id"]: a["metrics"]["value"] for a in assessments
+            if a["metrics"]["metric_id"] == "lesion_dice"}
+    assert dice == {"SEG_A": 1.0, "SEG_B": 1.0}
+
+    with pytest.raises(ValueError, match="no reference mask"):
+        lesions.score_cases(submission, {"a1": mask_dirs["SEG_A"] + "/gt_a1.nii.gz"}, workers=1,
+                            other_cases={"a2"})
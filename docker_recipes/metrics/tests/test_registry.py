@@ -0,0 +1,27 @@
+import compute_metrics  # registers the built-in metrics
+import registry
+
+
+def test_only_the_intermediates_of_the_requested_metrics_are_computed(monkeypatch):
+    computed = []
+    for name, step in list(registry.INTERMEDIATES.items()):
+        def traced(*args, name=name, compute=step.compute):
+            computed.append(name)
+            return compute(*args)
+        monkeypatch.setitem(registry.INTERMEDIATES, name, step._replace(compute=traced))
+
+    import pandas as pd
+    table = pd.DataFrame({"label": [0, 1, 1, 0], "predicted_probability": [0.1, 0.8, 0.6, 0.7],
+                          "predicted_label": [0, 1, 1, 1]})
+    metrics = registry.compute(table, ["sensitivity", "precision"])
+    assert set(metrics) == {"sensitivity", "precision"}
+    assert "calibration" not in computed and "roc_curve" not in computed
+    assert len(computed) == len(set(computed))  # each intermediate once
+
+
+def test_metrics_are_requested_by_their_exact_name():
+    assert registry.resolve(["accuracy"]) == ["accuracy"]
+    assert registry.resolve(["auc"]) == []
+    # a family requests its variants, and only those
+    assert registry.select({"f1_score_macro": 1, "f1_score_a": 1, "roc_auc": 1, "accuracy": 1}, ["f1_score"]) \
+        == {"f1_score_macro": 1, "f1_score_a": 1}
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import roc_auc_score
+
+import compute_metrics
+import sketch
+
+
+def site(seed, n=400):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 2, n)
+    s = np.clip(rng.normal(0.4 + 0.2 * y, 0.2), 0, 1)
+    return y, s, (s > 0.5).astype(int)
+
+
+@pytest.mark.parametrize("n_bins", [8, 64, sketch.N_BINS])
+def test_auc_error_within_the_bounds(n_bins):
+    y, s, p = site(0)
+    summary = sketch.summarize_scores(y, s, p, n_bins)
+    exact = compute_metrics.compute_binary_metrics(
+        pd.DataFrame({"label": y, "predicted_probability": s, "predicted_label": p}), ["roc_auc", "pr_auc"])
+
+    roc_auc, _, roc_bound = sketch.roc_auc(summary)
+    assert abs(roc_auc - roc_auc_score(y, s)) <= roc_bound
+    pr_auc, pr_bound = sketch.pr_auc(summary)
+    assert abs(pr_auc - exact["pr_auc"][0]) <= pr_bound
+
+
+def test_coarser_bins_give_wider_bounds():
+    y, s, p = site(1)
+    bounds = [sketch.roc_auc(sketch.summarize_scores(y, s, p, n_bins))[2] for n_bins in (8, 64, 4096)]
+    assert bounds == sorted(bounds, reverse=True)
+
+
+def test_sketches_of_sites_merge_into_the_sketch_of_all_data():
+    sites = [site(seed, n) for seed, n in ((2, 300), (3, 150), (4, 50))]
+    # each site's sketch goes through its JSON state file, as with --merge_sketches
+    sketches = [sketch.sketch_from_json(sketch.sketch_to_json(sketch.summarize_scores(*data, 256)))
+                for data in sites]
+    merged = sketch.merge_sketches(*sketches)
+    whole = sketch.summarize_scores(*(np.concatenate(column) for column in zip(*sites)), 256)
+
+    merged_metrics, merged_bounds = compute_metrics.compute_sketch_metrics(merged)
+    whole_metrics, whole_bounds = compute_metrics.compute_sketch_metrics(whole)
+    assert merged_bounds == pytest.approx(whole_bounds)
+    for name, (value, stderr) in whole_metrics.items():
+        np.testing.assert_allclose(merged_metrics[name][0], value)
+        np.testing.assert_allclose(merged_metrics[name][1], stderr)
+
+
+def test_merging_different_bin_counts_is_refused():
+    y, s, p = site(5, 20)
+    with pytest.raises(ValueError, match="different bin counts"):
+        sketch.merge_sketches(sketch.summarize_scores(y, s, p, 8), sketch.summarize_scores(y, s, p, 16))
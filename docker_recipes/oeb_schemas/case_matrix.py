@@ -0,0 +1,172 @@
+'''
+Participants x cases outcome matrix of a challenge, shared by the metrics and consolidation stages.
+
+With --cases_dir, the metrics stage adds the per-case outcome of each participant
+to <cases_dir>/<challenge>/outcomes/:
+
+    meta.json     format version, number of cases, and the row of each participant
+    cases.npy     case (image) ids, sorted
+    correct.bits  one row per participant: whether each case was predicted right,
+                  bit-packed (np.packbits), ceil(cases / 8) bytes per row
+    scores.f4     one row per participant: the probability given to the ground
+                  truth of each case (little-endian float32)
+
+Rows are only ever added: a participant scored again gets a new row, and
+meta.json, replaced atomically, points to the rows in use. Readers therefore see
+whole rows without locking, and map the files instead of reading them; writers
+add rows under an advisory lock (locking.py).
+
+    matrix = open_matrix(cases_dir, challenge)     # None: no outcomes yet
+    correct = matrix.correct()                     # participants x cases, bool
+    scores = matrix.scores()                       # participants x cases, float32
+'''
+import json
+import os
+
+from locking import locked
+
+MATRIX_DIR = "outcomes"
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+CASES_FILE = "cases.npy"
+CORRECT_FILE = "correct.bits"
+SCORES_FILE = "scores.f4"
+LOCK_FILE = ".lock"
+
+SCORE_DTYPE = "<f4"
+
+
+def matrix_path(cases_dir, challenge):
+    return os.path.join(cases_dir, challenge.replace('.', '_'), MATRIX_DIR)
+
+
+def row_bytes(cases):
+    return (cases + 7) // 8
+
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, META_FILE), mode='r', encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_meta(meta, path):
+    tmp_path = os.path.join(path, f"{META_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, mode='w', encoding="utf-8") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, os.path.join(path, META_FILE))
+
+
+def write_outcomes(path, participant_id, images, correct, scores):
+    '''
+    Add (or replace) the row of a participant in the outcome matrix in directory path.
+    Input:
+    images: case ids; the first participant fixes the cases of the matrix, the others must have the same
+    correct: whether each case was predicted right
+    scores: probability given to the ground truth of each case
+    Returns:
+    the row written
+    '''
+    import numpy as np
+
+    images = np.asarray(images, dtype=str)
+    order = np.argsort(images, kind="mergesort")
+    images = images[order]
+    correct = np.asarray(correct, dtype=bool)[order]
+    scores = np.asarray(scores, dtype=SCORE_DTYPE)[order]
+
+    os.makedirs(path, exist_ok=True)
+    with locked(os.path.join(path, LOCK_FILE)):
+        meta = read_meta(path)
+        if meta is None:
+            tmp_path = os.path.join(path, f"{CASES_FILE}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, images)
+            os.replace(tmp_path, os.path.join(path, CASES_FILE))
+            meta = {"version": FORMAT_VERSION, "cases": len(images), "rows": 0, "participants": {}}
+            for name in (CORRECT_FILE, SCORES_FILE):
+                open(os.path.join(path, name), mode='wb').close()
+        else:
+            if meta.get("version") != FORMAT_VERSION:
+                raise ValueError(f"{path}: outcome matrix format {meta.get('version')}, expected {FORMAT_VERSION}")
+            cases = np.load(os.path.join(path, CASES_FILE))
+            if len(cases) != len(images) or not np.array_equal(cases, images):
+                raise ValueError(f"{participant_id}: the cases differ from those of the outcome matrix in {path} "
+                                 f"(has the gold standard changed?)")
+
+        # at the offset of the new row: what a failed write may have left after the last row is overwritten
+        row = meta["rows"]
+        for name, data, size in ((CORRECT_FILE, np.packbits(correct), row_bytes(len(images))),
+                                 (SCORES_FILE, scores, 4 * len(images))):
+            with open(os.path.join(path, name), mode='r+b') as f:
+                f.seek(row * size)
+                f.write(data.tobytes())
+        meta["rows"] = row + 1
+        meta["participants"][participant_id] = row
+        write_meta(meta, path)
+    return row
+
+
+class CaseMatrix:
+    '''
+    Read-only, memory-mapped view of the outcome matrix of a challenge, participants in the order they were added.
+    '''
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.meta = read_meta(path)
+        if self.meta is None:
+            raise FileNotFoundError(os.path.join(path, META_FILE))
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path}: outcome matrix format {self.meta.get('version')}, expected {FORMAT_VERSION}")
+        self.path = path
+        self.cases = np.load(os.path.join(path, CASES_FILE), mmap_mode='r')
+        self.participants = list(self.meta["participants"])
+        self.rows = np.array(list(self.meta["participants"].values()), dtype=np.int64)
+
+        # rows added after meta.json was read lie beyond these shapes and are not seen
+        n, rows = self.meta["cases"], self.meta["rows"]
+        if rows:
+            self._correct = np.memmap(os.path.join(path, CORRECT_FILE), dtype=np.uint8, mode='r',
+                                      shape=(rows, row_bytes(n)))
+            self._scores = np.memmap(os.path.join(path, SCORES_FILE), dtype=SCORE_DTYPE, mode='r', shape=(rows, n))
+        else:
+            self._correct = np.zeros((0, row_bytes(n)), dtype=np.uint8)
+            self._scores = np.zeros((0, n), dtype=SCORE_DTYPE)
+
+    def __len__(self):
+        return len(self.participants)
+
+    def _in_use(self, matrix):
+        import numpy as np
+
+        # the rows of the participants; the whole map when no participant was replaced
+        if np.array_equal(self.rows, np.arange(len(matrix))):
+            return matrix
+        return matrix[self.rows]
+
+    def correct(self):
+        '''
+        Participants x cases boolean matrix: whether each participant got each case right.
+        '''
+        import numpy as np
+
+        return np.unpackbits(self._in_use(self._correct), axis=1, count=self.meta["cases"]).astype(bool)
+
+    def scores(self):
+        '''
+        Participants x cases matrix of the probability each participant gave to the ground truth.
+        '''
+        return self._in_use(self._scores)
+
+
+def open_matrix(cases_dir, challenge):
+    '''
+    The outcome matrix of a challenge, or None when no participant has been added to it yet.
+    '''
+    path = matrix_path(cases_dir, challenge)
+    if read_meta(path) is None:
+        return None
+    return CaseMatrix(path)
@@ -0,0 +1,235 @@
+'''
+Compiled gold-standard store, shared by the validation and metrics stages.
+
+The gold standard of an event does not change between submissions, so it can be
+read and checked once (validation/compile_goldstandard.py) into a store next to
+it, <dir>/gt.csv -> <dir>/gt.store/:
+
+    meta.json      format version, columns, row count, and the size, mtime and
+                   sha256 of the gt.csv it was compiled from
+    ids.npy        image ids, sorted (fixed-width strings)
+    rows.npy       row of each sorted id in gt.csv
+    col_<column>.npy  every other column (labels, label_<class>, strata), in gt.csv order
+    na_<column>.npy   where a text column is missing (empty cell), for the columns listed
+                   under "missing" in meta.json
+
+The arrays are opened memory-mapped and read-only, so opening a store costs no
+parsing, and ids are looked up by binary search on ids.npy. frame() gives the
+same table as reading the CSV and normalising it (normalise()), missing cells
+included. A store whose gt.csv
+has changed since it was compiled is ignored (the CSV is read instead); when only
+the mtime differs, the content hash decides.
+'''
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+STORE_SUFFIX = ".store"
+FORMAT_VERSION = 2
+META_FILE = "meta.json"
+
+# bytes hashed at a time
+CHUNK_SIZE = 1 << 20
+
+
+def goldstandard_path(goldstandard_dir, challenge):
+    '''
+    Gold standard of a challenge: <dir>/<challenge>/gt.csv if present, otherwise the shared <dir>/gt.csv.
+    '''
+    per_challenge = Path(goldstandard_dir) / challenge / "gt.csv"
+    return per_challenge if per_challenge.is_file() else Path(goldstandard_dir) / "gt.csv"
+
+
+def store_path(gt_path):
+    '''
+    Store directory of a gold-standard CSV: gt.csv -> gt.store.
+    '''
+    root, _ = os.path.splitext(str(gt_path))
+    return root + STORE_SUFFIX
+
+
+def content_hash(path):
+    '''
+    sha256 of a file, read in chunks.
+    '''
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def column_file(column):
+    return f"col_{column}.npy"
+
+
+def missing_file(column):
+    return f"na_{column}.npy"
+
+
+def normalise(gt_df):
+    '''
+    The gold standard as both the store and the CSV give it: image ids as stripped strings.
+    '''
+    return gt_df.assign(image=gt_df["image"].astype(str).str.strip())
+
+
+def compile_store(gt_df, gt_path):
+    '''
+    Write the store of the checked gold standard gt_df, read from gt_path.
+    The store is built in a temporary directory that replaces the old one. Returns its path.
+    '''
+    import numpy as np
+
+    path = store_path(gt_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    ids = gt_df["image"].astype(str).to_numpy().astype(str)
+    rows = np.argsort(ids, kind="mergesort")
+    np.save(os.path.join(tmp_path, "ids.npy"), ids[rows])
+    np.save(os.path.join(tmp_path, "rows.npy"), rows.astype(np.int64))
+
+    columns, missing = [], []
+    for column in gt_df.columns:
+        if column == "image":
+            continue
+        values = gt_df[column].to_numpy()
+        if values.dtype.kind == "O":
+            # text: fixed-width strings, with the missing cells kept apart (not turned into "nan")
+            na = gt_df[column].isna().to_numpy()
+            values = np.where(na, "", gt_df[column].astype(str).to_numpy()).astype(str)
+            if na.any():
+                np.save(os.path.join(tmp_path, missing_file(column)), na)
+                missing.append(str(column))
+        np.save(os.path.join(tmp_path, column_file(column)), values)
+        columns.append(str(column))
+
+    st = os.stat(gt_path)
+    meta = {
+        "version": FORMAT_VERSION,
+        "rows": int(len(gt_df)),
+        "columns": ["image"] + columns,
+        "missing": missing,
+        "source": {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": content_hash(gt_path)},
+    }
+    with open(os.path.join(tmp_path, META_FILE), mode='w', encoding="utf-8") as f:
+        json.dump(meta, f, indent=4, sort_keys=True)
+
+    # a directory cannot replace another one atomically: move the old store aside first
+    if os.path.isdir(path):
+        old_path = f"{path}.{os.getpid()}.old"
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(tmp_path, path)
+    return path
+
+
+def is_fresh(meta, gt_path):
+    '''
+    Whether a store's metadata still describes gt_path.
+    '''
+    source = meta.get("source", {})
+    st = os.stat(gt_path)
+    if st.st_size != source.get("size"):
+        return False
+    if st.st_mtime_ns == source.get("mtime_ns"):
+        return True
+    # touched or copied: compare the contents
+    return content_hash(gt_path) == source.get("sha256")
+
+
+class GoldStandardStore:
+    '''
+    Read-only, memory-mapped view of a compiled gold standard.
+
+        store = open_store(gt_path)          # None: no usable store, read the CSV
+        gt_df = store.frame()
+        rows = store.lookup(["image_1", "image_7"])
+    '''
+
+    def __init__(self, path):
+        import numpy as np
+
+        with open(os.path.join(path, META_FILE), mode='r', encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path}: store format {self.meta.get('version')}, expected {FORMAT_VERSION}")
+        self.path = path
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode='r')
+        self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode='r')
+        self.columns = {column: np.load(os.path.join(path, column_file(column)), mmap_mode='r')
+                        for column in self.meta["columns"][1:]}
+        self.missing = {column: np.load(os.path.join(path, missing_file(column)), mmap_mode='r')
+                        for column in self.meta["missing"]}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    @property
+    def sha256(self):
+        return self.meta["source"]["sha256"]
+
+    def lookup(self, images):
+        '''
+        Row in gt.csv of each image id (binary search), -1 for ids not in the gold standard.
+        '''
+        import numpy as np
+
+        images = np.asarray(images, dtype=str)
+        if not len(self.ids):
+            return np.full(len(images), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, images), len(self.ids) - 1)
+        return np.where(self.ids[pos] == images, self.rows[pos], -1)
+
+    def unmatched(self, rows):
+        '''
+        Image ids whose row is not in rows (as returned by lookup()), sorted.
+        '''
+        import numpy as np
+
+        rows = np.asarray(rows)
+        hit = np.zeros(len(self.ids), dtype=bool)
+        hit[rows[rows >= 0]] = True
+        return self.ids[~hit[self.rows]]
+
+    def frame(self):
+        '''
+        The gold standard as a DataFrame, in gt.csv order.
+        '''
+        import numpy as np
+        import pandas as pd
+
+        ids = np.empty(len(self.ids), dtype=self.ids.dtype)
+        ids[self.rows] = self.ids
+        data = {"image": ids.astype(object)}
+        for column, values in self.columns.items():
+            if values.dtype.kind == "U":
+                values = values.astype(object)
+                if column in self.missing:
+                    values[self.missing[column]] = np.nan
+                data[column] = values
+            else:
+                data[column] = np.array(values)
+        return pd.DataFrame(data, columns=self.meta["columns"])
+
+
+def open_store(gt_path):
+    '''
+    The store compiled from gt_path, or None when there is none or it is out of date.
+    '''
+    path = store_path(gt_path)
+    if not os.path.isfile(os.path.join(path, META_FILE)):
+        return None
+    try:
+        store = GoldStandardStore(path)
+    except (OSError, ValueError):
+        return None
+    if not is_fresh(store.meta, gt_path):
+        return None
+    return store
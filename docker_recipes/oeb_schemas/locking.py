@@ -0,0 +1,28 @@
+'''
+Advisory file locks, shared by the stages that write to directories of concurrent runs
+(the consolidation's shared outdir, see consolidation/storage.py, and the per-case
+outcome matrices of the metrics stage, see case_matrix.py).
+
+flock is advisory and per host; where it is missing (e.g. on Windows) the block runs unlocked.
+'''
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks
+    fcntl = None
+
+
+@contextlib.contextmanager
+def locked(lock_path):
+    '''
+    Hold the exclusive advisory lock of lock_path (created if missing) for the duration of the block.
+    '''
+    with open(lock_path, mode='a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
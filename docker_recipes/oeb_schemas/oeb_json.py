@@ -0,0 +1,287 @@
+'''
+JSON reading and writing shared by all stages.
+
+* Backend: orjson when it is installed, the json module otherwise.
+* Format: "pretty" (default) writes the indented (4 spaces), key-sorted layout
+  the stages always wrote; "compact" drops all whitespace. The format is
+  chosen with the EUCANIMAGE_JSON environment variable or per call. With
+  orjson, the pretty layout is its 2-space indentation, doubled.
+* NaN and infinities are written as NaN / Infinity in both formats, as the
+  json module does. orjson would write them as null, so a document orjson
+  wrote with a null is checked for them and, if it holds any, written with
+  the json module instead. orjson cannot read NaN either: a document it
+  cannot parse is read again with the json module.
+* ArrayWriter writes a JSON list one object at a time, into a temporary file
+  that replaces the target only when the list is complete.
+* iter_objects reads the objects of a JSON list one at a time, so inputs
+  never have to be held in memory all at once.
+* Progressive results: dump_tier (and ArrayWriter's tier) replace a results file
+  atomically and record its tier (1: provisional, 2: final) in <file>.tier;
+  a file is never replaced by results of a lower tier. The tier check and the
+  replacement are done under the lock <file>.tier.lock, so that concurrent
+  provisional and final writers cannot interleave them.
+'''
+import json
+import math
+import os
+import re
+
+from locking import locked
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+FORMAT_VARIABLE = "EUCANIMAGE_JSON"
+FORMATS = ("pretty", "compact")
+
+# bytes read at a time by iter_objects
+CHUNK_SIZE = 1 << 20
+
+# tiers of progressive results, and the suffix of their marker files
+PROVISIONAL_TIER = 1
+FINAL_TIER = 2
+TIER_SUFFIX = ".tier"
+TIER_LOCK_SUFFIX = ".tier.lock"
+
+
+def pretty_default():
+    '''
+    Whether output is pretty-printed unless a call says otherwise (EUCANIMAGE_JSON).
+    '''
+    fmt = os.environ.get(FORMAT_VARIABLE, "pretty").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"{FORMAT_VARIABLE} must be one of {FORMATS}, not '{fmt}'")
+    return fmt == "pretty"
+
+
+def non_finite(obj):
+    '''
+    Whether obj holds a NaN or an infinity (which orjson writes as null).
+    '''
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(non_finite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(non_finite(v) for v in obj)
+    if getattr(obj, "dtype", None) is not None and obj.dtype.kind in "fc":
+        # numpy arrays and scalars
+        import numpy as np
+        return not np.isfinite(obj).all()
+    return False
+
+
+def to_builtin(obj):
+    '''
+    json module default: numpy arrays and scalars as lists and numbers.
+    '''
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj, pretty=None):
+    '''
+    Serialise obj to UTF-8 bytes.
+    '''
+    if pretty is None:
+        pretty = pretty_default()
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if pretty else 0)
+        data = orjson.dumps(obj, option=option)
+        if b"null" not in data or not non_finite(obj):
+            # 2 to 4 spaces per level: every line's indentation doubled
+            return re.sub(rb"\n( +)", rb"\n\1\1", data) if pretty else data
+    if pretty:
+        return json.dumps(obj, indent=4, sort_keys=True, separators=(',', ': '), default=to_builtin).encode("utf-8")
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=to_builtin).encode("utf-8")
+
+
+def dump(obj, path, pretty=None):
+    '''
+    Write obj to the JSON file path.
+    '''
+    with open(path, mode='wb') as f:
+        f.write(dumps(obj, pretty))
+
+
+def replace(data, path):
+    '''
+    Atomically replace the file path with the bytes data.
+    '''
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode='wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_tier(path):
+    '''
+    Tier marker ({"tier", "provisional", "version"}) of a results file, or None if it has none.
+    '''
+    try:
+        return load(path + TIER_SUFFIX)
+    except (OSError, ValueError):
+        return None
+
+
+def superseded(path, tier):
+    '''
+    Whether path already holds results of a higher tier than tier.
+    '''
+    marker = read_tier(path)
+    return marker is not None and marker["tier"] > tier
+
+
+def write_tier(path, tier):
+    '''
+    Record the tier of the results just written to path; the version counts the writes.
+    '''
+    marker = read_tier(path)
+    version = marker["version"] + 1 if marker is not None else 1
+    replace(dumps({"tier": tier, "provisional": tier < FINAL_TIER, "version": version}, pretty=True),
+            path + TIER_SUFFIX)
+
+
+def tier_locked(path):
+    '''
+    Lock held while the tier of path is checked and path replaced.
+    '''
+    return locked(path + TIER_LOCK_SUFFIX)
+
+
+def replace_tier(write, path, tier):
+    '''
+    Under the tier lock of path, call write() to replace path and record its tier,
+    unless path holds results of a higher tier. Returns whether write() was called.
+    '''
+    with tier_locked(path):
+        if superseded(path, tier):
+            return False
+        write()
+        write_tier(path, tier)
+    return True
+
+
+def dump_tier(obj, path, tier=None, pretty=None):
+    '''
+    Write obj to path as results of a tier (None: no marker).
+    The file is replaced atomically, then its marker; results of a lower tier than the
+    ones in path are dropped, so a late provisional run cannot undo a final one.
+    Returns whether path was written.
+    '''
+    data = dumps(obj, pretty)
+    if tier is None:
+        replace(data, path)
+        return True
+    return replace_tier(lambda: replace(data, path), path, tier)
+
+
+def loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN / Infinity, as written by the json module (pretty layout): not JSON for orjson
+            pass
+    return json.loads(data)
+
+
+def load(path):
+    '''
+    Read a whole JSON file.
+    '''
+    with open(path, mode='rb') as f:
+        return loads(f.read())
+
+
+def iter_objects(path, chunk_size=CHUNK_SIZE):
+    '''
+    Yield the elements of the JSON list in path one at a time (a top-level object is yielded as is).
+    Only the element being decoded is kept in memory.
+    '''
+    decoder = json.JSONDecoder()
+    with open(path, mode='r', encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        eof = False
+
+        if not buffer.startswith('['):
+            # not a list: a single object
+            yield loads(buffer + f.read())
+            return
+        buffer = buffer[1:]
+
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                obj, end = decoder.raw_decode(buffer)
+                # a value that ends with the buffer may continue in the next chunk
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if complete:
+                yield obj
+                buffer = buffer[end:]
+                continue
+
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            if eof and not buffer.strip():
+                raise ValueError(f"{path}: unterminated JSON list")
+
+
+class ArrayWriter:
+    '''
+    Write a JSON list element by element; the output is identical to dump() of the whole list.
+    With a tier, the finished list replaces path like dump_tier (unless path holds a higher tier).
+
+        with ArrayWriter(path) as out:
+            for obj in objects:
+                out.write(obj)
+    '''
+
+    def __init__(self, path, pretty=None, tier=None):
+        self.path = path
+        self.pretty = pretty_default() if pretty is None else pretty
+        self.tier = tier
+        self.count = 0
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.tmp_path, mode='wb')
+        self.f.write(b"[")
+        return self
+
+    def write(self, obj):
+        data = dumps(obj, self.pretty)
+        if self.pretty:
+            # the list's own indentation level
+            data = b"\n" + b"\n".join(b"    " + line for line in data.split(b"\n"))
+        self.f.write((b"," if self.count else b"") + data)
+        self.count += 1
+
+    def extend(self, objects):
+        for obj in objects:
+            self.write(obj)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.f.write(b"\n]" if self.pretty and self.count else b"]")
+        self.f.close()
+        if exc_type is not None:
+            os.remove(self.tmp_path)
+        elif self.tier is None:
+            os.replace(self.tmp_path, self.path)
+        elif not replace_tier(lambda: os.replace(self.tmp_path, self.path), self.path, self.tier):
+            os.remove(self.tmp_path)
+        return False
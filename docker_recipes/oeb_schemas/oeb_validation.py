@@ -0,0 +1,150 @@
+'''
+JSON-schema checks of the OEB objects written by the benchmarking stages.
+
+The schemas in schemas/<type>.json cover the participant, assessment and
+aggregation datasets and the Manifest entries. Each schema is compiled once
+per process into a cached validator; whole object lists are validated in one
+call, large ones on a thread pool, and objects updated in place can be
+re-checked on the changed fields only.
+
+Usage:
+    errors = validate_objects(objects)                       # full check, list of messages
+    errors = validate_fields(aggregation_object, ["datalink.inline_data.challenge_participants"])
+    check_oeb_objects(objects)                               # raises ValueError, as the stages use it
+'''
+import functools
+import importlib.util
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "schemas")
+
+# lists longer than this are validated on a thread pool
+PARALLEL_THRESHOLD = 1000
+
+# messages reported per object list
+MAX_ERRORS = 20
+
+
+def object_type(obj):
+    '''
+    Schema name of an OEB object: its "type", or "manifest" for Manifest entries.
+    '''
+    if "type" in obj:
+        return obj["type"]
+    if "participants" in obj and "id" in obj:
+        return "manifest"
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def load_schema(name):
+    with open(os.path.join(SCHEMA_DIR, name + ".json"), mode='r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def validator(name, path=""):
+    '''
+    Compiled validator of a schema, or of the sub-schema at a dotted property path.
+    '''
+    from jsonschema.validators import validator_for
+
+    schema = load_schema(name)
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    for key in filter(None, path.split(".")):
+        schema = schema.get("properties", {}).get(key, {})
+    return cls(schema)
+
+
+def object_errors(obj, index=None):
+    '''
+    Error messages of one object.
+    '''
+    name = object_type(obj) if isinstance(obj, dict) else None
+    where = f"object {index}" if index is not None else "object"
+    if isinstance(obj, dict) and "_id" in obj:
+        where += f" ({obj['_id']})"
+    if name is None or not os.path.exists(os.path.join(SCHEMA_DIR, str(name) + ".json")):
+        return [f"{where}: unknown OEB object type {name!r}"]
+
+    return [f"{where}: {'/'.join(str(p) for p in e.absolute_path) or '<root>'}: {e.message}"
+            for e in validator(name).iter_errors(obj)]
+
+
+def _chunk_errors(objects, offset):
+    errors = []
+    for i, obj in enumerate(objects, offset):
+        errors.extend(object_errors(obj, i))
+    return errors
+
+
+def validate_objects(objects, workers=None, parallel_threshold=PARALLEL_THRESHOLD):
+    '''
+    Validate a list of OEB objects against their schemas.
+    Input:
+    objects: list of participant, assessment, aggregation and Manifest objects
+    workers: threads used for lists longer than parallel_threshold (default: number of CPUs)
+    Returns:
+    list of error messages (at most MAX_ERRORS), empty if all objects are valid
+    '''
+    objects = list(objects)
+    if len(objects) <= parallel_threshold:
+        errors = _chunk_errors(objects, 0)
+    else:
+        workers = workers or os.cpu_count() or 1
+        size = -(-len(objects) // (workers * 4))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunks = pool.map(_chunk_errors,
+                              [objects[i:i + size] for i in range(0, len(objects), size)],
+                              range(0, len(objects), size))
+            errors = [e for chunk in chunks for e in chunk]
+    return errors[:MAX_ERRORS]
+
+
+def validate_fields(obj, paths):
+    '''
+    Fast path for objects updated in place: validate only the given dotted property paths.
+    Input:
+    obj: OEB object that was valid before the update
+    paths: changed fields, e.g. ["datalink.inline_data.challenge_participants"]
+    Returns:
+    list of error messages, empty if the changed fields are valid
+    '''
+    name = object_type(obj)
+    errors = []
+    for path in paths:
+        value = obj
+        for key in path.split("."):
+            if not isinstance(value, dict) or key not in value:
+                errors.append(f"{obj.get('_id', name)}: {path}: missing")
+                break
+            value = value[key]
+        else:
+            errors.extend(f"{obj.get('_id', name)}: {path}: {e.message}"
+                          for e in validator(name, path).iter_errors(value))
+    return errors
+
+
+def check_oeb_objects(objects, fields=None):
+    '''
+    Check OEB json objects against the schemas of oeb_schemas/
+    Input:
+    objects: list of OEB objects
+    fields: optional dotted paths; if given, only these fields are checked (objects updated in place)
+    Returns:
+    None; raises ValueError if an object is invalid. Skipped with a warning if jsonschema is not installed.
+    '''
+    if importlib.util.find_spec("jsonschema") is None:
+        logging.warning("OEB schema checks skipped (jsonschema not available)")
+        return
+
+    if fields:
+        errors = [e for obj in objects for e in validate_fields(obj, fields)]
+    else:
+        errors = validate_objects(objects)
+    if errors:
+        raise ValueError("Invalid OEB object(s):\n" + "\n".join(errors))
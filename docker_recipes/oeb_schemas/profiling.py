@@ -0,0 +1,107 @@
+'''
+Opt-in profiling of the stage scripts (--profile).
+
+validation.py, compute_metrics.py, aggregation.py and merge_data_model_files.py
+run their main() through run(). Without --profile it is a plain call: nothing
+is imported, started or written. With it the stage runs under cProfile and
+tracemalloc, and three files are written next to its output:
+
+    <prefix>.pstats       raw profile, for pstats / snakeviz
+    <prefix>.hot.txt      wall time, peak traced memory and the top functions,
+                          by cumulative and by own time
+    <prefix>.alloc.tsv    top allocation sites still alive at the end of the
+                          stage: file, line, bytes, blocks
+
+<prefix> is the output file without its extension, or <outdir>/<stage>.profile
+for stages writing a directory. The files are also written when the stage
+fails, including through sys.exit().
+'''
+import os
+
+# entries of the hot-function table and of the allocation sites (--profile_top)
+TOP = 30
+
+# frames kept per allocation by tracemalloc: 1 is enough for file:line sites
+ALLOC_FRAMES = 1
+
+
+def add_arguments(parser):
+    '''
+    Add --profile and --profile_top to a stage's argument parser.
+    '''
+    parser.add_argument("--profile", action="store_true",
+                        help="Run under cProfile and tracemalloc and write <output>.pstats, .hot.txt "
+                             "and .alloc.tsv next to the output (see profiling.py).")
+    parser.add_argument("--profile_top", type=int, default=TOP,
+                        help=f"Profile mode: functions and allocation sites reported (default: {TOP}).")
+    return parser
+
+
+def profile_prefix(output, stage):
+    '''
+    Path prefix of the profile files of a stage writing output (a file or a directory).
+    '''
+    output = str(output)
+    if os.path.isdir(output) or not os.path.splitext(output)[1]:
+        return os.path.join(output, f"{stage}.profile")
+    return os.path.splitext(output)[0]
+
+
+def run(main, options, output, stage):
+    '''
+    Run main(options), profiled if options.profile; returns what main returns.
+    '''
+    if not getattr(options, "profile", False):
+        return main(options)
+
+    import cProfile
+    import time
+    import tracemalloc
+
+    tracemalloc.start(ALLOC_FRAMES)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(main, options)
+    finally:
+        elapsed = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        write_profile(profiler, snapshot, peak, elapsed, profile_prefix(output, stage), stage,
+                      getattr(options, "profile_top", TOP))
+
+
+def write_profile(profiler, snapshot, peak, elapsed, prefix, stage, top=TOP):
+    '''
+    Write the pstats file, the hot-function table and the allocation sites of a profiled run.
+    '''
+    import io
+    import pstats
+    import tracemalloc
+
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(prefix + ".pstats")
+
+    report = io.StringIO()
+    report.write(f"stage {stage}: wall time {elapsed:.3f}s, peak traced memory {peak / 2**20:.1f} MiB\n\n")
+    for order, title in (("cumulative", "cumulative time"), ("tottime", "own time")):
+        report.write(f"Top {top} functions by {title}\n")
+        pstats.Stats(profiler, stream=report).strip_dirs().sort_stats(order).print_stats(top)
+    with open(prefix + ".hot.txt", "w") as f:
+        f.write(report.getvalue())
+
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    with open(prefix + ".alloc.tsv", "w") as f:
+        f.write("file\tline\tbytes\tblocks\n")
+        for stat in snapshot.statistics("lineno")[:top]:
+            frame = stat.traceback[0]
+            f.write(f"{frame.filename}\t{frame.lineno}\t{stat.size}\t{stat.count}\n")
+    print(f"INFO: profile of {stage} written to {prefix}.pstats, .hot.txt and .alloc.tsv")
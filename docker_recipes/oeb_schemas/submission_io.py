@@ -0,0 +1,305 @@
+'''
+Streaming reader of submissions, shared by the validation and metrics stages.
+
+A submission (-i) may be a plain file or come in containers, detected from their
+first bytes rather than from the file name:
+
+    gzip, zstd     a compressed file (zstd needs the zstandard package)
+    tar            an archive, itself possibly gzip- or zstd-compressed
+                   (.tar.gz, .tgz, .nii.gz.tar, .tar.zst), whose members may
+                   be compressed too (e.g. .nii.gz or .csv.gz members)
+
+Archives are read as a stream, member after member, without extracting them to
+disk or seeking back: each byte of the submission is read once, and at most one
+member (one CSV chunk, or one NIfTI volume) is held in memory at a time.
+
+    for member in iter_members(path):            # name, kind ("csv", "nifti", "other"), stream
+        ...
+    pred_df = read_predictions(path)             # the one predictions CSV
+    for chunk in iter_predictions(path, chunksize=100_000):
+        ...
+    for name, image in iter_volumes(path):       # nibabel images, one at a time
+        ...
+
+The masks of segmentation challenges follow the naming of the README: reference
+masks gt_<case>.nii[.gz] in the gold-standard directory, predicted masks
+brain_<case>.nii[.gz] in the submission (see reference_mask_dir and case_id).
+
+A member's stream must be consumed before moving to the next member.
+'''
+import io
+import os
+import struct
+import tarfile
+from collections import namedtuple
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# suffixes of compressed members, stripped before looking at the file type
+COMPRESSED_SUFFIXES = (".gz", ".zst", ".zstd")
+
+CSV = "csv"
+NIFTI = "nifti"
+OTHER = "other"
+
+# segmentation challenges: reference masks gt_<case>.nii[.gz], predicted masks brain_<case>.nii[.gz]
+GT_MASK_PREFIX = "gt_"
+PRED_MASK_PREFIX = "brain_"
+
+# wide multi-class / multi-label schema: predictions prob_<class>, multi-label ground truth label_<class>
+PROB_PREFIX = "prob_"
+LABEL_PREFIX = "label_"
+
+# bytes of the decompressed stream buffered at a time
+BUFFER_SIZE = 1 << 20
+
+# sizeof_hdr of the NIfTI-1 and NIfTI-2 headers, their first field
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+
+Member = namedtuple("Member", ["name", "kind", "stream"])
+
+
+class SubmissionError(ValueError):
+    '''
+    A submission does not hold what it should (e.g. no or several predictions CSVs).
+    '''
+
+
+class _Prefixed(io.RawIOBase):
+    '''
+    Raw stream replaying the bytes already read from a stream (to detect its type) before the rest of it.
+    '''
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.head:
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.stream.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def read_exactly(stream, size):
+    '''
+    Up to size bytes of stream (fewer only at its end); decompressors may return short reads.
+    '''
+    chunks, missing = [], size
+    while missing > 0:
+        data = stream.read(missing)
+        if not data:
+            break
+        chunks.append(data)
+        missing -= len(data)
+    return b"".join(chunks)
+
+
+def rewound(head, stream):
+    return io.BufferedReader(_Prefixed(head, stream), buffer_size=BUFFER_SIZE)
+
+
+def zstd_reader(stream):
+    try:
+        import zstandard
+    except ImportError:
+        raise SubmissionError("zstd-compressed submissions need the zstandard package")
+    decompressor = zstandard.ZstdDecompressor()
+    try:
+        return decompressor.stream_reader(stream, read_across_frames=True)
+    except TypeError:  # zstandard < 0.15 reads across frames anyway
+        return decompressor.stream_reader(stream)
+
+
+def decompressed(stream):
+    '''
+    Decompressed stream of a gzip- or zstd-compressed stream; other streams are returned as they are.
+    '''
+    head = read_exactly(stream, len(ZSTD_MAGIC))
+    stream = rewound(head, stream)
+    if head.startswith(GZIP_MAGIC):
+        import gzip
+        return io.BufferedReader(gzip.GzipFile(fileobj=stream, mode='rb'), buffer_size=BUFFER_SIZE)
+    if head.startswith(ZSTD_MAGIC):
+        return io.BufferedReader(zstd_reader(stream), buffer_size=BUFFER_SIZE)
+    return stream
+
+
+def is_tar(head):
+    '''
+    Whether head, the first block of a stream, is a tar header (its checksum is checked).
+    '''
+    if len(head) < tarfile.BLOCKSIZE:
+        return False
+    try:
+        tarfile.TarInfo.frombuf(head[:tarfile.BLOCKSIZE], tarfile.ENCODING, "surrogateescape")
+    except tarfile.HeaderError:
+        return False
+    return True
+
+
+def strip_compression(name):
+    root, ext = os.path.splitext(name)
+    return root if ext.lower() in COMPRESSED_SUFFIXES else name
+
+
+def member_kind(name):
+    name = strip_compression(name).lower()
+    if name.endswith(".csv"):
+        return CSV
+    if name.endswith(".nii"):
+        return NIFTI
+    return OTHER
+
+
+def iter_members(path):
+    '''
+    Yield the members of a submission, in the order they are stored, as Member(name, kind, stream).
+    A file that is not an archive is its only member; it is taken for a CSV unless named *.nii[.gz].
+    '''
+    with open(path, mode='rb') as f:
+        stream = decompressed(f)
+        head = read_exactly(stream, tarfile.BLOCKSIZE)
+        stream = rewound(head, stream)
+
+        if not is_tar(head):
+            name = strip_compression(os.path.basename(str(path)))
+            yield Member(name, NIFTI if member_kind(name) == NIFTI else CSV, stream)
+            return
+
+        # "r|": a stream of members, read in order, never seeking back
+        with tarfile.open(fileobj=stream, mode="r|") as archive:
+            for info in archive:
+                # directories, links, and hidden files (e.g. macOS "._" resource forks)
+                if not info.isfile() or os.path.basename(info.name).startswith("."):
+                    continue
+                yield Member(info.name, member_kind(info.name), decompressed(archive.extractfile(info)))
+
+
+# -----------------------------------------------------------------------------
+# Predictions CSV
+# -----------------------------------------------------------------------------
+
+def iter_predictions(path, chunksize=None, on_volume=None):
+    '''
+    Yield the predictions CSV of a submission as DataFrames: the whole table, or chunks of chunksize rows.
+    A submission must hold exactly one CSV. on_volume(name, header), if given, is called with the
+    header of each NIfTI member met on the way; their voxel data is skipped, not decoded.
+    '''
+    import pandas as pd
+
+    found = None
+    for member in iter_members(path):
+        if member.kind == CSV:
+            if found is not None:
+                raise SubmissionError(f"{path} holds more than one predictions CSV: {found}, {member.name}")
+            found = member.name
+            if chunksize:
+                for chunk in pd.read_csv(member.stream, chunksize=chunksize):
+                    yield chunk
+            else:
+                yield pd.read_csv(member.stream)
+        elif member.kind == NIFTI and on_volume is not None:
+            on_volume(member.name, read_volume_header(member.stream))
+    if found is None:
+        raise SubmissionError(f"{path} holds no predictions CSV")
+
+
+def read_predictions(path, on_volume=None):
+    '''
+    The predictions CSV of a submission as a DataFrame (see iter_predictions).
+    '''
+    tables = list(iter_predictions(path, on_volume=on_volume))
+    return tables[0]
+
+
+# -----------------------------------------------------------------------------
+# NIfTI volumes
+# -----------------------------------------------------------------------------
+
+def nifti_classes(head):
+    '''
+    nibabel (header, image) classes of a NIfTI-1 or NIfTI-2 file, from its first bytes.
+    '''
+    import nibabel
+
+    for order in "<>":
+        size = struct.unpack(order + "i", head[:4])[0] if len(head) >= 4 else None
+        if size == NIFTI1_HEADER_SIZE:
+            return nibabel.Nifti1Header, nibabel.Nifti1Image
+        if size == NIFTI2_HEADER_SIZE:
+            return nibabel.Nifti2Header, nibabel.Nifti2Image
+    raise SubmissionError("not a NIfTI-1 or NIfTI-2 file")
+
+
+def read_volume_header(stream):
+    '''
+    Header (and extensions) of the NIfTI volume in stream, reading only the bytes before its voxels.
+    '''
+    head = read_exactly(stream, 4)
+    header_class, _ = nifti_classes(head)
+    return header_class.from_fileobj(rewound(head, stream))
+
+
+def read_volume(stream):
+    '''
+    The NIfTI volume in stream, as a nibabel image (its voxels are in memory).
+    '''
+    data = stream.read()
+    _, image_class = nifti_classes(data)
+    return image_class.from_bytes(data)
+
+
+def iter_volumes(path):
+    '''
+    Yield (member name, nibabel image) of each NIfTI volume of a submission, one at a time.
+    '''
+    for member in iter_members(path):
+        if member.kind == NIFTI:
+            yield member.name, read_volume(member.stream)
+
+
+# -----------------------------------------------------------------------------
+# Segmentation masks
+# -----------------------------------------------------------------------------
+
+def case_id(name, prefix):
+    '''
+    Case of a mask file or member: gt_<case>.nii.gz -> <case> (prefix "gt_"), folders and suffixes dropped.
+    '''
+    name = strip_compression(os.path.basename(name))
+    if name.lower().endswith(".nii"):
+        name = name[:-len(".nii")]
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+def reference_mask_dir(goldstandard_dir, challenge):
+    '''
+    Directory of the reference masks (gt_<case>.nii[.gz]) of a segmentation challenge: <dir>/<challenge>
+    or the shared <dir>; None for a challenge whose gold standard is a gt.csv.
+    '''
+    for directory in (os.path.join(str(goldstandard_dir), challenge), str(goldstandard_dir)):
+        if os.path.isfile(os.path.join(directory, "gt.csv")):
+            return None
+        if reference_masks(directory):
+            return directory
+    return None
+
+
+def reference_masks(directory):
+    '''
+    Reference masks of a directory, as {case: path}.
+    '''
+    if not os.path.isdir(directory):
+        return {}
+    return {case_id(name, GT_MASK_PREFIX): os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(GT_MASK_PREFIX) and member_kind(name) == NIFTI}
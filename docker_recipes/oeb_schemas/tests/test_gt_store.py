@@ -0,0 +1,38 @@
+import pandas as pd
+
+import gt_store
+
+
+def write_gt(tmp_path):
+    gt_path = tmp_path / "gt.csv"
+    gt_path.write_text("image,label,site\n 7 ,1,A\n3,0,\n12,1,B\n")
+    return gt_path
+
+
+def test_store_frame_equals_normalised_csv(tmp_path):
+    gt_path = write_gt(tmp_path)
+    gt_df = gt_store.normalise(pd.read_csv(gt_path))
+    gt_store.compile_store(gt_df, gt_path)
+
+    store = gt_store.open_store(gt_path)
+    frame = store.frame()
+    pd.testing.assert_frame_equal(frame, gt_df)
+    # a missing cell stays missing, it does not become the string "nan"
+    assert frame["site"].isna().tolist() == [False, True, False]
+
+
+def test_lookup_and_unmatched(tmp_path):
+    gt_path = write_gt(tmp_path)
+    gt_store.compile_store(gt_store.normalise(pd.read_csv(gt_path)), gt_path)
+    store = gt_store.open_store(gt_path)
+
+    rows = store.lookup(["12", "99", "7"])
+    assert rows.tolist() == [2, -1, 0]
+    assert store.unmatched(rows).tolist() == ["3"]
+
+
+def test_changed_csv_is_read_instead(tmp_path):
+    gt_path = write_gt(tmp_path)
+    gt_store.compile_store(gt_store.normalise(pd.read_csv(gt_path)), gt_path)
+    gt_path.write_text("image,label\n1,0\n")
+    assert gt_store.open_store(gt_path) is None
@@ -0,0 +1,71 @@
+import json
+import math
+import threading
+
+import pytest
+
+import oeb_json
+
+
+def test_dump_tier_refuses_a_lower_tier(tmp_path):
+    path = str(tmp_path / "results.json")
+    assert oeb_json.dump_tier({"v": "final"}, path, oeb_json.FINAL_TIER)
+    assert not oeb_json.dump_tier({"v": "provisional"}, path, oeb_json.PROVISIONAL_TIER)
+    assert oeb_json.load(path) == {"v": "final"}
+    assert oeb_json.read_tier(path)["tier"] == oeb_json.FINAL_TIER
+
+
+def test_array_writer_refuses_a_lower_tier(tmp_path):
+    path = str(tmp_path / "results.json")
+    with oeb_json.ArrayWriter(path, tier=oeb_json.FINAL_TIER) as out:
+        out.extend([1, 2])
+    with oeb_json.ArrayWriter(path, tier=oeb_json.PROVISIONAL_TIER) as out:
+        out.extend([3])
+    assert oeb_json.load(path) == [1, 2]
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_tier_check_and_replace_are_atomic(tmp_path):
+    # a provisional writer holding the tier lock delays the final one, which then wins
+    path = str(tmp_path / "results.json")
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_provisional():
+        def write():
+            entered.set()
+            release.wait(5)
+            oeb_json.replace(oeb_json.dumps("provisional"), path)
+        oeb_json.replace_tier(write, path, oeb_json.PROVISIONAL_TIER)
+
+    thread = threading.Thread(target=slow_provisional)
+    thread.start()
+    entered.wait(5)
+    final = threading.Thread(target=oeb_json.dump_tier, args=("final", path, oeb_json.FINAL_TIER))
+    final.start()
+    final.join(0.2)
+    assert final.is_alive()  # waits for the tier lock
+    release.set()
+    thread.join()
+    final.join()
+    assert oeb_json.load(path) == "final"
+    assert not oeb_json.dump_tier("late", path, oeb_json.PROVISIONAL_TIER)
+
+
+@pytest.mark.parametrize("fmt", oeb_json.FORMATS)
+def test_nan_round_trip(tmp_path, monkeypatch, fmt):
+    path = str(tmp_path / "nan.json")
+    monkeypatch.setenv(oeb_json.FORMAT_VARIABLE, fmt)
+    oeb_json.dump([{"value": float("nan"), "stderr": None, "curve": [float("inf"), 1.0]}], path)
+    for obj in (oeb_json.load(path)[0], next(oeb_json.iter_objects(path))):
+        assert math.isnan(obj["value"])
+        assert obj["stderr"] is None
+        assert obj["curve"] == [float("inf"), 1.0]
+
+
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+def test_pretty_layout_does_not_depend_on_the_backend(monkeypatch, backend):
+    obj = [{"b": [1, {"c": "x"}], "a": {}, "d": []}, "e"]
+    if backend == "json":
+        monkeypatch.setattr(oeb_json, "orjson", None)
+    assert oeb_json.dumps(obj, pretty=True) == \
+        json.dumps(obj, indent=4, sort_keys=True, separators=(',', ': ')).encode("utf-8")
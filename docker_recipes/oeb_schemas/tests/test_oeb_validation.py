@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+import pytest
+
+import oeb_validation
+
+STAGES = {"validation": "validation", "metrics": "compute_metrics", "consolidation": "aggregation"}
+
+
+def test_check_oeb_objects_raises_on_invalid_objects():
+    with pytest.raises(ValueError, match="unknown OEB object type"):
+        oeb_validation.check_oeb_objects([{"_id": "x", "type": "no-such-type"}])
+    oeb_validation.check_oeb_objects([])
+
+
+@pytest.mark.parametrize("stage, module", STAGES.items())
+def test_stages_share_one_check(stage, module):
+    code = (f"import sys; sys.path.insert(0, {stage!r}); import {module}, oeb_validation; "
+            f"print({module}.check_oeb_objects is oeb_validation.check_oeb_objects)")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=oeb_validation.__file__.rsplit("/", 2)[0]).stdout
+    assert out.strip() == "True"
@@ -0,0 +1,57 @@
+import argparse
+import os
+import pstats
+import sys
+import tracemalloc
+
+import pytest
+
+import profiling
+
+
+def options(*args):
+    return profiling.add_arguments(argparse.ArgumentParser()).parse_args(list(args))
+
+
+def stage_main(options):
+    blocks = [bytearray(1024) for _ in range(100)]
+    return len(blocks), tracemalloc.is_tracing()
+
+
+def failing_main(options):
+    sys.exit(2)
+
+
+def profile_files(prefix):
+    return sorted(name for name in os.listdir(os.path.dirname(prefix))
+                  if name.startswith(os.path.basename(prefix) + "."))
+
+
+def test_without_profile_it_is_a_plain_call(tmp_path):
+    output = tmp_path / "assessment.json"
+    assert profiling.run(stage_main, options(), output, "metrics") == (100, False)
+    assert os.listdir(tmp_path) == []
+
+
+def test_profile_writes_the_three_files_next_to_the_output(tmp_path):
+    output = tmp_path / "assessment.json"
+    assert profiling.run(stage_main, options("--profile", "--profile_top", "5"), output, "metrics") == (100, True)
+    assert not tracemalloc.is_tracing()
+
+    prefix = str(tmp_path / "assessment")
+    assert profile_files(prefix) == ["assessment.alloc.tsv", "assessment.hot.txt", "assessment.pstats"]
+    functions = {name for _, _, name in pstats.Stats(prefix + ".pstats").stats}
+    assert "stage_main" in functions
+    with open(prefix + ".hot.txt") as f:
+        assert f.readline().startswith("stage metrics: wall time ")
+    with open(prefix + ".alloc.tsv") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "file\tline\tbytes\tblocks"
+    assert 1 <= len(lines) - 1 <= 5
+
+
+def test_profile_is_written_when_the_stage_exits(tmp_path):
+    with pytest.raises(SystemExit):
+        profiling.run(failing_main, options("--profile"), tmp_path, "consolidation")
+    assert profile_files(str(tmp_path / "consolidation.profile")) == [
+        "consolidation.profile.alloc.tsv", "consolidation.profile.hot.txt", "consolidation.profile.pstats"]
@@ -0,0 +1,51 @@
+import gzip
+import io
+import tarfile
+
+import pandas as pd
+import pytest
+
+import submission_io
+
+CSV = b"image,predicted_probability,predicted_label\nimg_1,0.9,1\nimg_2,0.2,0\n"
+
+
+def add_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.parametrize("name", ["predictions.csv", "predictions.csv.gz", "submission.tar.gz"])
+def test_predictions_are_read_through_their_containers(tmp_path, name):
+    path = tmp_path / name
+    if name.endswith(".tar.gz"):
+        with tarfile.open(path, mode="w:gz") as archive:
+            add_member(archive, "._predictions.csv", b"resource fork")
+            add_member(archive, "sub/predictions.csv.gz", gzip.compress(CSV))
+            add_member(archive, "notes.txt", b"not a table")
+    elif name.endswith(".gz"):
+        path.write_bytes(gzip.compress(CSV))
+    else:
+        path.write_bytes(CSV)
+
+    expected = pd.read_csv(io.BytesIO(CSV))
+    pd.testing.assert_frame_equal(submission_io.read_predictions(path), expected)
+    chunks = list(submission_io.iter_predictions(path, chunksize=1))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+
+def test_zstd_compressed_predictions(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = tmp_path / "predictions.csv.zst"
+    path.write_bytes(zstandard.ZstdCompressor().compress(CSV))
+    assert submission_io.read_predictions(path)["image"].tolist() == ["img_1", "img_2"]
+
+
+def test_archive_with_two_tables_is_refused(tmp_path):
+    path = tmp_path / "submission.tar"
+    with tarfile.open(path, mode="w") as archive:
+        add_member(archive, "a.csv", CSV)
+        add_member(archive, "b.csv", CSV)
+    with pytest.raises(submission_io.SubmissionError, match="more than one predictions CSV"):
+        submission_io.read_predictions(path)
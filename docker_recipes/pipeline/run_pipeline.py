@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Fused validation -> metrics -> consolidation runner for a single participant.
+
+Runs the three stages of main.nf in one process. The validated predictions and
+ground truth, the assessment objects and the aggregation objects are handed
+from stage to stage in memory instead of being re-read from disk, and the
+consolidation no longer needs a second interpreter for the merge step. Every
+artefact of the OEB data model is still written:
+
+    <outdir>/validated_result.json
+    <outdir>/assessment_results.json
+    <outdir>/<challenge>/<challenge>.json, <participant>.json and plots
+    <outdir>/Manifest.json
+    <outdir>/consolidated_result.json
+
+The artefact paths can be overridden individually, as in main.nf.
+"""
+import logging
+import os
+import sys
+from argparse import ArgumentParser, RawTextHelpFormatter
+from pathlib import Path
+
+from stages import add_stage_paths, stage_module
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-i", "--input", required=True,
+                        help="Predictions CSV file.")
+    parser.add_argument("-g", "--goldstandard_file", required=True,
+                        help="Ground-truth directory: <challenge>/gt.csv per challenge or a shared gt.csv.")
+    parser.add_argument("-c", "--challenges_ids", nargs='+', required=True,
+                        help="Challenge id(s), space-separated.")
+    parser.add_argument("-p", "--participant_id", required=True,
+                        help="Tool / model id (participant).")
+    parser.add_argument("-com", "--community_id", required=True,
+                        help="Benchmarking community id (e.g. 'EuCanImage').")
+    parser.add_argument("-e", "--event_id", required=True,
+                        help="Benchmarking event id.")
+    parser.add_argument("-t", "--template", required=True,
+                        help="Path to the aggregation template.")
+    parser.add_argument("-o", "--outdir", required=True,
+                        help="Output directory for the aggregation files, Manifest.json and plots.")
+    parser.add_argument("--cases_dir",
+                        help="Directory of the per-case tables (<challenge>/<participant>.csv); the participant's\n"
+                             "tables are added to it and all participants in it are compared by permutation tests")
+    parser.add_argument("--permutations", type=int, default=10000,
+                        help="Number of permutations per participant pair (default: 10000)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the permutation tests (default: 0)")
+    parser.add_argument("--checkpoint_budget", type=float, default=0.01,
+                        help="Fraction of the permutation tests' run time spent saving progress to resume from (default: 0.01)")
+    parser.add_argument("--chart_format", choices=["svg", "png", "webp"], default="svg",
+                        help="File format of the charts (default: svg)")
+    parser.add_argument("--progressive", action="store_true",
+                        help="Write provisional results (confusion-matrix metrics, no tests or charts) first,\n"
+                             "then the final results, which replace them atomically (see oeb_json.dump_tier)")
+    parser.add_argument("--shared_outdir", action="store_true",
+                        help="The outdir is shared with concurrent runs of other participants: add to its\n"
+                             "aggregation files and Manifest instead of starting from the template (see storage.py)")
+    parser.add_argument("--template_metrics", action="store_true",
+                        help="Compute only the metrics the aggregation template references (see registry.py)")
+    parser.add_argument("--metric_plugins", nargs='+', default=[],
+                        help="Modules (names or .py paths) registering more metrics in registry.py")
+    parser.add_argument("--validation_result",
+                        help="Path of the validated participant JSON (default: <outdir>/validated_result.json)")
+    parser.add_argument("--assessment_results",
+                        help="Path of the assessment JSON (default: <outdir>/assessment_results.json)")
+    parser.add_argument("--consolidated_result",
+                        help="Path of the consolidated JSON (default: <outdir>/consolidated_result.json)")
+    add_stage_paths()
+    import profiling
+    profiling.add_arguments(parser)
+    return parser
+
+
+def write_json(obj, path, tier=None):
+    import oeb_json
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    oeb_json.dump_tier(obj, path, tier)
+
+
+def main(options):
+    validation = stage_module("validation")
+    compute_metrics = stage_module("metrics")
+    aggregation = stage_module("aggregation")
+    compute_metrics.registry.load_plugins(options.metric_plugins)
+    requested = compute_metrics.template_metrics(options.template) if options.template_metrics else None
+
+    outdir = options.outdir
+    validation_result = options.validation_result or os.path.join(outdir, "validated_result.json")
+    assessment_results = options.assessment_results or os.path.join(outdir, "assessment_results.json")
+    consolidated_result = options.consolidated_result or os.path.join(outdir, "consolidated_result.json")
+
+    ########################################################
+    # 1. Validation
+    ########################################################
+    challenges_ids = list(dict.fromkeys(options.challenges_ids))
+    pred_df = validation.load_predictions(Path(options.input))
+    goldstandards = validation.load_goldstandards(options.goldstandard_file, challenges_ids)
+    gt_df = validation.combine_goldstandards(goldstandards.values())
+    validation.check_correspondence(
+        pred_df, gt_df, validation.goldstandard_stores(options.goldstandard_file, challenges_ids))
+    validation.check_schema(pred_df, gt_df)
+
+    validation_json = validation.build_participant_dataset(options)
+    write_json(validation_json, validation_result)
+    logging.info(f"Validation succeeded, written to {validation_result}")
+
+    # progressive runs write the provisional tier first, then the final one over it
+    for tier in ([1, 2] if options.progressive else [None]):
+        ########################################################
+        # 2. Metrics, on the validated tables
+        ########################################################
+        assessments = compute_metrics.score_challenges(
+            pred_df, goldstandards, options.participant_id, options.community_id, options.event_id,
+            options.cases_dir, tier, requested)
+        write_json(assessments, assessment_results, tier)
+        logging.info(f"Metrics written to {assessment_results}" + (f" (tier {tier})" if tier else ""))
+
+        ########################################################
+        # 3. Consolidation: aggregation, Manifest and merge
+        ########################################################
+        os.makedirs(outdir, exist_ok=True)
+        community_id, participant_id, challenges = aggregation.group_assessments(assessments)
+        manifest, aggregations = aggregation.aggregate_challenges(
+            community_id, participant_id, challenges, outdir, options.event_id, options.template,
+            cases_dir=options.cases_dir, permutations=options.permutations, seed=options.seed,
+            checkpoint_budget=options.checkpoint_budget, chart_format=options.chart_format, tier=tier,
+            shared_outdir=options.shared_outdir)
+        if options.shared_outdir:
+            # merged challenge by challenge, with the entries of the other runs
+            import oeb_json
+            manifest = oeb_json.load(os.path.join(outdir, "Manifest.json"))
+        else:
+            write_json(manifest, os.path.join(outdir, "Manifest.json"), tier)
+
+        # same order as merge_data_model_files.main: validation, Manifest, assessments, aggregations
+        consolidated = [validation_json] + manifest + assessments
+        for challenge_id in challenges_ids:
+            consolidated.extend(aggregations.get(challenge_id, []))
+        aggregation.check_oeb_objects(consolidated)
+        write_json(consolidated, consolidated_result, tier)
+        logging.info(f"Consolidated result written to {consolidated_result}" + (f" (tier {tier})" if tier else ""))
+
+    return consolidated
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s:%(message)s', datefmt='%Y-%m-%d %H:%M:%S ')
+    try:
+        options = parse_arguments().parse_args()
+        import profiling
+        profiling.run(main, options, options.outdir, "pipeline")
+    except Exception as e:
+        logging.exception(str(e))
+        sys.exit(1)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Thin client for scoring_service.py.
+
+Takes the same arguments as the stage scripts, sends them to the resident
+service as a job and exits with the job's exit status, so a Nextflow process
+can call e.g.
+
+    python3 /app/scoring_client.py --socket /tmp/eucanimage_scoring/scoring.sock metrics -i predictions.csv ...
+
+instead of `python3 /app/compute_metrics.py -i predictions.csv ...`. The job
+output is printed to stdout. `status` prints the service's queue depth and
+latency report instead of running a job.
+
+Only the standard library is imported, so the client starts in milliseconds.
+"""
+import http.client
+import json
+import os
+import socket
+import sys
+from argparse import REMAINDER, ArgumentParser, RawTextHelpFormatter
+from urllib.parse import urlparse
+
+from stages import STAGE_MODULES, stage_script
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''
+    HTTP connection over a Unix socket.
+    '''
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument("-s", "--socket", help="Unix socket of the scoring service")
+    address.add_argument("-u", "--url", help="URL of the scoring service, e.g. http://127.0.0.1:8765")
+    parser.add_argument("--fallback", action="store_true",
+                        help="Run the stage script directly if the service cannot be reached")
+    parser.add_argument("stage", choices=sorted(STAGE_MODULES) + ["status"],
+                        help="Stage to run, or 'status'")
+    parser.add_argument("stage_args", nargs=REMAINDER,
+                        help="Arguments of the stage script")
+    return parser
+
+
+def connect(options):
+    if options.socket:
+        return UnixHTTPConnection(options.socket)
+    url = urlparse(options.url)
+    return http.client.HTTPConnection(url.hostname, url.port)
+
+
+def request(options, method, path, payload=None):
+    '''
+    Send one request and return (HTTP status, decoded JSON reply).
+    '''
+    conn = connect(options)
+    try:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read().decode("utf-8"))
+    finally:
+        conn.close()
+
+
+def main(options):
+    try:
+        if options.stage == "status":
+            code, reply = request(options, "GET", "/status")
+            print(json.dumps(reply, indent=4, sort_keys=True))
+            return 0 if code == 200 else 1
+
+        job = {"stage": options.stage, "argv": options.stage_args, "cwd": os.getcwd()}
+        code, reply = request(options, "POST", "/jobs", job)
+    except (OSError, http.client.HTTPException) as e:
+        if not options.fallback or options.stage == "status":
+            print(f"ERROR: Cannot reach the scoring service: {e}", file=sys.stderr)
+            return 1
+        print(f"WARNING: Cannot reach the scoring service ({e}), running {options.stage} locally.",
+              file=sys.stderr)
+        script = stage_script(options.stage)
+        os.execv(sys.executable, [sys.executable, script] + options.stage_args)
+
+    if code != 200:
+        print(f"ERROR: Scoring service refused the job ({code}): {reply.get('error')}", file=sys.stderr)
+        return 1
+
+    sys.stdout.write(reply["log"])
+    print(f"INFO: {options.stage} finished with status {reply['exit_status']} "
+          f"(queued {reply['queue_s']:.3f}s, ran {reply['run_s']:.3f}s)", file=sys.stderr)
+    return reply["exit_status"]
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments().parse_args()))
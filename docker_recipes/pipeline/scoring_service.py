@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Resident scoring service for the benchmarking stages.
+
+Every Nextflow task normally starts a container, a Python interpreter and the
+pandas / scikit-learn / matplotlib imports before running one small job. This
+service keeps a bounded pool of warm worker processes instead: each worker has
+the heavy libraries imported and caches the gold standards and aggregation
+templates it has read (keyed on path, size and modification time).
+
+Jobs are the command lines of the stage scripts, so `scoring_client.py` can
+stand in for `python3 /app/<stage>.py` in main.nf:
+
+    POST /jobs     {"stage": "metrics", "argv": ["-i", "predictions.csv", ...], "cwd": "/work/dir"}
+    GET  /status   pool size, queue depth, job counters and per-stage latency
+
+Stages are "validation", "metrics", "aggregation" and "merge". Relative paths in
+a job are resolved against its "cwd", which must be visible to the service.
+
+A worker that dies (e.g. killed for its memory) breaks the whole pool: the pool
+is then replaced by a new one and the jobs it failed are resubmitted once; a job
+failing again that way is answered with a 500 error.
+
+Usage:
+    python3 scoring_service.py --socket /tmp/eucanimage_scoring/scoring.sock [-w WORKERS] [-q MAX_QUEUE]
+    python3 scoring_service.py --port 8765 [-w WORKERS] [-q MAX_QUEUE]
+"""
+import functools
+import io
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import traceback
+from argparse import ArgumentParser, RawTextHelpFormatter
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stderr, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stages import STAGE_MODULES, stage_module
+
+# modules imported once per worker, before the first job arrives
+WARM_IMPORTS = ("numpy", "pandas", "sklearn.metrics", "JSON_templates", "assessment_chart.assessment_chart")
+
+# number of recent jobs per stage used for the latency percentiles
+LATENCY_WINDOW = 1000
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument("-s", "--socket", help="Path of the Unix socket to listen on")
+    address.add_argument("-p", "--port", type=int, help="TCP port to listen on (localhost only)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("-q", "--max_queue", type=int, default=64,
+                        help="Jobs allowed to wait for a worker before new ones are refused (default: 64)")
+    parser.add_argument("--cache_size", type=int, default=32,
+                        help="Gold standards / templates kept in memory per worker (default: 32)")
+    return parser
+
+
+########################################################
+# Worker side
+########################################################
+
+def cached_reader(reader, maxsize):
+    '''
+    Wrap a file reader with an LRU cache keyed on (real path, size, mtime), so edited files are re-read.
+    '''
+    @functools.lru_cache(maxsize=maxsize)
+    def _read(path, size, mtime_ns):
+        return reader(path)
+
+    @functools.wraps(reader)
+    def read(path):
+        st = os.stat(path)
+        return _read(os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+    read.cache_info = _read.cache_info
+    return read
+
+
+def warm_worker(cache_size):
+    '''
+    Process pool initializer: import the heavy libraries and install the cached readers.
+    '''
+    logging.basicConfig(level=logging.INFO)
+    stage_module("aggregation")  # puts the stage directories on sys.path
+    for name in WARM_IMPORTS:
+        try:
+            __import__(name)
+        except ImportError as e:
+            logging.warning(f"Worker {os.getpid()} could not pre-import {name}: {e}")
+
+    validation = stage_module("validation")
+    validation.read_goldstandard = cached_reader(validation.read_goldstandard, cache_size)
+    # the metrics stage reads the gold standard and its compiled store together
+    metrics = stage_module("metrics")
+    metrics.open_goldstandard = cached_reader(metrics.open_goldstandard, cache_size)
+    aggregation = stage_module("aggregation")
+    aggregation.read_aggregation_template = cached_reader(aggregation.read_aggregation_template, cache_size)
+
+
+def run_job(stage, argv, cwd):
+    '''
+    Run one stage in the current (worker) process, the same way its script would run.
+    Returns the exit status, the captured output and the start/run times.
+    '''
+    started = time.time()
+    log = io.StringIO()
+    handler = logging.StreamHandler(log)
+    logging.getLogger().addHandler(handler)
+    previous_cwd = os.getcwd()
+    status = 0
+    try:
+        with redirect_stdout(log), redirect_stderr(log):
+            try:
+                os.chdir(cwd)
+                module = stage_module(stage)
+                parser = module.parse_arguments()
+                parser.prog = os.path.basename(module.__file__)
+                module.main(parser.parse_args(argv))
+            except SystemExit as e:
+                # the stage scripts report errors through sys.exit(), like on the command line
+                if isinstance(e.code, str):
+                    print(e.code)
+                    status = 1
+                else:
+                    status = e.code or 0
+            except Exception:
+                traceback.print_exc()
+                status = 1
+    finally:
+        os.chdir(previous_cwd)
+        logging.getLogger().removeHandler(handler)
+
+    return {
+        "exit_status": status,
+        "log": log.getvalue(),
+        "started": started,
+        "run_s": time.time() - started,
+    }
+
+
+########################################################
+# Server side
+########################################################
+
+# times a job failed by a broken pool is resubmitted to the new one
+RESUBMITS = 1
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+class ScoringService:
+    '''
+    Bounded pool of warm workers plus the bookkeeping reported by GET /status.
+    '''
+
+    def __init__(self, workers, max_queue, cache_size):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.cache_size = cache_size
+        self.pool = self.new_pool()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.latencies = {stage: deque(maxlen=LATENCY_WINDOW) for stage in STAGE_MODULES}
+        self.waits = {stage: deque(maxlen=LATENCY_WINDOW) for stage in STAGE_MODULES}
+
+        # start (and warm) all workers now rather than on the first jobs
+        for future in [self.pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker, initargs=(self.cache_size,))
+
+    def replace_pool(self, broken):
+        '''
+        Replace a broken pool by a new one, once however many jobs it failed.
+        '''
+        with self.lock:
+            if self.pool is not broken:
+                return
+            self.pool = self.new_pool()
+            self.restarts += 1
+        logging.warning("A worker process died, the pool was restarted")
+        broken.shutdown(wait=False)
+
+    def run(self, stage, argv, cwd):
+        '''
+        Run a job on the pool, resubmitting it (RESUBMITS times) when a dead worker broke the pool.
+        '''
+        for attempt in range(RESUBMITS + 1):
+            pool = self.pool
+            try:
+                return pool.submit(run_job, stage, argv, cwd).result()
+            except BrokenProcessPool:
+                self.replace_pool(pool)
+        raise WorkerCrashed(f"The worker running the {stage} job died {RESUBMITS + 1} time(s) "
+                            "(killed, e.g. for its memory use); the job was not completed")
+
+    def submit(self, stage, argv, cwd):
+        '''
+        Run a job on the pool and wait for its result. Raises QueueFull when the queue is at capacity,
+        WorkerCrashed when its worker keeps dying.
+        '''
+        if stage not in STAGE_MODULES:
+            raise KeyError(f"Unknown stage '{stage}', expected one of {sorted(STAGE_MODULES)}")
+
+        with self.lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                raise QueueFull(f"{self.in_flight} jobs in flight, queue limit is {self.max_queue}")
+            self.in_flight += 1
+
+        submitted = time.time()
+        try:
+            result = self.run(stage, argv, cwd)
+        except WorkerCrashed:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        result["queue_s"] = max(result.pop("started") - submitted, 0.0)
+        result["total_s"] = time.time() - submitted
+        with self.lock:
+            self.latencies[stage].append(result["total_s"])
+            self.waits[stage].append(result["queue_s"])
+            if result["exit_status"] == 0:
+                self.completed += 1
+            else:
+                self.failed += 1
+        return result
+
+    def status(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "running": min(self.in_flight, self.workers),
+                "queued": max(self.in_flight - self.workers, 0),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "failed": self.failed,
+                "restarts": self.restarts,
+                "latency_s": {stage: summarize(values) for stage, values in self.latencies.items() if values},
+                "queue_wait_s": {stage: summarize(values) for stage, values in self.waits.items() if values},
+            }
+
+
+def summarize(values):
+    ordered = sorted(values)
+
+    def percentile(p):
+        return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "max": ordered[-1],
+    }
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    # set on the handler class by serve()
+    service = None
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self.reply(200, self.service.status())
+        else:
+            self.reply(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self.reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length).decode("utf-8"))
+            result = self.service.submit(job["stage"], list(job.get("argv", [])), job.get("cwd") or os.getcwd())
+        except QueueFull as e:
+            self.reply(503, {"error": str(e)})
+        except WorkerCrashed as e:
+            self.reply(500, {"error": str(e)})
+        except (KeyError, ValueError, TypeError) as e:
+            self.reply(400, {"error": f"Bad job request: {e}"})
+        else:
+            self.reply(200, result)
+
+    def reply(self, code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logging.info("%s %s", self.address_string(), format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(options):
+    service = ScoringService(options.workers, options.max_queue, options.cache_size)
+    handler = type("BoundJobHandler", (JobHandler,), {"service": service})
+
+    if options.socket:
+        if os.path.exists(options.socket):
+            os.remove(options.socket)
+        os.makedirs(os.path.dirname(os.path.abspath(options.socket)), exist_ok=True)
+        server = UnixHTTPServer(options.socket, handler)
+        where = options.socket
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", options.port), handler)
+        where = f"http://127.0.0.1:{options.port}"
+
+    logging.info(f"Scoring service listening on {where} with {options.workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down")
+    finally:
+        server.server_close()
+        service.pool.shutdown()
+        if options.socket and os.path.exists(options.socket):
+            os.remove(options.socket)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s:%(message)s', datefmt='%Y-%m-%d %H:%M:%S ')
+    serve(parse_arguments().parse_args())
@@ -0,0 +1,48 @@
+"""
+Locate the stage scripts of the validation, metrics and consolidation containers.
+
+Inside the pipeline image all stage scripts are copied flat into /app. In a
+source checkout they live in the sibling recipe directories, which are put on
+sys.path here so that the stages can be imported as modules.
+"""
+import importlib
+import os
+import sys
+
+RECIPES_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+STAGE_DIRS = ("validation", "metrics", "consolidation", "oeb_schemas")
+
+# stage name -> module implementing it (each module has parse_arguments() and main())
+STAGE_MODULES = {
+    "validation": "validation",
+    "metrics": "compute_metrics",
+    "aggregation": "aggregation",
+    "merge": "merge_data_model_files",
+}
+
+
+def add_stage_paths():
+    '''
+    Make the stage modules importable when running from a source checkout.
+    '''
+    for stage_dir in STAGE_DIRS:
+        path = os.path.join(RECIPES_DIR, stage_dir)
+        if os.path.isdir(path) and path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def stage_module(stage):
+    '''
+    Import and return the module implementing the given stage.
+    '''
+    if stage not in STAGE_MODULES:
+        raise KeyError(f"Unknown stage '{stage}', expected one of {sorted(STAGE_MODULES)}")
+    add_stage_paths()
+    return importlib.import_module(STAGE_MODULES[stage])
+
+
+def stage_script(stage):
+    '''
+    Return the path of the script implementing the given stage.
+    '''
+    return stage_module(stage).__file__
@@ -0,0 +1,53 @@
+import os
+
+import oeb_json
+import run_pipeline
+from stages import stage_module
+
+INPUT_DATA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "input_data")
+PREDICTIONS = os.path.join(INPUT_DATA, "participant_dir", "predictions.csv")
+GOLDSTANDARD = os.path.join(INPUT_DATA, "goldstandard_dir")
+TEMPLATE = os.path.join(INPUT_DATA, "minimal_aggregation_template.json")
+CHALLENGES = ["CH1", "CH2"]
+
+
+def run_stage(stage, *argv):
+    module = stage_module(stage)
+    return module.main(module.parse_arguments().parse_args([str(a) for a in argv]))
+
+
+def undated(obj):
+    # validation_date is the time of each run
+    if isinstance(obj, dict):
+        return {k: undated(v) for k, v in obj.items() if k != "validation_date"}
+    if isinstance(obj, list):
+        return [undated(v) for v in obj]
+    return obj
+
+
+def test_fused_run_writes_what_the_three_stages_write(tmp_path, monkeypatch):
+    ids = ["-p", "toolA", "-com", "C", "-e", "E"]
+
+    # main.nf: validation, compute_metrics, then aggregation and merge
+    staged = tmp_path / "staged"
+    staged.mkdir()
+    monkeypatch.chdir(staged)  # validation.py writes validated_result.json in its working directory
+    run_stage("validation", "-i", PREDICTIONS, "-g", GOLDSTANDARD, "-c", *CHALLENGES, *ids)
+    run_stage("metrics", "-i", PREDICTIONS, "-g", GOLDSTANDARD, "-c", *CHALLENGES, *ids,
+              "-o", staged / "assessment_results.json")
+    run_stage("aggregation", "-a", staged / "assessment_results.json", "-e", "E", "-o", staged / "out",
+              "-t", TEMPLATE)
+    run_stage("merge", "-m", staged / "assessment_results.json", "-v", staged / "validated_result.json",
+              "-c", *CHALLENGES, "-a", staged / "out", "-o", staged / "consolidated_result.json")
+
+    fused = tmp_path / "fused"
+    run_pipeline.main(run_pipeline.parse_arguments().parse_args([
+        "-i", PREDICTIONS, "-g", GOLDSTANDARD, "-c", *CHALLENGES, *ids, "-t", TEMPLATE, "-o", str(fused / "out"),
+        "--validation_result", str(fused / "validated_result.json"),
+        "--assessment_results", str(fused / "assessment_results.json"),
+        "--consolidated_result", str(fused / "consolidated_result.json")]))
+
+    for name in ("validated_result.json", "assessment_results.json", "consolidated_result.json",
+                 os.path.join("out", "Manifest.json"), os.path.join("out", "CH1", "CH1.json"),
+                 os.path.join("out", "CH2", "toolA.json")):
+        assert undated(oeb_json.load(str(fused / name))) == undated(oeb_json.load(str(staged / name))), name
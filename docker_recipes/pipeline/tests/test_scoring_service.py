@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import scoring_service
+
+
+class FakePool:
+    '''
+    Pool whose workers die on the first `crashes` jobs.
+    '''
+
+    def __init__(self, crashes):
+        self.crashes = crashes
+        self.shut_down = False
+
+    def submit(self, fn, stage, argv, cwd):
+        future = Future()
+        if self.crashes > 0:
+            self.crashes -= 1
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        else:
+            future.set_result({"exit_status": 0, "log": "", "started": 0.0, "run_s": 0.0})
+        return future
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+def service(pools):
+    svc = scoring_service.ScoringService.__new__(scoring_service.ScoringService)
+    svc.workers, svc.max_queue, svc.cache_size = 1, 4, 1
+    svc.lock = threading.Lock()
+    svc.in_flight = svc.completed = svc.failed = svc.restarts = 0
+    svc.latencies = {stage: [] for stage in scoring_service.STAGE_MODULES}
+    svc.waits = {stage: [] for stage in scoring_service.STAGE_MODULES}
+    pools = iter(pools)
+    svc.new_pool = lambda: next(pools)
+    svc.pool = svc.new_pool()
+    return svc
+
+
+def test_broken_pool_is_replaced_and_the_job_resubmitted():
+    first = FakePool(crashes=1)
+    svc = service([first, FakePool(crashes=0)])
+    result = svc.submit("metrics", [], ".")
+    assert result["exit_status"] == 0
+    assert first.shut_down and svc.pool is not first
+    assert svc.status()["restarts"] == 1
+
+
+def test_job_whose_worker_keeps_dying_fails_clearly():
+    svc = service([FakePool(crashes=1), FakePool(crashes=1), FakePool(crashes=0)])
+    with pytest.raises(scoring_service.WorkerCrashed, match="metrics job died"):
+        svc.submit("metrics", [], ".")
+    status = svc.status()
+    assert (status["failed"], status["restarts"]) == (1, 2)
+    # the next job runs on a working pool
+    assert svc.submit("metrics", [], ".")["exit_status"] == 0
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+
+import pytest
+
+import stages
+
+
+@pytest.mark.parametrize("stage", sorted(stages.STAGE_MODULES))
+def test_importing_a_stage_defers_the_heavy_libraries(stage):
+    code = (f"import sys, stages; stages.stage_module({stage!r}); "
+            "print(sorted(m for m in ('pandas', 'sklearn', 'matplotlib', 'scipy') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=stages.__file__.rsplit("/", 1)[0]).stdout
+    assert out.strip() == "[]"
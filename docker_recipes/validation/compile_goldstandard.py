@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Compile the gold standard of an event once, for all its submissions.
+
+Every gt.csv of the directory (the shared ``<dir>/gt.csv`` and the per-challenge
+``<dir>/<challenge>/gt.csv``) is read and checked as by the validation stage,
+then written next to it as a memory-mapped store (``gt.store/``, see
+``oeb_schemas/gt_store.py``). The validation and metrics stages open the store
+instead of parsing and re-checking the CSV, as long as the CSV is unchanged.
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List
+
+from validation import load_goldstandard, error
+
+import gt_store  # on sys.path once validation is imported
+from gt_store import goldstandard_path
+
+
+def parse_arguments() -> ArgumentParser:
+    """Return the command-line parser of the compile command."""
+    parser = ArgumentParser(description="Compile the gold-standard CSVs of a directory into read-only stores.")
+    parser.add_argument("-g", "--goldstandard_file", required=True,
+                        help="Ground-truth directory: <challenge>/gt.csv per challenge and/or a shared gt.csv.")
+    parser.add_argument("-c", "--challenges_ids", nargs='+',
+                        help="Compile only the gt.csv of these challenge(s) (default: all found).")
+    return parser
+
+
+def goldstandard_files(goldstandard_dir: str, challenges=None) -> List[Path]:
+    """Return the gt.csv files of the directory, or of the given challenges."""
+    root = Path(goldstandard_dir)
+    if challenges:
+        return list(dict.fromkeys(goldstandard_path(goldstandard_dir, challenge) for challenge in challenges))
+    return [path for path in [root / "gt.csv"] + sorted(root.glob("*/gt.csv")) if path.is_file()]
+
+
+def main(cfg) -> List[str]:
+    """Compile every gold standard; return the paths of the stores written."""
+    if not Path(cfg.goldstandard_file).is_dir():
+        error(f"Ground-truth directory '{cfg.goldstandard_file}' does not exist.")
+    gt_paths = goldstandard_files(cfg.goldstandard_file, cfg.challenges_ids)
+    if not gt_paths:
+        error(f"No gt.csv found in '{cfg.goldstandard_file}'.")
+
+    stores = []
+    for gt_path in gt_paths:
+        gt_df = load_goldstandard(gt_path, use_store=False)
+        path = gt_store.compile_store(gt_df, gt_path)
+        print(f"INFO: Compiled {gt_path} ({len(gt_df)} images) → {path}")
+        stores.append(path)
+    return stores
+
+
+if __name__ == "__main__":
+    main(parse_arguments().parse_args())
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import gt_store
+import validation
+
+
+@pytest.fixture
+def goldstandard_dir(tmp_path):
+    for challenge, images in (("A", ["a1", "a2"]), ("B", ["b1", "b2", "b3"])):
+        (tmp_path / challenge).mkdir()
+        gt_path = tmp_path / challenge / "gt.csv"
+        pd.DataFrame({"image": images, "label": [0, 1] + [1] * (len(images) - 2)}).to_csv(gt_path, index=False)
+        gt_store.compile_store(validation.load_goldstandard(gt_path, use_store=False), gt_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("images, message", [
+    (["a1", "a2", "b1", "b2", "b3"], None),
+    (["a1", "b1", "b2", "b3"], "present in GT but missing in predictions: ['a2']"),
+    (["a1", "a2", "b1", "b2", "b3", "c1"], "found in predictions but not in GT: ['c1']"),
+])
+def test_correspondence_through_the_stores(goldstandard_dir, images, message):
+    stores = validation.goldstandard_stores(goldstandard_dir, ["A", "B"])
+    assert len(stores) == 2
+    gt_df = pd.concat(validation.load_goldstandards(goldstandard_dir, ["A", "B"]).values())
+    pred_df = pd.DataFrame({"image": images})
+
+    for with_stores in (stores, ()):
+        if message is None:
+            validation.check_correspondence(pred_df, gt_df, with_stores)
+        else:
+            with pytest.raises(SystemExit, match=message.replace("[", r"\[").replace("]", r"\]")):
+                validation.check_correspondence(pred_df, gt_df, with_stores)
+
+
+def test_goldstandards_sharing_an_image_must_agree(tmp_path):
+    a = pd.DataFrame({"image": ["x1", "x2"], "label": [0, 1]})
+    b = pd.DataFrame({"image": ["x2", "x3"], "label": [1, 0], "site": ["s", "t"]})
+    combined = validation.combine_goldstandards([a, b, a])
+    assert combined["image"].tolist() == ["x1", "x2", "x3"]
+
+    b.loc[0, "label"] = 0
+    with pytest.raises(SystemExit, match=r"different labels .*\['x2'\]"):
+        validation.combine_goldstandards([a, b])
+
+
+def test_goldstandard_path_prefers_the_challenge_file(goldstandard_dir):
+    assert validation.goldstandard_path(goldstandard_dir, "A") == goldstandard_dir / "A" / "gt.csv"
+    assert validation.goldstandard_path(goldstandard_dir, "C") == goldstandard_dir / "gt.csv"
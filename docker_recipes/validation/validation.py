@@ -3,34 +3,55 @@
 """
 from __future__ import annotations
 
-import json
 import sys
 from argparse import ArgumentParser
 from pathlib import Path
 
-import pandas as pd
-import numpy as np
 import os
 
-import JSON_templates
+# shared OEB modules: in the images they are copied next to this script, in a source checkout they are in ../oeb_schemas
+SCHEMAS_DIR = str(Path(__file__).resolve().parent.parent / "oeb_schemas")
+if SCHEMAS_DIR not in sys.path:
+    sys.path.append(SCHEMAS_DIR)
+import oeb_json
+import gt_store
+from gt_store import goldstandard_path
+import submission_io
+from submission_io import PROB_PREFIX, LABEL_PREFIX  # wide multi-class / multi-label schema
+import profiling
+from oeb_validation import check_oeb_objects
+
+# validated participant JSON, written to the working directory
+OUTPUT_FILE = "validated_result.json"
+
+# pandas and JSON_templates are imported inside the functions that need them, so
+# that importing this module (or running it with --help / bad arguments) stays cheap.
 
 # -----------------------------------------------------------------------------
 # CLI arguments
 # -----------------------------------------------------------------------------
-parser = ArgumentParser()
-parser.add_argument("-i", "--input", required=True,
-                    help="CSV file containing participant predictions.")
-parser.add_argument("-com", "--community_id", required=True,
-                    help="OEB community id or label, e.g. 'EuCanImage'.")
-parser.add_argument("-c", "--challenges_ids", nargs='+', required=True,
-                    help="Challenge name(s) chosen by the user.")
-parser.add_argument("-p", "--participant_id", required=True,
-                    help="Tool / model id (participant).")
-parser.add_argument("-e", "--event_id", required=True,
-                    help="Benchmarking event id or name.")
-parser.add_argument("-g", "--goldstandard_file", required=True,
-                    help="Ground‑truth CSV containing 'image' and 'label' columns.")
-args = parser.parse_args()
+
+def parse_arguments() -> ArgumentParser:
+    """Return the command-line parser of the validation stage."""
+    parser = ArgumentParser()
+    parser.add_argument("-i", "--input", required=True,
+                        help="CSV file containing participant predictions, possibly gzip/zstd-compressed "
+                             "or in a tar archive (e.g. with the NIfTI masks, .nii.gz.tar).")
+    parser.add_argument("-com", "--community_id", required=True,
+                        help="OEB community id or label, e.g. 'EuCanImage'.")
+    parser.add_argument("-c", "--challenges_ids", nargs='+', required=True,
+                        help="Challenge name(s) chosen by the user.")
+    parser.add_argument("-p", "--participant_id", required=True,
+                        help="Tool / model id (participant).")
+    parser.add_argument("-e", "--event_id", required=True,
+                        help="Benchmarking event id or name.")
+    parser.add_argument("-g", "--goldstandard_file", required=True,
+                        help="Ground‑truth directory: <challenge>/gt.csv per challenge or a shared gt.csv, "
+                             "with 'image' and 'label' columns (or, for segmentation challenges, "
+                             "reference masks gt_<case>.nii[.gz]).")
+    profiling.add_arguments(parser)
+    return parser
+
 
 # -----------------------------------------------------------------------------
 # Helper utilities
@@ -41,22 +62,56 @@ def error(msg: str) -> None:
     sys.exit(f"ERROR: {msg}")
 
 
+def read_goldstandard(gt_path: Path):
+    """Read the ground-truth CSV into a DataFrame.
+
+    Long-running callers (see ``pipeline/scoring_service.py``) replace this
+    with a cached reader, so the result is copied before being modified.
+    """
+    import pandas as pd
+    return pd.read_csv(gt_path)
+
+
 # -----------------------------------------------------------------------------
-# Main validation routine
+# Validation steps (usable on in-memory data)
 # -----------------------------------------------------------------------------
 
-def main(cfg):
+def check_volume_header(name: str, header) -> None:
+    """Exit with an error unless the NIfTI header of archive member *name* describes a 3D volume."""
+    shape = header.get_data_shape()
+    if len(shape) < 3 or any(n == 0 for n in shape):
+        error(f"NIfTI volume '{name}' must have at least three non-empty dimensions, found shape {shape}.")
+
+
+def load_predictions(pred_path: Path):
+    """Read and check the participant predictions CSV; return the cleaned DataFrame.
+
+    The CSV may be compressed or inside a tar archive (see ``submission_io.py``),
+    which is streamed, not extracted; the headers of its NIfTI members are checked on the way.
+    """
     # ---------------------------------------------------------------------
     # 1. Load participant predictions
     # ---------------------------------------------------------------------
-    pred_path = Path(cfg.input)
     if not pred_path.is_file():
         error(f"Predictions file '{pred_path}' does not exist or is not a file.")
 
+    import pandas as pd
+
+    volumes = []
+
+    def check_volume(name, header):
+        check_volume_header(name, header)
+        volumes.append(name)
+
     try:
-        pred_df = pd.read_csv(pred_path)
+        pred_df = submission_io.read_predictions(pred_path, on_volume=check_volume)
     except Exception as exc:
         error(f"Cannot read predictions CSV: {exc}")
+    if volumes:
+        print(f"INFO: {len(volumes)} NIfTI volume(s) in the submission archive.")
+
+    if any(str(c).startswith(PROB_PREFIX) for c in pred_df.columns):
+        return check_wide_predictions(pred_df)
 
     expected_pred_cols = ["image", "predicted_probability", "predicted_label"]
     missing_cols = [c for c in expected_pred_cols if c not in pred_df.columns]
@@ -107,20 +162,78 @@ def main(cfg):
             f"WARNING: {len(inconsistent)} rows where hard label != probability threshold 0.5.\n"
             f"         This is *not* an error – only informational.")
 
-    # ---------------------------------------------------------------------
-    # 3. Load ground‑truth and check correspondence
-    # ---------------------------------------------------------------------
-    gt_path = Path(os.path.join(cfg.goldstandard_file, "gt.csv"))
+    return pred_df
+
+
+def check_wide_predictions(pred_df):
+    """Check predictions with one `prob_<class>` column per class; return the cleaned DataFrame."""
+    import pandas as pd
+
+    prob_cols = [c for c in pred_df.columns if str(c).startswith(PROB_PREFIX)]
+    if "image" not in pred_df.columns:
+        error("Missing required column(s) in predictions CSV: ['image'].")
+    if len(prob_cols) < 2:
+        error(f"Multi-class / multi-label predictions need at least two '{PROB_PREFIX}<class>' columns, found {prob_cols}.")
+
+    expected_pred_cols = ["image"] + prob_cols + (["predicted_label"] if "predicted_label" in pred_df.columns else [])
+    extra_cols = [c for c in pred_df.columns if c not in expected_pred_cols]
+    if extra_cols:
+        print(f"WARNING: Ignoring unexpected column(s) in predictions CSV: {extra_cols}")
+    pred_df = pred_df[expected_pred_cols].copy()
+
+    pred_df["image"] = pred_df["image"].astype(str).str.strip()
+    if pred_df["image"].duplicated().any():
+        dupes = pred_df.loc[pred_df["image"].duplicated(), "image"].unique()
+        error(f"Duplicate image id(s) in predictions CSV: {', '.join(dupes)}")
+
+    for col in prob_cols:
+        try:
+            pred_df[col] = pd.to_numeric(pred_df[col], errors="raise")
+        except Exception as exc:
+            error(f"'{col}' column must be numeric: {exc}")
+        out_of_range = ~((pred_df[col] >= 0) & (pred_df[col] <= 1))
+        if out_of_range.any():
+            error(f"Probability values outside [0,1]:\n{pred_df.loc[out_of_range, ['image', col]].to_string(index=False)}")
+
+    if "predicted_label" in pred_df.columns:
+        pred_df["predicted_label"] = pred_df["predicted_label"].astype(str).str.strip()
+
+    # Informational only – multi-label scores need not sum to one
+    off_simplex = (pred_df[prob_cols].sum(axis=1) - 1).abs() > 1e-3
+    if off_simplex.any():
+        print(
+            f"WARNING: {int(off_simplex.sum())} rows where the class probabilities do not sum to 1.\n"
+            f"         This is expected for multi-label predictions only.")
+
+    return pred_df
+
+
+def load_goldstandard(gt_path: Path, use_store: bool = True):
+    """Read and check the ground-truth CSV; return the cleaned DataFrame.
+
+    A store compiled from the same CSV (see ``compile_goldstandard.py``) is
+    opened instead, without parsing or re-checking, unless *use_store* is False.
+    """
     if not gt_path.is_file():
         error(f"Ground‑truth file '{gt_path}' does not exist or is not a file.")
 
+    store = gt_store.open_store(gt_path) if use_store else None
+    if store is not None:
+        return store.frame()
+
     try:
-        gt_df = pd.read_csv(gt_path)
+        gt_df = read_goldstandard(gt_path).copy()
     except Exception as exc:
         error(f"Cannot read ground‑truth CSV: {exc}")
 
     expected_gt_cols = ["image", "label"]
-    if list(gt_df.columns[:2]) != expected_gt_cols:  # strict but catches common mistakes
+    label_cols = [c for c in gt_df.columns[1:] if str(c).startswith(LABEL_PREFIX)]
+    if label_cols and gt_df.columns[0] == "image":
+        # multi-label ground truth: one 0/1 column per class
+        bad = [c for c in label_cols if not gt_df[c].isin([0, 1]).all()]
+        if bad:
+            error(f"Multi-label ground-truth column(s) must contain 0 or 1 only: {bad}")
+    elif list(gt_df.columns[:2]) != expected_gt_cols:  # strict but catches common mistakes
         error(f"Ground‑truth CSV must have columns {expected_gt_cols} as the first two columns.")
 
     gt_df["image"] = gt_df["image"].astype(str).str.strip()
@@ -129,25 +242,160 @@ def main(cfg):
         dupes = gt_df.loc[gt_df["image"].duplicated(), "image"].unique()
         error(f"Duplicate image id(s) in ground‑truth CSV: {', '.join(dupes)}")
 
-    pred_set = set(pred_df["image"])
-    gt_set   = set(gt_df["image"])
+    return gt_df
+
+
+def load_goldstandards(goldstandard_dir: str, challenges) -> dict:
+    """Load and check the ground truth of every challenge.
+
+    Returns a dict mapping each challenge id to its DataFrame; challenges that
+    share a gt.csv share the same DataFrame, read only once.
+    """
+    gt_paths = {challenge: goldstandard_path(goldstandard_dir, challenge) for challenge in challenges}
+    gt_dfs = {gt_path: load_goldstandard(gt_path) for gt_path in dict.fromkeys(gt_paths.values())}
+    return {challenge: gt_dfs[gt_path] for challenge, gt_path in gt_paths.items()}
+
+
+def combine_goldstandards(gt_dfs):
+    """Return the union of the ground truth of several challenges, one row per image.
+
+    Exits with an error when an image is in several gold standards with
+    different labels (``label`` or ``label_<class>``).
+    """
+    import pandas as pd
 
-    missing_in_pred = gt_set - pred_set
-    extra_in_pred   = pred_set - gt_set
+    distinct = list({id(gt_df): gt_df for gt_df in gt_dfs}.values())
+    if len(distinct) == 1:
+        return distinct[0]
+    gt_df = pd.concat(distinct, ignore_index=True)
+    repeated = gt_df[gt_df["image"].duplicated(keep=False)]
+    label_cols = [c for c in gt_df.columns if c == "label" or str(c).startswith(LABEL_PREFIX)]
+    if len(repeated) and label_cols:
+        conflicts = repeated.groupby("image")[label_cols].nunique().gt(1).any(axis=1)
+        if conflicts.any():
+            images = sorted(conflicts.index[conflicts])
+            error(f"{len(images)} image id(s) have different labels in the ground truth of different "
+                  f"challenges: {images[:5]}")
+    return gt_df.drop_duplicates("image")
+
+
+def goldstandard_stores(goldstandard_dir: str, challenges) -> list:
+    """Return the compiled store of every distinct gold standard of the challenges.
+
+    Empty unless all of them have an up-to-date store (see ``compile_goldstandard.py``).
+    """
+    gt_paths = dict.fromkeys(goldstandard_path(goldstandard_dir, challenge) for challenge in challenges)
+    stores = [gt_store.open_store(gt_path) for gt_path in gt_paths]
+    return stores if all(store is not None for store in stores) else []
+
+
+def check_masks(pred_path: Path, mask_dirs) -> None:
+    """Exit with an error unless the submission holds one predicted mask per case of the segmentation challenges.
+
+    *mask_dirs* are the directories of reference masks; only the NIfTI headers
+    are read, and each predicted mask must have the shape of its reference.
+    """
+    import nibabel
+
+    if not pred_path.is_file():
+        error(f"Predictions file '{pred_path}' does not exist or is not a file.")
+
+    shapes = {}
+    try:
+        for member in submission_io.iter_members(pred_path):
+            if member.kind != submission_io.NIFTI:
+                continue
+            header = submission_io.read_volume_header(member.stream)
+            check_volume_header(member.name, header)
+            case = submission_io.case_id(member.name, submission_io.PRED_MASK_PREFIX)
+            if case in shapes:
+                error(f"More than one predicted mask of case '{case}'.")
+            shapes[case] = header.get_data_shape()
+    except ValueError as exc:  # includes submission_io.SubmissionError
+        error(f"Cannot read predicted masks: {exc}")
+
+    gt_masks = {}
+    for mask_dir in dict.fromkeys(mask_dirs):
+        gt_masks.update(submission_io.reference_masks(mask_dir))
+    missing_in_pred = set(gt_masks) - set(shapes)
+    extra_in_pred = set(shapes) - set(gt_masks)
+    if missing_in_pred:
+        error(f"{len(missing_in_pred)} case(s) have a reference mask but no predicted mask: {sorted(missing_in_pred)[:5]}…")
+    if extra_in_pred:
+        error(f"{len(extra_in_pred)} predicted mask(s) of cases without a reference mask: {sorted(extra_in_pred)[:5]}…")
+    for case, gt_path in gt_masks.items():
+        gt_shape = nibabel.load(gt_path).shape  # header only
+        if tuple(shapes[case]) != tuple(gt_shape):
+            error(f"Predicted mask of case '{case}' has shape {tuple(shapes[case])}, its reference {tuple(gt_shape)}.")
+    print(f"INFO: {len(shapes)} predicted mask(s) match their reference masks.")
+
+
+def check_correspondence(pred_df, gt_df, stores=()) -> None:
+    """Exit with an error unless predictions and ground truth cover the same image ids.
+
+    With the compiled *stores* of every gold standard *gt_df* is made of (see
+    :func:`goldstandard_stores`), the image ids are looked up in them instead of
+    being hashed.
+    """
+    if stores:
+        import numpy as np
+
+        images = pred_df["image"].to_numpy(dtype=str)
+        found = np.zeros(len(images), dtype=bool)
+        missing_in_pred = set()
+        for store in stores:
+            rows = store.lookup(images)
+            found |= rows >= 0
+            missing_in_pred.update(store.unmatched(rows).tolist())
+        extra_in_pred = set(images[~found].tolist())
+    else:
+        pred_set = set(pred_df["image"])
+        gt_set   = set(gt_df["image"])
+        missing_in_pred = gt_set - pred_set
+        extra_in_pred   = pred_set - gt_set
 
     if missing_in_pred:
         error(f"{len(missing_in_pred)} image id(s) are present in GT but missing in predictions: {sorted(missing_in_pred)[:5]}…")
     if extra_in_pred:
         error(f"{len(extra_in_pred)} extra image id(s) found in predictions but not in GT: {sorted(extra_in_pred)[:5]}…")
 
-    # ---------------------------------------------------------------------
-    # 4. Emit validation JSON
-    # ---------------------------------------------------------------------
-    output_filename = "validated_result.json"
+
+def check_schema(pred_df, gt_df) -> None:
+    """Exit with an error unless the prediction and ground-truth schemas describe the same task and classes."""
+    classes = [str(c)[len(PROB_PREFIX):] for c in pred_df.columns if str(c).startswith(PROB_PREFIX)]
+    gt_classes = [str(c)[len(LABEL_PREFIX):] for c in gt_df.columns if str(c).startswith(LABEL_PREFIX)]
+
+    if not classes:
+        if gt_classes and "label" not in gt_df.columns:
+            error("Multi-label ground truth needs one 'prob_<class>' prediction column per class.")
+        return
+
+    if gt_classes and "label" not in gt_df.columns:
+        # multi-label
+        if set(classes) != set(gt_classes):
+            error(f"Prediction classes {classes} do not match the ground-truth classes {gt_classes}.")
+        if "predicted_label" in pred_df.columns:
+            print("WARNING: 'predicted_label' is ignored for multi-label predictions (scores are thresholded at 0.5).")
+        return
+
+    # multi-class
+    unknown = set(gt_df["label"].astype(str).str.strip()) - set(classes)
+    if unknown:
+        error(f"Ground-truth class(es) without a '{PROB_PREFIX}<class>' prediction column: {sorted(unknown)}")
+    if "predicted_label" in pred_df.columns:
+        unknown = set(pred_df["predicted_label"]) - set(classes)
+        if unknown:
+            error(f"Invalid predicted_label value(s), expected one of {classes}: {sorted(unknown)}")
+
+
+def build_participant_dataset(cfg) -> dict:
+    """Return the OEB participant dataset of a submission that passed all checks."""
+    import JSON_templates
+
     data_id = f"{cfg.community_id}:{cfg.event_id}_{cfg.participant_id}"
     validated = True  # reaching this point ⇒ all checks passed
 
-    validation_json = JSON_templates.write_participant_dataset(
+    return JSON_templates.write_participant_dataset(
         data_id,
         cfg.community_id,
         cfg.challenges_ids,
@@ -155,12 +403,60 @@ def main(cfg):
         validated,
     )
 
-    with open(output_filename, "w", encoding="utf-8") as fp:
-        json.dump(validation_json, fp, indent=4, sort_keys=True, separators=(",", ": "))
+
+# -----------------------------------------------------------------------------
+# Main validation routine
+# -----------------------------------------------------------------------------
+
+def main(cfg):
+    """Validate one submission and write ``validated_result.json``.
+
+    *cfg* carries the attributes defined in :func:`parse_arguments`. Returns
+    the participant dataset object; any failed check exits via :func:`error`.
+    """
+    # segmentation challenges: their gold standard is a directory of reference masks
+    mask_dirs = {challenge: submission_io.reference_mask_dir(cfg.goldstandard_file, challenge)
+                 for challenge in cfg.challenges_ids}
+    mask_dirs = {challenge: mask_dir for challenge, mask_dir in mask_dirs.items() if mask_dir}
+    csv_challenges = [challenge for challenge in cfg.challenges_ids if challenge not in mask_dirs]
+
+    if csv_challenges:
+        # -----------------------------------------------------------------
+        # 1.-2. Load and check participant predictions
+        # -----------------------------------------------------------------
+        pred_df = load_predictions(Path(cfg.input))
+
+        # -----------------------------------------------------------------
+        # 3. Load ground‑truth of every challenge and check correspondence
+        #    (the predictions must cover exactly the union of their images)
+        # -----------------------------------------------------------------
+        goldstandards = load_goldstandards(cfg.goldstandard_file, csv_challenges)
+        gt_df = combine_goldstandards(goldstandards.values())
+        check_correspondence(pred_df, gt_df, goldstandard_stores(cfg.goldstandard_file, csv_challenges))
+        check_schema(pred_df, gt_df)
+
+    if mask_dirs:
+        # -----------------------------------------------------------------
+        # 1.-3. Check the predicted masks against the reference masks
+        # -----------------------------------------------------------------
+        check_masks(Path(cfg.input), mask_dirs.values())
+
+    # ---------------------------------------------------------------------
+    # 4. Emit validation JSON
+    # ---------------------------------------------------------------------
+    output_filename = OUTPUT_FILE
+    validation_json = build_participant_dataset(cfg)
+    try:
+        check_oeb_objects([validation_json])
+    except ValueError as exc:
+        error(str(exc))
+
+    oeb_json.dump(validation_json, output_filename)
 
     print(f"INFO: Validation succeeded. JSON written to '{output_filename}'.")
-    sys.exit(0)
+    return validation_json
 
 
 if __name__ == "__main__":
-    main(args)
+    options = parse_arguments().parse_args()
+    profiling.run(main, options, OUTPUT_FILE, "validation")
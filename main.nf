@@ -32,6 +32,8 @@ if (params.help) {
 		Other options:
 			--event_id				Name or OEB permanent ID for the benchmarking event 
 			--template    			Path to the JSON template file with the minimal data for the aggregation step to obtain the minimal benchmark data 
+			--scoring_service		Unix socket of a running scoring service (docker_recipes/pipeline/scoring_service.py); stages are sent to it instead of run in the task
+			--progressive			Also publish provisional results (confusion-matrix metrics, no tests or charts) to {outdir}/provisional within seconds; the final results replace them in {outdir}
 		//  --public_ref_dir     	Dir that can contain public reference file(s) used to validate the input parameters
 	    //  --otherdir              Output directory where custom results can be saved (no directory inside)
 			 
@@ -122,9 +124,11 @@ process validation {
 	output:
     path "validated_result.json", emit: validation_file
 	val task.exitStatus, emit: validation_status
-			
+
+	script:
+	def validation_cmd = params.scoring_service ? "python3 /app/scoring_client.py --socket ${params.scoring_service} validation" : "python3 /app/validation.py"
 	"""
-	python3 /app/validation.py -i $input_file -com $community_id -c $challenges_ids -e $event_id -p $participant_id -g $goldstandard_dir 
+	${validation_cmd} -i $input_file -com $community_id -c $challenges_ids -e $event_id -p $participant_id -g $goldstandard_dir 
 	"""
 
 }
@@ -167,8 +171,11 @@ process compute_metrics {
 	when:
 	validation_status == 0
 
+	script:
+	def metrics_cmd = params.scoring_service ? "python3 /app/scoring_client.py --socket ${params.scoring_service} metrics" : "python3 /app/compute_metrics.py"
+	def tier_arg = params.progressive ? "--tier 2" : ""
 	"""
-	python3 /app/compute_metrics.py -i $input_file -c $challenges_ids -e $event_id -g $goldstandard_dir -p $participant_id -com $community_id -o "${default_assessment_filename}"
+	${metrics_cmd} -i $input_file -c $challenges_ids -e $event_id -g $goldstandard_dir -p $participant_id -com $community_id -o "${default_assessment_filename}" ${tier_arg}
 	
 	"""
 }
@@ -208,48 +215,181 @@ process benchmark_consolidation {
 	
 	output:
 	path "${default_consolidation_filename}", emit: consolidated_result
-	
+
+	script:
+	def aggregation_cmd = params.scoring_service ? "python3 /app/scoring_client.py --socket ${params.scoring_service} aggregation" : "python3 /app/aggregation.py"
+	def merge_cmd = params.scoring_service ? "python3 /app/scoring_client.py --socket ${params.scoring_service} merge" : "python3 /app/merge_data_model_files.py"
+	def tier_arg = params.progressive ? "--tier 2" : ""
 	"""
-	python /app/aggregation.py -a $ass_json -e $event_id -o $outdir -t $template_path
-	python /app/merge_data_model_files.py -m $ass_json -v $validation_file -c $challenges_ids -a $outdir -o "${default_consolidation_filename}"
+	${aggregation_cmd} -a $ass_json -e $event_id -o $outdir -t $template_path ${tier_arg}
+	${merge_cmd} -m $ass_json -v $validation_file -c $challenges_ids -a $outdir -o "${default_consolidation_filename}" ${tier_arg}
 	"""
 
 }
 
+// Progressive results (--progressive): tier 1 of the metrics and of the consolidation runs
+// next to the two processes above. It publishes provisional results to {outdir}/provisional
+// within seconds and writes a provisional aggregation to {outdir}, which the final (tier 2)
+// consolidation replaces atomically; each results file there has a <file>.tier marker.
+
+process provisional_metrics {
+
+	tag "Computing provisional confusion-matrix metrics"
+
+	publishDir "${outdir}/provisional",
+	mode: 'copy',
+	overwrite: true
+
+	input:
+	val validation_status
+	path input_file
+	val challenges_ids
+	path goldstandard_dir
+	val participant_id
+	val community_id
+	val event_id
+
+	output:
+	path "${default_assessment_filename}", emit: ass_json
+
+	when:
+	validation_status == 0
+
+	script:
+	def metrics_cmd = params.scoring_service ? "python3 /app/scoring_client.py --socket ${params.scoring_service} metrics" : "python3 /app/compute_metrics.py"
+	"""
+	${metrics_cmd} -i $input_file -c $challenges_ids -e $event_id -g $goldstandard_dir -p $participant_id -com $community_id -o "${default_assessment_filename}" --tier 1
+	"""
+}
+
+process provisional_consolidation {
+
+	tag "Performing provisional benchmark assessment"
+
+	publishDir "${outdir}/provisional",
+	mode: 'copy',
+	overwrite: true
+
+	input:
+	path ass_json
+	val event_id
+	path outdir
+	path template_path
+	path validation_file
+	val challenges_ids
+
+	output:
+	path "${default_consolidation_filename}", emit: consolidated_result
+
+	script:
+	def aggregation_cmd = params.scoring_service ? "python3 /app/scoring_client.py --socket ${params.scoring_service} aggregation" : "python3 /app/aggregation.py"
+	def merge_cmd = params.scoring_service ? "python3 /app/scoring_client.py --socket ${params.scoring_service} merge" : "python3 /app/merge_data_model_files.py"
+	"""
+	${aggregation_cmd} -a $ass_json -e $event_id -o $outdir -t $template_path --tier 1
+	${merge_cmd} -m $ass_json -v $validation_file -c $challenges_ids -a $outdir -o "${default_consolidation_filename}" --tier 1
+	"""
+}
+
+// Single-process alternative to the three processes above (profile 'fused'):
+// docker_recipes/pipeline/run_pipeline.py validates, computes the metrics and
+// consolidates in memory, writing the same artefacts.
+
+process fused_pipeline {
+
+	tag "Validating, computing metrics and consolidating in one process"
+
+	publishDir outdir,
+	mode: 'copy',
+	overwrite: false
+
+	input:
+	path input_file
+	val challenges_ids
+	val participant_id
+	val community_id
+	val event_id
+	path goldstandard_dir
+	path outdir
+	path template_path
+
+	output:
+	path "validated_result.json", emit: validation_file
+	path "${default_assessment_filename}", emit: ass_json
+	path "${default_consolidation_filename}", emit: consolidated_result
+
+	"""
+	python3 /app/run_pipeline.py -i $input_file -c $challenges_ids -p $participant_id -com $community_id -e $event_id -g $goldstandard_dir -t $template_path -o $outdir --validation_result validated_result.json --assessment_results "${default_assessment_filename}" --consolidated_result "${default_consolidation_filename}"
+	"""
+}
+
 // Workflow
 
 workflow {
-    // Collect inputs and parameters
-    validation(
-        input_file,
-        challenges_ids,
-        participant_id,
-        community_id,
-		event_id,
-        // public_ref_dir,
-        goldstandard_dir
-    )
-    validations = validation.out.validation_file.collect()
-
-	compute_metrics(
-		validation.out.validation_status,
-		input_file,
-		challenges_ids,
-		goldstandard_dir,
-		participant_id,
-		community_id,
-		event_id
-	)
-	assessments = compute_metrics.out.ass_json.collect()
-
-	benchmark_consolidation(
-		assessments,
-		event_id,
-		outdir,
-		template_path,
-		validation_result,
-		challenges_ids
-	)
+    if (params.fused) {
+        fused_pipeline(
+            input_file,
+            challenges_ids,
+            participant_id,
+            community_id,
+            event_id,
+            goldstandard_dir,
+            outdir,
+            template_path
+        )
+    } else {
+        // Collect inputs and parameters
+        validation(
+            input_file,
+            challenges_ids,
+            participant_id,
+            community_id,
+			event_id,
+            // public_ref_dir,
+            goldstandard_dir
+        )
+        validations = validation.out.validation_file.collect()
+
+		compute_metrics(
+			validation.out.validation_status,
+			input_file,
+			challenges_ids,
+			goldstandard_dir,
+			participant_id,
+			community_id,
+			event_id
+		)
+		assessments = compute_metrics.out.ass_json.collect()
+
+		benchmark_consolidation(
+			assessments,
+			event_id,
+			outdir,
+			template_path,
+			validation_result,
+			challenges_ids
+		)
+
+		// tier 1: provisional results, emitted next to the final ones
+		if (params.progressive) {
+			provisional_metrics(
+				validation.out.validation_status,
+				input_file,
+				challenges_ids,
+				goldstandard_dir,
+				participant_id,
+				community_id,
+				event_id
+			)
+			provisional_consolidation(
+				provisional_metrics.out.ass_json.collect(),
+				event_id,
+				outdir,
+				template_path,
+				validation_result,
+				challenges_ids
+			)
+		}
+    }
 }
 
 workflow.onComplete { 